@@ -14,4 +14,4 @@ app.config["SQLALCHEMY_DATABASE_URI"] = safe_get_config("mysql/connection",
 
 from src.azureformation import (
     views,
-)
\ No newline at end of file
+)
@@ -3,9 +3,56 @@ __author__ = 'Yifu Huang'
 from src.azureformation.azureoperation.templateFramework import (
     TemplateFramework,
 )
+from src.azureformation.azureoperation.placement import (
+    CloudServicePlacement,
+    StoragePlacement,
+    SubscriptionPlacement,
+)
+from src.azureformation.azureoperation.provisionGraph import (
+    ProvisionGraph,
+)
+from src.azureformation.azureoperation.warmPool import (
+    WarmPool,
+)
+from src.azureformation.azureoperation.stopPolicy import (
+    StopPolicy,
+)
+from src.azureformation.azureoperation.subscriptionSync import (
+    SubscriptionSync,
+)
 from src.azureformation.azureoperation.utility import (
-    MDL_CLS_FUNC,
+    ASYNC_TICK,
+    TASKS,
+    TEARDOWN_CANCEL_DELAY,
+    TEARDOWN_ROLLBACK_DELAY,
+    commit_azure_log,
+    is_async_operation_pending,
+    remove_experiment_jobs,
     run_job,
+    update_experiment_azure_key,
+    update_experiment_heart_beat,
+    update_experiment_status,
+)
+from src.azureformation.database import (
+    db_adapter,
+)
+from src.azureformation.database.models import (
+    Experiment,
+)
+from src.azureformation.enum import (
+    ALOperation,
+    ALStatus,
+    AVMStatus,
+    EStatus,
+)
+from src.azureformation.log import (
+    log,
+)
+from src.azureformation.metrics import (
+    metrics,
+)
+from collections import (
+    OrderedDict,
 )
 
 
@@ -16,32 +63,190 @@ class AzureFormation:
     container, cloud service and deployment exist in azure (by sync them into database)
     For template: a template consists of a list of virtual environments, and a virtual environment
     is a virtual machine with its storage account, container, cloud service and deployment
+    For creation: storage accounts and cloud services of template are created in parallel, and a virtual machine
+    follows once both of its dependencies are ready, see ProvisionGraph
+    For warm pool: experiment claims pre-provisioned virtual environments of its template if any
+    For subscription: if azure_key_id is None, experiment is placed onto the azure subscription of its hackathon
+    with most headroom, and later operations of experiment follow the azure subscription it is placed on
+    For teardown: deployments of experiment are deleted in parallel, then cloud services and storage accounts
+    nothing else uses; experiment failed during creation is rolled back the same way
+    For cancellation: pending jobs of cancelled experiment become no-op, and what is provisioned is torn down
     Notice: It requires exclusive access when Azure performs an async operation on a deployment
     """
+    NO_CAPACITY = 'no azure subscription of hackathon [%d] has capacity for experiment [%d]'
+    NO_SUBSCRIPTION = 'experiment [%d] has neither azure subscription nor hackathon to place it on'
+    # experiments in these status could be cancelled
+    CANCELLABLE = [
+        EStatus.Init,
+        EStatus.Starting,
+        EStatus.Running,
+        EStatus.Stopped,
+        EStatus.Failed,
+    ]
+    CANCELLED = 'azure.experiment.cancelled'
 
-    def __init__(self, azure_key_id):
+    def __init__(self, azure_key_id=None):
         self.azure_key_id = azure_key_id
 
     def create(self, experiment_id):
+        experiment = db_adapter.get_object(Experiment, experiment_id)
+        # hand over pre-provisioned virtual environments if any, members of warm pool are created as usual
+        if experiment.warm_pool_id is None and WarmPool(self.azure_key_id).claim(experiment_id):
+            return
+        azure_key_id = self.azure_key_id
+        if azure_key_id is None:
+            if experiment.hackathon_id is None:
+                m = self.NO_SUBSCRIPTION % experiment_id
+                commit_azure_log(experiment_id, ALOperation.CREATE, ALStatus.FAIL, m)
+                log.error(m)
+                return
+            azure_key_id = SubscriptionPlacement(experiment.hackathon_id).place(experiment_id)
+            if azure_key_id is None:
+                m = self.NO_CAPACITY % (experiment.hackathon_id, experiment_id)
+                commit_azure_log(experiment_id, ALOperation.CREATE, ALStatus.FAIL, m)
+                log.error(m)
+                return
+        else:
+            update_experiment_azure_key(experiment_id, azure_key_id)
+        # names of template units depend on azure subscription, so template is loaded after placement
         template_framework = TemplateFramework(experiment_id)
-        for template_unit in template_framework.get_template_units():
-            # create storage account
-            run_job(MDL_CLS_FUNC[0],
-                    (self.azure_key_id, ),
-                    (experiment_id, template_unit))
+        cloud_service_placement = CloudServicePlacement(azure_key_id)
+        storage_placement = StoragePlacement(azure_key_id)
+        template_units = template_framework.get_template_units()
+        for template_unit in template_units:
+            if CloudServicePlacement.ENABLED:
+                # bin-pack virtual machines into cloud services
+                cloud_service_placement.place(experiment_id, template_unit)
+            # spread os virtual hard disks across pool of storage accounts
+            storage_placement.place(experiment_id, template_unit)
+        # create storage accounts and cloud services in parallel, virtual machines follow once both are ready
+        ProvisionGraph(azure_key_id).start(experiment_id, template_units)
 
-    def stop(self, experiment_id, need_status):
-        template_framework = TemplateFramework(experiment_id)
-        for template_unit in template_framework.get_template_units():
-            # stop virtual machine
-            run_job(MDL_CLS_FUNC[17],
-                    (self.azure_key_id, ),
-                    (experiment_id, template_unit, need_status))
+    def stop(self, experiment_id, need_status=None):
+        """
+        Stop experiment, stop mode is chosen by StopPolicy if need_status is None
+        :param experiment_id:
+        :param need_status: AVMStatus.STOPPED, AVMStatus.STOPPED_DEALLOCATED or None
+        :return:
+        """
+        azure_key_id = self.__get_azure_key_id(experiment_id)
+        if need_status is None:
+            stop_policy = StopPolicy(azure_key_id)
+            need_status = stop_policy.choose(experiment_id)
+            if need_status == AVMStatus.STOPPED:
+                # cores stay reserved only while experiment is likely to resume
+                stop_policy.schedule_downgrade(experiment_id)
+        for template_units in self.__group_by_deployment(experiment_id):
+            # stop virtual machines of a deployment in one operation
+            run_job(TASKS['VirtualMachine.stop_virtual_machines'],
+                    (azure_key_id, ),
+                    (experiment_id, template_units, need_status))
 
     def start(self, experiment_id):
+        azure_key_id = self.__get_azure_key_id(experiment_id)
+        # experiment stopped by reaper is not idle once started again
+        update_experiment_heart_beat(experiment_id)
+        for template_units in self.__group_by_deployment(experiment_id):
+            # start virtual machines of a deployment in one operation
+            run_job(TASKS['VirtualMachine.start_virtual_machines'],
+                    (azure_key_id, ),
+                    (experiment_id, template_units))
+
+    def delete(self, experiment_id):
+        azure_key_id = self.__get_azure_key_id(experiment_id)
+        if azure_key_id is None:
+            # never placed onto any azure subscription, so nothing to delete in azure
+            e = db_adapter.get_object(Experiment, experiment_id)
+            if e.status != EStatus.Cancelled:
+                update_experiment_status(experiment_id,
+                                         EStatus.Rollbacked if e.status == EStatus.Rollbacking else EStatus.Deleted)
+            return
+        if is_async_operation_pending(experiment_id):
+            # deletion would fail while azure locks deployment for an operation in flight, e.g. creation of a role
+            log.debug('delete experiment [%d]: wait for async operations in flight' % experiment_id)
+            run_job(TASKS['AzureFormation.delete'], (), (experiment_id, ), ASYNC_TICK)
+            return
+        for template_units in self.__group_by_deployment(experiment_id):
+            for template_unit in template_units:
+                commit_azure_log(experiment_id, ALOperation.DELETE_VIRTUAL_MACHINE, ALStatus.START)
+            # delete virtual machines of a deployment, deployments are deleted in parallel
+            run_job(TASKS['VirtualMachine.delete_virtual_machines'],
+                    (azure_key_id, ),
+                    (experiment_id, template_units))
+
+    def rollback(self, experiment_id):
+        """
+        Tear down what is provisioned for a failed experiment, the same way as cancel: pending jobs of experiment
+        are removed, those in flight become no-op, and deletion starts once steps in flight have settled and
+        azure has completed their async operations
+        Only the first of concurrent rollbacks of an experiment proceeds
+        :param experiment_id:
+        :return:
+        """
+        try:
+            count = Experiment.query.filter_by(id=experiment_id, status=EStatus.Failed).update(
+                {'status': EStatus.Rollbacking})
+            db_adapter.commit()
+        except Exception as e:
+            db_adapter.rollback()
+            log.error(e)
+            return
+        if count == 0:
+            return
+        log.debug('rollback experiment [%d], %d pending jobs removed' % (experiment_id,
+                                                                      remove_experiment_jobs(experiment_id)))
+        run_job(TASKS['AzureFormation.delete'], (), (experiment_id, ), TEARDOWN_ROLLBACK_DELAY)
+
+    def cancel(self, experiment_id):
+        """
+        Cancel experiment, e.g. its user has left while it is provisioning
+        Pending jobs of experiment are removed from scheduler, those in flight become no-op when they are due,
+        and resources already provisioned are torn down once steps in flight have settled
+        Return False if experiment could not be cancelled
+        :param experiment_id:
+        :return:
+        """
+        try:
+            count = Experiment.query.filter(Experiment.id == experiment_id,
+                                            Experiment.status.in_(self.CANCELLABLE)).update(
+                {'status': EStatus.Cancelled}, synchronize_session=False)
+            db_adapter.commit()
+        except Exception as e:
+            db_adapter.rollback()
+            log.error(e)
+            return False
+        if count == 0:
+            return False
+        metrics.incr(self.CANCELLED)
+        log.debug('cancel experiment [%d], %d pending jobs removed' % (experiment_id,
+                                                                    remove_experiment_jobs(experiment_id)))
+        run_job(TASKS['AzureFormation.delete'], (), (experiment_id, ), TEARDOWN_CANCEL_DELAY)
+        return True
+
+    def sync(self):
+        """
+        Sync existing resources of azure subscription into database now and every SubscriptionSync.TICK seconds,
+        so that templates could reuse them
+        :return:
+        """
+        SubscriptionSync(self.azure_key_id).schedule()
+
+    # --------------------------------------------- helper function ---------------------------------------------#
+
+    def __get_azure_key_id(self, experiment_id):
+        experiment = db_adapter.get_object(Experiment, experiment_id)
+        if experiment.azure_key_id is not None:
+            return experiment.azure_key_id
+        return self.azure_key_id
+
+    def __group_by_deployment(self, experiment_id):
+        """
+        Group template units of experiment by cloud service and deployment slot
+        :return: a list of template unit lists
+        """
         template_framework = TemplateFramework(experiment_id)
+        groups = OrderedDict()
         for template_unit in template_framework.get_template_units():
-            # start virtual machine
-            run_job(MDL_CLS_FUNC[21],
-                    (self.azure_key_id, ),
-                    (experiment_id, template_unit))
\ No newline at end of file
+            key = (template_unit.get_cloud_service_name(), template_unit.get_deployment_slot())
+            groups.setdefault(key, []).append(template_unit)
+        return groups.values()
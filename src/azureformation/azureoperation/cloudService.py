@@ -3,13 +3,18 @@ __author__ = 'Yifu Huang'
 from src.azureformation.azureoperation.resourceBase import(
     ResourceBase,
 )
+from src.azureformation.azureoperation.provisionGraph import (
+    ProvisionGraph,
+)
 from src.azureformation.azureoperation.utility import (
     AZURE_FORMATION,
-    MDL_CLS_FUNC,
+    TASKS,
     commit_azure_log,
     commit_azure_cloud_service,
     contain_azure_cloud_service,
+    is_azure_cloud_service_imported,
     delete_azure_cloud_service,
+    is_azure_cloud_service_in_use,
     run_job,
 )
 from src.azureformation.log import (
@@ -38,6 +43,17 @@ class CloudService(ResourceBase):
         '%s [%s] exist and created by %s before',
         '%s [%s] exist but not created by %s before',
     ]
+    DELETE_CLOUD_SERVICE_ERROR = [
+        '%s [%s] %s',
+        '%s [%s] wait for async fail',
+    ]
+    DELETE_CLOUD_SERVICE_INFO = [
+        '%s [%s] deleted',
+        '%s [%s] not managed by %s, kept',
+        '%s [%s] still in use, kept',
+        '%s [%s] not exist',
+        '%s [%s] still has deployments, kept',
+    ]
     NEED_COUNT = 1
 
     def __init__(self, azure_key_id):
@@ -75,6 +91,11 @@ class CloudService(ResourceBase):
                                                    label=label,
                                                    location=location)
             except Exception as e:
+                # retry transient error on scheduler instead of failing experiment
+                if self.retry_engine.retry(experiment_id, ALOperation.CREATE_CLOUD_SERVICE, CLOUD_SERVICE, name, e,
+                                           TASKS['CloudService.create_cloud_service'],
+                                           (self.azure_key_id, ), (experiment_id, template_unit)):
+                    return True
                 m = self.CREATE_CLOUD_SERVICE_ERROR[0] % (CLOUD_SERVICE, name, e.message)
                 commit_azure_log(experiment_id, ALOperation.CREATE_CLOUD_SERVICE, ALStatus.FAIL, m, 0)
                 log.error(e)
@@ -100,14 +121,65 @@ class CloudService(ResourceBase):
                 commit_azure_cloud_service(name, label, location, ACSStatus.CREATED, experiment_id)
                 commit_azure_log(experiment_id, ALOperation.CREATE_CLOUD_SERVICE, ALStatus.END, m, 2)
             log.debug(m)
-        # create virtual machine
-        run_job(MDL_CLS_FUNC[5], (self.azure_key_id, ), (experiment_id, template_unit))
+        # create virtual machines depending on cloud service, if their storage accounts are ready too
+        ProvisionGraph(self.azure_key_id).launch(experiment_id)
         return True
 
     # todo update cloud service
     def update_cloud_service(self):
         raise NotImplementedError
 
-    # todo delete cloud service
-    def delete_cloud_service(self):
-        raise NotImplementedError
\ No newline at end of file
+    def delete_cloud_service(self, experiment_id, name):
+        """
+        Delete cloud service created by azure formation once no virtual machine is created or placed in it
+        Cloud service still holding deployments (e.g. created out of azure formation) is kept
+        :return:
+        """
+        commit_azure_log(experiment_id, ALOperation.DELETE_CLOUD_SERVICE, ALStatus.START)
+        if not contain_azure_cloud_service(name) or is_azure_cloud_service_imported(name):
+            m = self.DELETE_CLOUD_SERVICE_INFO[1] % (CLOUD_SERVICE, name, AZURE_FORMATION)
+            commit_azure_log(experiment_id, ALOperation.DELETE_CLOUD_SERVICE, ALStatus.END, m, 1)
+            log.debug(m)
+            return True
+        if is_azure_cloud_service_in_use(name):
+            m = self.DELETE_CLOUD_SERVICE_INFO[2] % (CLOUD_SERVICE, name)
+            commit_azure_log(experiment_id, ALOperation.DELETE_CLOUD_SERVICE, ALStatus.END, m, 2)
+            log.debug(m)
+            return True
+        if not self.service.cloud_service_exists(name):
+            m = self.DELETE_CLOUD_SERVICE_INFO[3] % (CLOUD_SERVICE, name)
+            delete_azure_cloud_service(name)
+            commit_azure_log(experiment_id, ALOperation.DELETE_CLOUD_SERVICE, ALStatus.END, m, 3)
+            log.debug(m)
+            return True
+        if len(self.service.get_hosted_service_properties(name, True).deployments.deployments) > 0:
+            m = self.DELETE_CLOUD_SERVICE_INFO[4] % (CLOUD_SERVICE, name)
+            commit_azure_log(experiment_id, ALOperation.DELETE_CLOUD_SERVICE, ALStatus.END, m, 4)
+            log.debug(m)
+            return True
+        try:
+            result = self.service.delete_cloud_service(name)
+        except Exception as e:
+            m = self.DELETE_CLOUD_SERVICE_ERROR[0] % (CLOUD_SERVICE, name, e.message)
+            commit_azure_log(experiment_id, ALOperation.DELETE_CLOUD_SERVICE, ALStatus.FAIL, m, 0)
+            log.error(e)
+            return False
+        # query async operation status
+        run_job(TASKS['Service.query_async_operation_status'],
+                (self.azure_key_id, ),
+                (result.request_id,
+                 TASKS['CloudService.delete_cloud_service_async_true'], (self.azure_key_id, ), (experiment_id, name),
+                 TASKS['CloudService.delete_cloud_service_async_false'], (self.azure_key_id, ), (experiment_id, name)))
+        return True
+
+    def delete_cloud_service_async_true(self, experiment_id, name):
+        m = self.DELETE_CLOUD_SERVICE_INFO[0] % (CLOUD_SERVICE, name)
+        # cascade delete azure deployment left in database
+        delete_azure_cloud_service(name)
+        commit_azure_log(experiment_id, ALOperation.DELETE_CLOUD_SERVICE, ALStatus.END, m, 0)
+        log.debug(m)
+
+    def delete_cloud_service_async_false(self, experiment_id, name):
+        m = self.DELETE_CLOUD_SERVICE_ERROR[1] % (CLOUD_SERVICE, name)
+        commit_azure_log(experiment_id, ALOperation.DELETE_CLOUD_SERVICE, ALStatus.FAIL, m, 1)
+        log.error(m)
\ No newline at end of file
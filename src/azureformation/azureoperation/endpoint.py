@@ -1,29 +1,41 @@
 __author__ = 'Yifu Huang'
 
-from src.azureformation.azureoperation.utility import (
-    find_unassigned_endpoints,
-    add_endpoint_to_network_config,
-    delete_endpoint_from_network_config,
+from src.azureformation.azureoperation.service import (
+    Service,
+)
+from src.azureformation.azureoperation.networkConfigQueue import (
+    NetworkConfigQueue,
 )
 from src.azureformation.enum import (
-    VIRTUAL_MACHINE,
-    AVMStatus,
+    NCKind,
+    NCStatus,
 )
 from src.azureformation.log import (
     log,
 )
+from concurrent.futures import (
+    ThreadPoolExecutor,
+)
+import json
 
 
 class Endpoint:
     """
     Endpoint is used for dynamic management of azure endpoint on azure cloud service
+    Changes are queued per virtual machine in database, so that changes in a row, e.g. of ports added one after
+    another, are merged into one update of its network config, see NetworkConfigQueue
+    Blocking operations wait for their change in current thread, while async operations wait in a thread of
+    executor and return a future immediately
     """
     ERROR_RESULT = None
     TICK = 5
     LOOP = 200
+    WAITERS = 10
+    executor = ThreadPoolExecutor(WAITERS)
 
     def __init__(self, service):
-        self.service = service
+        # service could also be an azure key id
+        self.service = service if isinstance(service, Service) else Service(service)
 
     def assign_public_endpoints(self, cloud_service_name, deployment_slot, virtual_machine_name, private_endpoints):
         """
@@ -36,41 +48,11 @@ class Endpoint:
         :return: public_endpoints: a list of int
         """
         log.debug('private_endpoints: %s' % private_endpoints)
-        assigned_endpoints = self.service.get_assigned_endpoints(cloud_service_name)
-        log.debug('assigned_endpoints: %s' % assigned_endpoints)
-        if assigned_endpoints is None:
-            return self.ERROR_RESULT
-        # duplicate detection for public endpoint
-        public_endpoints = find_unassigned_endpoints(private_endpoints, assigned_endpoints)
-        log.debug('public_endpoints: %s' % public_endpoints)
-        deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
-        network_config = self.service.get_virtual_machine_network_config(cloud_service_name,
-                                                                         deployment_name,
-                                                                         virtual_machine_name)
-        # compose new network config to update
-        new_network_config = add_endpoint_to_network_config(network_config, public_endpoints, private_endpoints)
-        if new_network_config is None:
-            return self.ERROR_RESULT
-        try:
-            result = self.service.update_virtual_machine_network_config(cloud_service_name,
-                                                                        deployment_name,
-                                                                        virtual_machine_name,
-                                                                        new_network_config)
-        except Exception as e:
-            log.error(e)
+        change = self.__submit_and_wait(cloud_service_name, deployment_slot, virtual_machine_name, NCKind.ADD,
+                                        private_endpoints)
+        if change is None or change.status != NCStatus.END:
             return self.ERROR_RESULT
-        if not self.service.wait_for_async(result.request_id, self.TICK, self.LOOP):
-            log.error('wait for async fail')
-            return self.ERROR_RESULT
-        if not self.service.wait_for_virtual_machine(cloud_service_name,
-                                                     deployment_name,
-                                                     virtual_machine_name,
-                                                     self.TICK,
-                                                     self.LOOP,
-                                                     AVMStatus.READY_ROLE):
-            log.error('%s [%s] not ready' % (VIRTUAL_MACHINE, virtual_machine_name))
-            return self.ERROR_RESULT
-        return public_endpoints
+        return json.loads(change.public_endpoints)
 
     def release_public_endpoints(self, cloud_service_name, deployment_slot, virtual_machine_name, private_endpoints):
         """
@@ -83,30 +65,57 @@ class Endpoint:
         :return:
         """
         log.debug('private_endpoints: %s' % private_endpoints)
-        deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
-        network_config = self.service.get_virtual_machine_network_config(cloud_service_name,
-                                                                         deployment_name,
-                                                                         virtual_machine_name)
-        new_network_config = delete_endpoint_from_network_config(network_config, private_endpoints)
-        if new_network_config is None:
-            return False
+        change = self.__submit_and_wait(cloud_service_name, deployment_slot, virtual_machine_name, NCKind.REMOVE,
+                                        private_endpoints)
+        return change is not None and change.status == NCStatus.END
+
+    def assign_public_endpoints_async(self, cloud_service_name, deployment_slot, virtual_machine_name,
+                                      private_endpoints, callback=None):
+        """
+        Non-blocking version of assign_public_endpoints
+        :param cloud_service_name:
+        :param deployment_slot:
+        :param virtual_machine_name:
+        :param private_endpoints: a list of int or str
+        :param callback: called with the future once it is done
+        :return: future whose result is public_endpoints (a list of int), or None if failed
+        """
+        future = self.executor.submit(self.assign_public_endpoints, cloud_service_name, deployment_slot,
+                                      virtual_machine_name, private_endpoints)
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    def release_public_endpoints_async(self, cloud_service_name, deployment_slot, virtual_machine_name,
+                                       private_endpoints, callback=None):
+        """
+        Non-blocking version of release_public_endpoints
+        :param cloud_service_name:
+        :param deployment_slot:
+        :param virtual_machine_name:
+        :param private_endpoints: a list of int or str
+        :param callback: called with the future once it is done
+        :return: future whose result is True, or False if failed
+        """
+        future = self.executor.submit(self.release_public_endpoints, cloud_service_name, deployment_slot,
+                                      virtual_machine_name, private_endpoints)
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    # --------------------------------------------- helper function ---------------------------------------------#
+
+    def __submit_and_wait(self, cloud_service_name, deployment_slot, virtual_machine_name, kind, private_endpoints):
+        """
+        Queue change and wait for the update it is merged into
+        :return: change, or None if failed to queue or timed out
+        """
+        queue = NetworkConfigQueue(self.service)
         try:
-            result = self.service.update_virtual_machine_network_config(cloud_service_name,
-                                                                        deployment_name,
-                                                                        virtual_machine_name,
-                                                                        new_network_config)
+            deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
+            change_id = queue.submit(cloud_service_name, deployment_name, virtual_machine_name, kind,
+                                     private_endpoints)
         except Exception as e:
             log.error(e)
-            return False
-        if not self.service.wait_for_async(result.request_id, self.TICK, self.LOOP):
-            log.error('wait for async fail')
-            return False
-        if not self.service.wait_for_virtual_machine(cloud_service_name,
-                                                     deployment_name,
-                                                     virtual_machine_name,
-                                                     self.TICK,
-                                                     self.LOOP,
-                                                     AVMStatus.READY_ROLE):
-            log.error('%s [%s] not ready' % (VIRTUAL_MACHINE, virtual_machine_name))
-            return False
-        return True
\ No newline at end of file
+            return None
+        return queue.wait(change_id, self.TICK, self.LOOP)
@@ -0,0 +1,308 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.database import (
+    db_adapter,
+)
+from src.azureformation.database.models import (
+    AzureResourceChange,
+)
+from src.azureformation.enum import (
+    STORAGE_ACCOUNT,
+    CLOUD_SERVICE,
+    DEPLOYMENT,
+)
+from src.azureformation.functions import (
+    safe_get_config,
+)
+from src.azureformation.log import (
+    log,
+)
+from src.azureformation.metrics import (
+    metrics,
+)
+from datetime import (
+    datetime,
+    timedelta,
+)
+from sqlalchemy.exc import (
+    IntegrityError,
+)
+from threading import (
+    Lock,
+)
+import time
+
+
+class Inventory(object):
+    """
+    In-process index of resources of one azure subscription, which answers existence queries of Service locally
+    Storage accounts and cloud services are indexed by bulk list calls, and deployments and virtual machines of a
+    cloud service by one detailed get of it on first query; each is refreshed once older than TTL
+    Our own mutations mark what they touch as unknown, again when their async operations complete, and unknown
+    entries are answered by azure until Service records the answer
+    Index is kept in process, while mutations are published in database, so that an entry is not answered from
+    an index refreshed before another worker process last mutated its resource
+    Return None from a query means unknown, and the caller should ask azure
+    """
+    ENABLED = safe_get_config("azure.inventory.enabled", True)
+    TTL = safe_get_config("azure.inventory.ttl", 300)
+    HIT = 'azure.inventory.hit'
+    MISS = 'azure.inventory.miss'
+    instances = {}
+    instances_lock = Lock()
+
+    @classmethod
+    def get(cls, azure_key_id):
+        """
+        Return the shared inventory of given azure key, None if disabled
+        :param azure_key_id:
+        :return:
+        """
+        if not cls.ENABLED:
+            return None
+        with cls.instances_lock:
+            if azure_key_id not in cls.instances:
+                cls.instances[azure_key_id] = Inventory(azure_key_id)
+            return cls.instances[azure_key_id]
+
+    def __init__(self, azure_key_id):
+        self.azure_key_id = azure_key_id
+        self.lock = Lock()
+        self.storage_accounts = set()
+        self.storage_accounts_time = None
+        self.unknown_storage_accounts = set()
+        self.cloud_services = set()
+        self.cloud_services_time = None
+        self.unknown_cloud_services = set()
+        # cloud service name -> (time, {lower case deployment slot: (deployment name, set of virtual machine names)})
+        self.details = {}
+        # request id of async operation in progress -> (resource type, name)
+        self.pending = {}
+        # (resource type, name) -> time Service recorded an answer of azure, which is as fresh as a refresh
+        self.answers = {}
+
+    # ---------------------------------------- query ---------------------------------------- #
+
+    def storage_account_exists(self, service, name):
+        with self.lock:
+            if name in self.unknown_storage_accounts:
+                return self.__miss()
+            refresh_time = self.__get_refresh_time(self.storage_accounts_time, STORAGE_ACCOUNT, name)
+            exists = name in self.storage_accounts
+        if self.__is_fresh(refresh_time):
+            if self.__is_changed(name, refresh_time, STORAGE_ACCOUNT):
+                return self.__miss()
+            return self.__hit(exists)
+        try:
+            names = set(s.service_name for s in service.list_storage_accounts().storage_services)
+        except Exception as e:
+            log.error(e)
+            return self.__miss()
+        with self.lock:
+            self.storage_accounts = names
+            self.storage_accounts_time = time.time()
+            return self.__hit(name in self.storage_accounts)
+
+    def cloud_service_exists(self, service, name):
+        with self.lock:
+            if name in self.unknown_cloud_services:
+                return self.__miss()
+            refresh_time = self.__get_refresh_time(self.cloud_services_time, CLOUD_SERVICE, name)
+            exists = name in self.cloud_services
+        if self.__is_fresh(refresh_time):
+            if self.__is_changed(name, refresh_time, CLOUD_SERVICE):
+                return self.__miss()
+            return self.__hit(exists)
+        try:
+            names = set(s.service_name for s in service.list_hosted_services().hosted_services)
+        except Exception as e:
+            log.error(e)
+            return self.__miss()
+        with self.lock:
+            self.cloud_services = names
+            self.cloud_services_time = time.time()
+            return self.__hit(name in self.cloud_services)
+
+    def deployment_exists(self, service, cloud_service_name, deployment_slot):
+        detail = self.__get_detail(service, cloud_service_name)
+        if detail is None:
+            return self.__miss()
+        return self.__hit(deployment_slot.lower() in detail)
+
+    def virtual_machine_exists(self, service, cloud_service_name, deployment_name, virtual_machine_name):
+        detail = self.__get_detail(service, cloud_service_name)
+        if detail is None:
+            return self.__miss()
+        for name, virtual_machine_names in detail.values():
+            if name == deployment_name:
+                return self.__hit(virtual_machine_name in virtual_machine_names)
+        return self.__hit(False)
+
+    # ---------------------------------------- update ---------------------------------------- #
+
+    def set_storage_account(self, name, exists):
+        with self.lock:
+            self.unknown_storage_accounts.discard(name)
+            self.answers[(STORAGE_ACCOUNT, name)] = time.time()
+            if exists:
+                self.storage_accounts.add(name)
+            else:
+                self.storage_accounts.discard(name)
+
+    def set_cloud_service(self, name, exists):
+        with self.lock:
+            self.unknown_cloud_services.discard(name)
+            self.answers[(CLOUD_SERVICE, name)] = time.time()
+            if exists:
+                self.cloud_services.add(name)
+            else:
+                self.cloud_services.discard(name)
+                self.details[name] = (time.time(), {})
+
+    def set_deployment(self, cloud_service_name, deployment_slot, deployment):
+        """
+        Record deployment of given slot in indexed detail of cloud service, if any
+        Nothing is recorded if detail is not indexed, since other deployments of cloud service are unknown
+        :param deployment: Deployment, None if not found
+        """
+        with self.lock:
+            if cloud_service_name not in self.details:
+                return
+            detail = self.details[cloud_service_name][1]
+            if deployment is None:
+                detail.pop(deployment_slot.lower(), None)
+            else:
+                detail[deployment_slot.lower()] = (deployment.name,
+                                                   set(r.role_name for r in deployment.role_list.roles))
+
+    def track(self, request_id, resource_type, name):
+        """
+        Mark resource touched by a mutation as unknown, and again once its async operation completes
+        :param request_id: request id of async operation, None if mutation is sync
+        :param resource_type: STORAGE_ACCOUNT, CLOUD_SERVICE or DEPLOYMENT in enum.py
+        :param name: name of storage account or cloud service, cloud service name for deployment
+        :return:
+        """
+        self.__invalidate(resource_type, name)
+        self.publish(resource_type, name)
+        if request_id is not None:
+            with self.lock:
+                self.pending[request_id] = (resource_type, name)
+
+    def settle(self, request_id):
+        """
+        Async operation of given request id completed, so what it touched is unknown again
+        """
+        with self.lock:
+            resource = self.pending.pop(request_id, None)
+        if resource is not None:
+            self.__invalidate(*resource)
+            self.publish(*resource)
+
+    def publish(self, resource_type, name):
+        """
+        Record mutation of resource in database for inventories of other worker processes
+        Changes older than TTL are purged, as no fresh index predates them
+        """
+        now = datetime.utcnow()
+        try:
+            db_adapter.delete_all_objects(AzureResourceChange,
+                                          AzureResourceChange.azure_key_id == self.azure_key_id,
+                                          AzureResourceChange.change_time < now - timedelta(seconds=self.TTL))
+            change = db_adapter.find_first_object_by(AzureResourceChange,
+                                                     azure_key_id=self.azure_key_id,
+                                                     resource_type=resource_type,
+                                                     name=name)
+            if change is None:
+                db_adapter.add_object_kwargs(AzureResourceChange,
+                                             azure_key_id=self.azure_key_id,
+                                             resource_type=resource_type,
+                                             name=name,
+                                             change_time=now)
+            else:
+                db_adapter.update_object(change, change_time=now)
+            db_adapter.commit()
+        except IntegrityError:
+            # published by another worker in the meantime, which is as recent
+            db_adapter.rollback()
+        except Exception as e:
+            db_adapter.rollback()
+            log.error(e)
+
+    # --------------------------------------------- helper function ---------------------------------------------#
+
+    def __invalidate(self, resource_type, name):
+        with self.lock:
+            if resource_type == STORAGE_ACCOUNT:
+                self.unknown_storage_accounts.add(name)
+            elif resource_type == CLOUD_SERVICE:
+                self.unknown_cloud_services.add(name)
+                self.details.pop(name, None)
+            elif resource_type == DEPLOYMENT:
+                self.details.pop(name, None)
+
+    def __get_detail(self, service, cloud_service_name):
+        """
+        Return {deployment slot: (deployment name, set of virtual machine names)} of cloud service, None if unknown
+        """
+        with self.lock:
+            refresh_time, detail = self.details.get(cloud_service_name, (None, None))
+            # no detail is needed of cloud service known not to exist
+            absent = cloud_service_name not in self.unknown_cloud_services and \
+                cloud_service_name not in self.cloud_services
+            cloud_services_time = self.cloud_services_time
+        if self.__is_fresh(refresh_time) and \
+                not self.__is_changed(cloud_service_name, refresh_time, CLOUD_SERVICE, DEPLOYMENT):
+            return detail
+        if absent and self.__is_fresh(cloud_services_time) and \
+                not self.__is_changed(cloud_service_name, cloud_services_time, CLOUD_SERVICE):
+            return {}
+        try:
+            properties = service.get_hosted_service_properties(cloud_service_name, True)
+        except Exception as e:
+            if e.message != service.NOT_FOUND:
+                log.error(e)
+                return None
+            self.set_cloud_service(cloud_service_name, False)
+            return {}
+        detail = {}
+        for deployment in properties.deployments.deployments:
+            detail[deployment.deployment_slot.lower()] = (deployment.name,
+                                                  set(r.role_name for r in deployment.role_list.roles))
+        with self.lock:
+            self.details[cloud_service_name] = (time.time(), detail)
+        return detail
+
+    def __get_refresh_time(self, list_time, resource_type, name):
+        """
+        Time name was last listed or answered by azure, None if never listed
+        """
+        if list_time is None:
+            return None
+        return max(list_time, self.answers.get((resource_type, name), list_time))
+
+    def __is_fresh(self, refresh_time):
+        return refresh_time is not None and time.time() - refresh_time < self.TTL
+
+    def __is_changed(self, name, refresh_time, *resource_types):
+        """
+        Whether resource is mutated by any worker process since index was refreshed, True if unsure
+        """
+        try:
+            return db_adapter.count(AzureResourceChange,
+                                    AzureResourceChange.azure_key_id == self.azure_key_id,
+                                    AzureResourceChange.resource_type.in_(resource_types),
+                                    AzureResourceChange.name == name,
+                                    AzureResourceChange.change_time >=
+                                    datetime.utcfromtimestamp(refresh_time)) > 0
+        except Exception as e:
+            log.error(e)
+            return True
+
+    def __hit(self, exists):
+        metrics.incr(self.HIT)
+        return exists
+
+    def __miss(self):
+        metrics.incr(self.MISS)
+        return None
@@ -0,0 +1,250 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.service import (
+    Service,
+)
+from src.azureformation.azureoperation.utility import (
+    VIRTUAL_MACHINE_TICK,
+    TASKS,
+    find_unassigned_endpoints,
+    add_endpoint_to_network_config,
+    delete_endpoint_from_network_config,
+    run_job,
+)
+from src.azureformation.database import (
+    db_adapter,
+)
+from src.azureformation.database.models import (
+    AzureNetworkConfigChange,
+)
+from src.azureformation.enum import (
+    AVMStatus,
+    NCKind,
+    NCStatus,
+)
+from src.azureformation.functions import (
+    safe_get_config,
+)
+from src.azureformation.log import (
+    log,
+)
+from src.azureformation.metrics import (
+    metrics,
+)
+from datetime import (
+    datetime,
+    timedelta,
+)
+import json
+import time
+
+
+class NetworkConfigQueue:
+    """
+    Per virtual machine queue of network config changes in database, which are merged into one update_role call
+    Changes submitted in a row are flushed together by one scheduler job LINGER seconds after the last of them,
+    and those submitted while an update is in flight are flushed together once it completes, since azure locks
+    the deployment for every update anyway
+    Any process could flush or complete an update, and a flush left in flight longer than FLIGHT_TTL (e.g. by
+    a restart) fails its changes
+    """
+    LINGER = safe_get_config("azure.network_config_queue.linger", 1)
+    FLIGHT_TTL = safe_get_config("azure.network_config_queue.flight_ttl", 1000)
+    FLUSH_JOB_ID = 'azure-network-config-flush-%s-%s-%s-%s'
+    FLUSHED = 'azure.network_config_queue.flushed'
+    COALESCED = 'azure.network_config_queue.coalesced'
+
+    def __init__(self, service):
+        # service could also be an azure key id, which is how scheduled jobs construct queue
+        self.service = service if isinstance(service, Service) else Service(service)
+
+    def submit(self, cloud_service_name, deployment_name, virtual_machine_name, kind, private_endpoints):
+        """
+        Queue change of network config of virtual machine
+        :param cloud_service_name:
+        :param deployment_name:
+        :param virtual_machine_name:
+        :param kind: NCKind.ADD or NCKind.REMOVE
+        :param private_endpoints: a list of int or str
+        :return: id of change
+        """
+        change = db_adapter.add_object_kwargs(AzureNetworkConfigChange,
+                                              azure_key_id=self.service.azure_key_id,
+                                              cloud_service_name=cloud_service_name,
+                                              deployment_name=deployment_name,
+                                              virtual_machine_name=virtual_machine_name,
+                                              kind=kind,
+                                              private_endpoints=json.dumps(private_endpoints),
+                                              status=NCStatus.PENDING)
+        self.__schedule_flush(cloud_service_name, deployment_name, virtual_machine_name, self.LINGER)
+        return change.id
+
+    def wait(self, change_id, second_per_loop, loop):
+        """
+        Wait for change to be flushed and completed, up to second_per_loop * loop
+        :return: change, or None if timed out
+        """
+        for count in range(loop + 1):
+            change = db_adapter.get_object(AzureNetworkConfigChange, change_id)
+            if change.status in [NCStatus.END, NCStatus.FAIL]:
+                return change
+            log.debug('wait for network config change [%d] loop count [%d]' % (change_id, count))
+            time.sleep(second_per_loop)
+        log.error('Timed out waiting for network config change to complete.')
+        return None
+
+    def flush(self, cloud_service_name, deployment_name, virtual_machine_name):
+        """
+        Apply all pending changes of virtual machine in one update_role call, unless an update is in flight
+        """
+        try:
+            changes = self.__lock_changes(cloud_service_name, deployment_name, virtual_machine_name)
+            deadline = datetime.utcnow() - timedelta(seconds=self.FLIGHT_TTL)
+            in_flight = [c for c in changes if c.status == NCStatus.FLUSHING]
+            if any(c.last_modify_time > deadline for c in in_flight):
+                # flushed again once update in flight completes
+                db_adapter.commit()
+                return
+            for change in in_flight:
+                log.warn('network config queue: update of virtual machine [%s] not completed in %d seconds' %
+                         (virtual_machine_name, self.FLIGHT_TTL))
+                self.__set_status(change, NCStatus.FAIL)
+            changes = [c for c in changes if c.status == NCStatus.PENDING]
+            if len(changes) == 0:
+                db_adapter.commit()
+                return
+            try:
+                network_config, results = self.compose(cloud_service_name, deployment_name, virtual_machine_name,
+                                                       changes)
+            except Exception as e:
+                log.error(e)
+                for change in changes:
+                    self.__set_status(change, NCStatus.FAIL)
+                db_adapter.commit()
+                return
+            for change, result in zip(changes, results):
+                change.public_endpoints = None if result is None else json.dumps(result)
+                self.__set_status(change, NCStatus.FLUSHING)
+            db_adapter.commit()
+        except Exception as e:
+            db_adapter.rollback()
+            log.error(e)
+            return
+        metrics.incr(self.FLUSHED)
+        metrics.incr(self.COALESCED, len(changes) - 1)
+        log.debug('network config queue: flush %d changes of virtual machine [%s]' %
+                  (len(changes), virtual_machine_name))
+        ids = [change.id for change in changes]
+        try:
+            operation = self.service.update_virtual_machine_network_config(cloud_service_name,
+                                                                           deployment_name,
+                                                                           virtual_machine_name,
+                                                                           network_config)
+        except Exception as e:
+            log.error(e)
+            self.__complete(AzureNetworkConfigChange.id.in_(ids), NCStatus.FAIL,
+                            cloud_service_name, deployment_name, virtual_machine_name)
+            return
+        AzureNetworkConfigChange.query.filter(AzureNetworkConfigChange.id.in_(ids)).update(
+            {'request_id': operation.request_id}, synchronize_session=False)
+        db_adapter.commit()
+        # query async operation status
+        run_job(TASKS['Service.query_async_operation_status'],
+                (self.service.azure_key_id, ),
+                (operation.request_id,
+                 TASKS['NetworkConfigQueue.flush_async_true'], (self.service.azure_key_id, ),
+                 (operation.request_id, cloud_service_name, deployment_name, virtual_machine_name),
+                 TASKS['NetworkConfigQueue.flush_async_false'], (self.service.azure_key_id, ),
+                 (operation.request_id, cloud_service_name, deployment_name, virtual_machine_name)))
+
+    def flush_async_true(self, request_id, cloud_service_name, deployment_name, virtual_machine_name):
+        # query virtual machine status
+        run_job(TASKS['Service.query_virtual_machine_status'],
+                (self.service.azure_key_id, ),
+                (cloud_service_name, deployment_name, virtual_machine_name, AVMStatus.READY_ROLE,
+                 TASKS['NetworkConfigQueue.flush_vm_true'], (self.service.azure_key_id, ),
+                 (request_id, cloud_service_name, deployment_name, virtual_machine_name)),
+                VIRTUAL_MACHINE_TICK)
+
+    def flush_async_false(self, request_id, cloud_service_name, deployment_name, virtual_machine_name):
+        log.error('wait for async fail')
+        self.__complete(AzureNetworkConfigChange.request_id == request_id, NCStatus.FAIL,
+                        cloud_service_name, deployment_name, virtual_machine_name)
+
+    def flush_vm_true(self, request_id, cloud_service_name, deployment_name, virtual_machine_name):
+        self.__complete(AzureNetworkConfigChange.request_id == request_id, NCStatus.END,
+                        cloud_service_name, deployment_name, virtual_machine_name)
+
+    def compose(self, cloud_service_name, deployment_name, virtual_machine_name, changes):
+        """
+        Apply changes in order to current network config of virtual machine
+        Public endpoints are assigned once for all changes, so that they do not collide with each other
+        :return: (new_network_config, results): public endpoints assigned by each change, None for NCKind.REMOVE
+        """
+        network_config = self.service.get_virtual_machine_network_config(cloud_service_name,
+                                                                         deployment_name,
+                                                                         virtual_machine_name)
+        assigned_endpoints = None
+        results = []
+        for change in changes:
+            private_endpoints = json.loads(change.private_endpoints)
+            log.debug('private_endpoints: %s' % private_endpoints)
+            if change.kind == NCKind.ADD:
+                if assigned_endpoints is None:
+                    assigned_endpoints = self.service.get_assigned_endpoints(cloud_service_name)
+                    log.debug('assigned_endpoints: %s' % assigned_endpoints)
+                # duplicate detection for public endpoint
+                public_endpoints = find_unassigned_endpoints(private_endpoints, assigned_endpoints)
+                log.debug('public_endpoints: %s' % public_endpoints)
+                assigned_endpoints = assigned_endpoints + public_endpoints
+                network_config = add_endpoint_to_network_config(network_config, public_endpoints,
+                                                                private_endpoints)
+                results.append(public_endpoints)
+            else:
+                network_config = delete_endpoint_from_network_config(network_config, private_endpoints)
+                results.append(None)
+        return network_config, results
+
+    # --------------------------------------------- helper function ---------------------------------------------#
+
+    def __lock_changes(self, cloud_service_name, deployment_name, virtual_machine_name):
+        """
+        Return changes of virtual machine not completed yet with row lock, in order of submission
+        """
+        return AzureNetworkConfigChange.query.filter_by(azure_key_id=self.service.azure_key_id,
+                                                        cloud_service_name=cloud_service_name,
+                                                        deployment_name=deployment_name,
+                                                        virtual_machine_name=virtual_machine_name) \
+            .filter(AzureNetworkConfigChange.status.in_([NCStatus.PENDING, NCStatus.FLUSHING])) \
+            .order_by(AzureNetworkConfigChange.id).with_for_update().all()
+
+    def __set_status(self, change, status):
+        change.status = status
+        change.last_modify_time = datetime.utcnow()
+
+    def __complete(self, criterion, status, cloud_service_name, deployment_name, virtual_machine_name):
+        """
+        Resolve changes in flight, and flush changes queued in the meantime
+        Changes no longer in flight, e.g. expired before their update completed, are left as they are
+        """
+        AzureNetworkConfigChange.query.filter(criterion,
+                                              AzureNetworkConfigChange.status == NCStatus.FLUSHING).update(
+            {'status': status, 'last_modify_time': datetime.utcnow()}, synchronize_session=False)
+        db_adapter.commit()
+        if db_adapter.count_by(AzureNetworkConfigChange,
+                               azure_key_id=self.service.azure_key_id,
+                               cloud_service_name=cloud_service_name,
+                               deployment_name=deployment_name,
+                               virtual_machine_name=virtual_machine_name,
+                               status=NCStatus.PENDING) > 0:
+            self.__schedule_flush(cloud_service_name, deployment_name, virtual_machine_name, 0)
+
+    def __schedule_flush(self, cloud_service_name, deployment_name, virtual_machine_name, second):
+        # one flush job per virtual machine, which a later change pushes back
+        job_id = self.FLUSH_JOB_ID % (self.service.azure_key_id, cloud_service_name, deployment_name,
+                                      virtual_machine_name)
+        run_job(TASKS['NetworkConfigQueue.flush'],
+                (self.service.azure_key_id, ),
+                (cloud_service_name, deployment_name, virtual_machine_name),
+                second,
+                job_id)
@@ -0,0 +1,279 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.service import (
+    Service,
+)
+from src.azureformation.azureoperation.rateLimiter import (
+    RateLimiter,
+)
+from src.azureformation.azureoperation.templateUnit import (
+    TemplateUnit,
+)
+from src.azureformation.azureoperation.virtualMachine import (
+    VirtualMachine,
+)
+from src.azureformation.azureoperation.utility import (
+    contain_azure_cloud_service,
+    contain_azure_storage_account,
+    commit_azure_virtual_hard_disk,
+    commit_azure_virtual_machine_placement,
+    count_azure_virtual_hard_disk,
+    get_azure_cloud_service_usage,
+    get_subscription_suffix,
+    get_virtual_machine_name,
+    load_template_from_experiment,
+    update_experiment_azure_key,
+)
+from src.azureformation.database import (
+    db_adapter,
+)
+from src.azureformation.database.models import (
+    Experiment,
+    HackathonAzureKey,
+    AzureInFlightOperation,
+)
+from src.azureformation.enum import (
+    EStatus,
+)
+from src.azureformation.functions import (
+    safe_get_config,
+)
+from src.azureformation.log import (
+    log,
+)
+from datetime import (
+    datetime,
+    timedelta,
+)
+import copy
+
+
+class SubscriptionPlacement:
+    """
+    Place experiments of a hackathon onto its azure subscriptions according to live capacity
+    Headroom of a subscription is its remaining quota (cores, cloud services, storage accounts) minus cores
+    experiments still starting on it will take, discounted by its in-flight async operations
+    Storage accounts and cloud services already created are reused, so they are not needed again
+    """
+    CORES = 'cores'
+    CLOUD_SERVICES = 'cloud services'
+    STORAGE_ACCOUNTS = 'storage accounts'
+    VIRTUAL_ENVIRONMENTS = 'virtual_environments'
+
+    def __init__(self, hackathon_id):
+        self.hackathon_id = hackathon_id
+
+    def place(self, experiment_id):
+        """
+        Choose azure key with most headroom for experiment and record it on experiment
+        Return None if no azure key has enough capacity
+        :param experiment_id:
+        :return: azure_key_id
+        """
+        template_units = map(TemplateUnit, load_template_from_experiment(experiment_id)[self.VIRTUAL_ENVIRONMENTS])
+        best_azure_key_id = None
+        best_score = 0
+        for hackathon_azure_key in db_adapter.find_all_objects_by(HackathonAzureKey, hackathon_id=self.hackathon_id):
+            azure_key_id = hackathon_azure_key.azure_key_id
+            need = self.get_need(template_units, azure_key_id)
+            headroom = self.get_headroom(azure_key_id, need)
+            if headroom is None:
+                continue
+            # fraction of experiments of this size the subscription could still hold, experiment needing nothing
+            # (e.g. template without virtual environments) fits any subscription
+            ratios = [float(headroom[k]) / need[k] for k in need if need[k] > 0]
+            ratio = min(ratios) if len(ratios) > 0 else 1.0
+            score = ratio / (1.0 + float(self.__count_in_flight(azure_key_id)) / RateLimiter.MAX_IN_FLIGHT)
+            log.debug('placement: azure key [%d] headroom %s score %.2f' % (azure_key_id, headroom, score))
+            if ratio >= 1 and score > best_score:
+                best_azure_key_id = azure_key_id
+                best_score = score
+        if best_azure_key_id is not None:
+            update_experiment_azure_key(experiment_id, best_azure_key_id)
+        return best_azure_key_id
+
+    def get_capacity(self, template_units, azure_key_id):
+        """
+        Number of experiments of template units the subscription could still hold
+        :param template_units: a list of TemplateUnit
+        :param azure_key_id:
+        :return:
+        """
+        need = self.get_need(template_units, azure_key_id)
+        headroom = self.get_headroom(azure_key_id, need)
+        if headroom is None or need[self.CORES] == 0:
+            return 0
+        # storage accounts and cloud services are shared by experiments
+        if headroom[self.CLOUD_SERVICES] < need[self.CLOUD_SERVICES] or \
+                headroom[self.STORAGE_ACCOUNTS] < need[self.STORAGE_ACCOUNTS]:
+            return 0
+        return max(0, headroom[self.CORES] / need[self.CORES])
+
+    def get_need(self, template_units, azure_key_id):
+        """
+        Resources needed by template units on given azure subscription
+        :param template_units: a list of TemplateUnit, their names are not changed
+        :param azure_key_id:
+        :return: a dict of resource -> count
+        """
+        suffix = get_subscription_suffix(self.hackathon_id, azure_key_id)
+        cloud_service_names = set()
+        storage_account_names = set()
+        for template_unit in template_units:
+            t = TemplateUnit(copy.deepcopy(template_unit.virtual_environment))
+            if suffix is not None:
+                t.add_name_suffix(suffix)
+            if not contain_azure_cloud_service(t.get_cloud_service_name()):
+                cloud_service_names.add(t.get_cloud_service_name())
+            if not contain_azure_storage_account(t.get_storage_account_name()):
+                storage_account_names.add(t.get_storage_account_name())
+        return {
+            self.CORES: sum(VirtualMachine.SIZE_CORE_MAP[t.get_virtual_machine_size().lower()]
+                            for t in template_units),
+            self.CLOUD_SERVICES: len(cloud_service_names),
+            self.STORAGE_ACCOUNTS: len(storage_account_names),
+        }
+
+    def get_headroom(self, azure_key_id, need):
+        """
+        Return None if subscription could not be queried
+        :param azure_key_id:
+        :param need: resources needed by one experiment, used to estimate cores of experiments still starting
+        :return: a dict of resource -> count
+        """
+        try:
+            subscription = Service(azure_key_id).get_subscription()
+        except Exception as e:
+            log.error(e)
+            return None
+        # quota of experiments still starting is not fully reflected in subscription yet
+        starting = db_adapter.count_by(Experiment, azure_key_id=azure_key_id, status=EStatus.Starting)
+        return {
+            self.CORES: subscription.max_core_count - subscription.current_core_count -
+            starting * need[self.CORES],
+            self.CLOUD_SERVICES: subscription.max_hosted_services - subscription.current_hosted_services,
+            self.STORAGE_ACCOUNTS: subscription.max_storage_accounts - subscription.current_storage_accounts,
+        }
+
+    # --------------------------------------------- helper function ---------------------------------------------#
+
+    def __count_in_flight(self, azure_key_id):
+        return db_adapter.count(AzureInFlightOperation,
+                                AzureInFlightOperation.azure_key_id == azure_key_id,
+                                AzureInFlightOperation.create_time >
+                                datetime.utcnow() - timedelta(seconds=RateLimiter.IN_FLIGHT_TTL))
+
+
+class StoragePlacement:
+    """
+    Spread os virtual hard disks of virtual machines across a pool of storage accounts, so that boot storms
+    are not bound by iops of a single storage account
+    Pool of a template storage account is itself followed by storage accounts with index suffix, which are
+    created on demand by StorageAccount.create_storage_account
+    Disks are counted per storage account in database, a disk is recorded when it is placed
+    """
+    # standard storage account: 20000 iops, 500 iops per standard disk
+    MAX_DISKS = safe_get_config("azure.storage_placement.max_disks", 40)
+    MAX_ACCOUNTS = safe_get_config("azure.storage_placement.max_accounts", 10)
+
+    def __init__(self, azure_key_id):
+        self.azure_key_id = azure_key_id
+
+    def place(self, experiment_id, template_unit):
+        """
+        Choose storage account for os virtual hard disk of template unit, and set it on template unit
+        Existing storage account with fewest disks is preferred, a new one is added to pool only when all
+        existing ones are full
+        :param experiment_id:
+        :param template_unit:
+        :return: storage account name
+        """
+        # vm image does not use os virtual hard disk of template
+        if template_unit.is_vm_image():
+            return template_unit.get_storage_account_name()
+        best_name = None
+        best_count = None
+        for name in self.get_pool(template_unit.get_storage_account_name()):
+            count = count_azure_virtual_hard_disk(name)
+            if not contain_azure_storage_account(name):
+                # not created yet, use it only if all created ones are full
+                if best_name is None or best_count >= self.MAX_DISKS:
+                    best_name, best_count = name, count
+                break
+            if best_name is None or count < best_count:
+                best_name, best_count = name, count
+        if best_count >= self.MAX_DISKS:
+            log.warn('storage placement: pool of %s is full, %s already has %d disks' %
+                     (template_unit.get_storage_account_name(), best_name, best_count))
+        template_unit.set_storage_account_name(best_name)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
+        commit_azure_virtual_hard_disk(best_name,
+                                       template_unit.get_cloud_service_name(),
+                                       virtual_machine_name,
+                                       experiment_id)
+        log.debug('storage placement: %s placed in %s with %d disks' % (virtual_machine_name, best_name, best_count))
+        return best_name
+
+    def get_pool(self, base):
+        """
+        Names of storage accounts in pool of given storage account, e.g. base, base1, base2 ...
+        :param base:
+        :return:
+        """
+        pool = [base]
+        for i in range(1, self.MAX_ACCOUNTS):
+            index = str(i)
+            pool.append(base[:TemplateUnit.STORAGE_ACCOUNT_NAME_LENGTH - len(index)] + index)
+        return pool
+
+
+class CloudServicePlacement:
+    """
+    Bin-pack virtual machines into cloud services, instead of one cloud service per template unit name
+    Pool of a template cloud service is itself followed by cloud services with index suffix, a virtual machine
+    goes to the first one whose deployment still has room for its role and input endpoints, so that few
+    cloud services are created and each deployment holds a bounded number of roles
+    Placements are recorded in database, which TemplateFramework follows afterwards
+    """
+    ENABLED = safe_get_config("azure.cloud_service_placement.enabled", False)
+    # azure allows 50 roles per deployment and 150 input endpoints per cloud service
+    MAX_ROLES = safe_get_config("azure.cloud_service_placement.max_roles", 50)
+    MAX_ENDPOINTS = safe_get_config("azure.cloud_service_placement.max_endpoints", 150)
+    MAX_CLOUD_SERVICES = safe_get_config("azure.cloud_service_placement.max_cloud_services", 20)
+
+    def __init__(self, azure_key_id):
+        self.azure_key_id = azure_key_id
+
+    def place(self, experiment_id, template_unit):
+        """
+        Choose cloud service for virtual machine of template unit by first fit, and set it on template unit
+        Template cloud service is kept if its whole pool is full
+        :param experiment_id:
+        :param template_unit:
+        :return: cloud service name
+        """
+        base = template_unit.get_cloud_service_name()
+        deployment_slot = template_unit.get_deployment_slot()
+        endpoint_count = template_unit.get_input_endpoint_count()
+        name = base
+        for candidate in self.get_pool(base):
+            roles, endpoints = get_azure_cloud_service_usage(candidate, deployment_slot)
+            if roles + 1 <= self.MAX_ROLES and endpoints + endpoint_count <= self.MAX_ENDPOINTS:
+                name = candidate
+                break
+        else:
+            log.warn('cloud service placement: pool of %s is full' % base)
+        template_unit.set_cloud_service_name(name)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
+        commit_azure_virtual_machine_placement(name, deployment_slot, virtual_machine_name, endpoint_count,
+                                               experiment_id)
+        log.debug('cloud service placement: %s placed in %s' % (virtual_machine_name, name))
+        return name
+
+    def get_pool(self, base):
+        """
+        Names of cloud services in pool of given cloud service, e.g. base, base-1, base-2 ...
+        :param base:
+        :return:
+        """
+        return [base] + [TemplateUnit.CLOUD_SERVICE_NAME_BASE % (base, i) for i in range(1, self.MAX_CLOUD_SERVICES)]
@@ -0,0 +1,124 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.templateFramework import (
+    TemplateFramework,
+)
+from src.azureformation.azureoperation.utility import (
+    TASKS,
+    get_virtual_machine_name,
+    run_job,
+)
+from src.azureformation.database import (
+    db_adapter,
+    db_session,
+)
+from src.azureformation.database.models import (
+    AzureCloudService,
+    AzureProvisionJournal,
+    AzureStorageAccount,
+    Experiment,
+)
+from src.azureformation.enum import (
+    PJStep,
+)
+from src.azureformation.log import (
+    log,
+)
+
+
+class ProvisionGraph:
+    """
+    Dependency graph of provisioning an experiment
+    Storage accounts and cloud services have no dependencies, and one shared by several template units is a single
+    node; a virtual machine depends on its cloud service and, unless created from vm image, its storage account
+    Nodes without dependencies are created in parallel, and a virtual machine is launched as soon as both of its
+    dependencies are ready, i.e. recorded in database
+    Dependencies complete concurrently, so readiness is checked under row lock of experiment, and a virtual machine
+    is launched once by recording CLOUD_SERVICE_READY as first step in its provision journal
+    """
+
+    def __init__(self, azure_key_id):
+        self.azure_key_id = azure_key_id
+
+    def compile(self, template_units):
+        """
+        Nodes without dependencies of template units
+        :param template_units: a list of TemplateUnit
+        :return: (storage_account_nodes, cloud_service_nodes): template unit of every distinct name
+        """
+        storage_account_nodes = self.__distinct([t for t in template_units if not t.is_vm_image()],
+                                                lambda t: t.get_storage_account_name())
+        cloud_service_nodes = self.__distinct(template_units, lambda t: t.get_cloud_service_name())
+        return storage_account_nodes, cloud_service_nodes
+
+    def start(self, experiment_id, template_units):
+        """
+        Create storage accounts and cloud services of template units in parallel
+        :param experiment_id:
+        :param template_units: a list of TemplateUnit
+        :return:
+        """
+        storage_account_nodes, cloud_service_nodes = self.compile(template_units)
+        for template_unit in storage_account_nodes:
+            # create storage account
+            run_job(TASKS['StorageAccount.create_storage_account'],
+                    (self.azure_key_id, ), (experiment_id, template_unit))
+        for template_unit in cloud_service_nodes:
+            # create cloud service
+            run_job(TASKS['CloudService.create_cloud_service'], (self.azure_key_id, ), (experiment_id, template_unit))
+
+    def launch(self, experiment_id):
+        """
+        Create virtual machines of experiment whose dependencies are ready, called once a dependency is ready
+        :param experiment_id:
+        :return: count of virtual machines launched
+        """
+        template_units = TemplateFramework(experiment_id).get_template_units()
+        # names are looked up before locking, since db adapter commits on every call
+        virtual_machine_names = [get_virtual_machine_name(experiment_id, t) for t in template_units]
+        launched = []
+        try:
+            Experiment.query.filter_by(id=experiment_id).with_for_update().first()
+            launched_names = set(j.virtual_machine_name for j in
+                                 AzureProvisionJournal.query.filter_by(experiment_id=experiment_id).all())
+            storage_account_names = self.__find_names(AzureStorageAccount,
+                                                      [t.get_storage_account_name() for t in template_units])
+            cloud_service_names = self.__find_names(AzureCloudService,
+                                                    [t.get_cloud_service_name() for t in template_units])
+            for template_unit, virtual_machine_name in zip(template_units, virtual_machine_names):
+                if virtual_machine_name in launched_names:
+                    continue
+                if template_unit.get_cloud_service_name() not in cloud_service_names:
+                    continue
+                if not template_unit.is_vm_image() and \
+                        template_unit.get_storage_account_name() not in storage_account_names:
+                    continue
+                db_session.add(AzureProvisionJournal(experiment_id=experiment_id,
+                                                     virtual_machine_name=virtual_machine_name,
+                                                     step=PJStep.CLOUD_SERVICE_READY))
+                launched.append(template_unit)
+            db_adapter.commit()
+        except Exception:
+            db_adapter.rollback()
+            raise
+        for template_unit in launched:
+            log.debug('provision graph: launch virtual machine of %s in experiment [%d]' %
+                      (template_unit.get_cloud_service_name(), experiment_id))
+            # create virtual machine
+            run_job(TASKS['VirtualMachine.create_virtual_machine'],
+                    (self.azure_key_id, ), (experiment_id, template_unit))
+        return len(launched)
+
+    # --------------------------------------------- helper function ---------------------------------------------#
+
+    def __distinct(self, template_units, key):
+        nodes = []
+        keys = set()
+        for template_unit in template_units:
+            if key(template_unit) not in keys:
+                keys.add(key(template_unit))
+                nodes.append(template_unit)
+        return nodes
+
+    def __find_names(self, ObjectClass, names):
+        return set(o.name for o in ObjectClass.query.filter(ObjectClass.name.in_(set(names))).all())
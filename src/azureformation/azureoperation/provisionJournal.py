@@ -0,0 +1,143 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.provisionGraph import (
+    ProvisionGraph,
+)
+from src.azureformation.azureoperation.service import (
+    Service,
+)
+from src.azureformation.azureoperation.templateFramework import (
+    TemplateFramework,
+)
+from src.azureformation.azureoperation.utility import (
+    DEPLOYMENT_TICK,
+    VIRTUAL_MACHINE_TICK,
+    TASKS,
+    contain_azure_deployment,
+    get_pending_experiment_ids,
+    get_provision_journal_step,
+    get_virtual_machine_name,
+    run_job,
+)
+from src.azureformation.database import (
+    db_adapter,
+)
+from src.azureformation.database.models import (
+    Experiment,
+)
+from src.azureformation.enum import (
+    AVMStatus,
+    EStatus,
+    PJStep,
+)
+from src.azureformation.functions import (
+    safe_get_config,
+)
+from src.azureformation.log import (
+    log,
+)
+
+
+class ProvisionJournal:
+    """
+    Provisioning journal records last completed step of every virtual machine of experiment in database, so that
+    experiments left starting by a restart (e.g. with memory job store) resume from their last step
+    Experiments with pending jobs in scheduler are still in progress and left alone
+    Only a virtual machine whose async operation could have been lost before its step was recorded is checked
+    against azure
+    """
+    RESUME_DELAY = safe_get_config("azure.provision_journal.resume_delay", 30)
+    RESUME_JOB_ID = 'azure-provision-journal-resume'
+    RESUME_INFO = 'resume experiment [%d] virtual machine [%s] after step [%s]'
+
+    @classmethod
+    def schedule_resume(cls):
+        """
+        Resume experiments once scheduler and job store are up
+        Only one resume is pending however many times server processes start
+        """
+        run_job(TASKS['ProvisionJournal.resume'], (), (), cls.RESUME_DELAY, cls.RESUME_JOB_ID)
+
+    def resume(self):
+        """
+        Resume provisioning of starting experiments which have no pending jobs
+        :return: count of experiments resumed
+        """
+        pending = get_pending_experiment_ids()
+        experiments = db_adapter.find_all_objects_by(Experiment, status=EStatus.Starting)
+        count = 0
+        for experiment in experiments:
+            if experiment.id in pending:
+                continue
+            try:
+                self.resume_experiment(experiment)
+                count += 1
+            except Exception as e:
+                log.error(e)
+        return count
+
+    def resume_experiment(self, experiment):
+        if experiment.azure_key_id is None:
+            # lost before placement, create it again
+            log.debug(self.RESUME_INFO % (experiment.id, None, None))
+            run_job(TASKS['AzureFormation.create'], (), (experiment.id, ))
+            return
+        azure_key_id = experiment.azure_key_id
+        not_launched = []
+        for template_unit in TemplateFramework(experiment.id).get_template_units():
+            virtual_machine_name = get_virtual_machine_name(experiment.id, template_unit)
+            step = get_provision_journal_step(experiment.id, virtual_machine_name)
+            if step == PJStep.VIRTUAL_MACHINE_READY:
+                continue
+            log.debug(self.RESUME_INFO % (experiment.id, virtual_machine_name, step))
+            func_args = (experiment.id, template_unit)
+            if step is None:
+                not_launched.append(template_unit)
+            elif step == PJStep.CLOUD_SERVICE_READY:
+                self.__resume_virtual_machine(azure_key_id, template_unit, virtual_machine_name, func_args)
+            elif step == PJStep.NETWORK_UPDATED:
+                self.__query_virtual_machine(azure_key_id, template_unit, virtual_machine_name,
+                                             TASKS['VirtualMachine.create_virtual_machine_vm_true_2'], func_args)
+            else:
+                # deployment ready or role added
+                self.__query_virtual_machine(azure_key_id, template_unit, virtual_machine_name,
+                                             TASKS['VirtualMachine.create_virtual_machine_vm_true_1'], func_args)
+        if len(not_launched) > 0:
+            # dependencies already ready are reused, and virtual machines are launched once they are all ready
+            ProvisionGraph(azure_key_id).start(experiment.id, not_launched)
+
+    # --------------------------------------------- helper function ---------------------------------------------#
+
+    def __resume_virtual_machine(self, azure_key_id, template_unit, virtual_machine_name, func_args):
+        """
+        Deployment or role could have been requested before restart, so check them in azure
+        """
+        service = Service(azure_key_id)
+        cloud_service_name = template_unit.get_cloud_service_name()
+        deployment_slot = template_unit.get_deployment_slot()
+        deployment_name = service.get_deployment_name(cloud_service_name, deployment_slot) \
+            if service.deployment_exists(cloud_service_name, deployment_slot) else None
+        if deployment_name is None or \
+                not service.virtual_machine_exists(cloud_service_name, deployment_name, virtual_machine_name):
+            run_job(TASKS['VirtualMachine.create_virtual_machine'], (azure_key_id, ), func_args)
+        elif not contain_azure_deployment(cloud_service_name, deployment_slot):
+            # deployment created with virtual machine
+            run_job(TASKS['Service.query_deployment_status'],
+                    (azure_key_id, ),
+                    (cloud_service_name, deployment_name,
+                     TASKS['VirtualMachine.create_virtual_machine_dm_true'], (azure_key_id, ), func_args),
+                    DEPLOYMENT_TICK)
+        else:
+            self.__query_virtual_machine(azure_key_id, template_unit, virtual_machine_name,
+                                         TASKS['VirtualMachine.create_virtual_machine_vm_true_1'], func_args)
+
+    def __query_virtual_machine(self, azure_key_id, template_unit, virtual_machine_name, true_task,
+                                func_args):
+        cloud_service_name = template_unit.get_cloud_service_name()
+        deployment_name = Service(azure_key_id).get_deployment_name(cloud_service_name,
+                                                                    template_unit.get_deployment_slot())
+        run_job(TASKS['Service.query_virtual_machine_status'],
+                (azure_key_id, ),
+                (cloud_service_name, deployment_name, virtual_machine_name, AVMStatus.READY_ROLE,
+                 true_task, (azure_key_id, ), func_args),
+                VIRTUAL_MACHINE_TICK)
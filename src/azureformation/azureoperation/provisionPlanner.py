@@ -0,0 +1,105 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.placement import (
+    SubscriptionPlacement,
+)
+from src.azureformation.azureoperation.rateLimiter import (
+    RateLimiter,
+)
+from src.azureformation.azureoperation.templateUnit import (
+    TemplateUnit,
+)
+from src.azureformation.azureoperation.utility import (
+    TASKS,
+    run_job,
+)
+from src.azureformation.database import (
+    db_adapter,
+)
+from src.azureformation.database.models import (
+    Hackathon,
+    HackathonAzureKey,
+    Template,
+)
+from src.azureformation.enum import (
+    VEStatus,
+)
+from src.azureformation.functions import (
+    load_template,
+    safe_get_config,
+)
+from src.azureformation.log import (
+    log,
+)
+from datetime import (
+    datetime,
+    timedelta,
+)
+import math
+
+
+class ProvisionPlanner:
+    """
+    Pre-provision experiments of a hackathon ahead of its start time, instead of all on demand at start
+    Warm pool of template is grown in stages, sized by in-flight limit and spaced by rate limit of azure
+    subscriptions of hackathon, so that it is full LEAD_TIME before start. Members are kept stopped deallocated
+    until users claim them
+    """
+    STAGE_SIZE = safe_get_config("azure.provision_planner.stage_size", 20)
+    LEAD_TIME = safe_get_config("azure.provision_planner.lead_time", 1800)
+    MIN_INTERVAL = safe_get_config("azure.provision_planner.min_interval", 300)
+    VIRTUAL_ENVIRONMENTS = 'virtual_environments'
+    # azure mutations of each member: create and deallocate every virtual machine
+    MUTATIONS_PER_VIRTUAL_MACHINE = 2
+
+    def __init__(self, hackathon_id):
+        self.hackathon_id = hackathon_id
+
+    def plan(self, template_id, headcount, start_time=None):
+        """
+        Schedule staged growth of warm pool of template
+        Headcount is cut down to what quota of azure subscriptions could hold
+        :param template_id:
+        :param headcount: expected number of users
+        :param start_time: utc, start time of hackathon if None
+        :return: a list of (utc run time, warm pool size)
+        """
+        if start_time is None:
+            start_time = db_adapter.get_object(Hackathon, self.hackathon_id).start_time
+        if start_time is None:
+            log.error('provision planner: start time of hackathon [%d] unknown' % self.hackathon_id)
+            return []
+        template = load_template(db_adapter.get_object(Template, template_id).url)
+        if template is None:
+            return []
+        template_units = map(TemplateUnit, template[self.VIRTUAL_ENVIRONMENTS])
+        azure_key_ids = [ha.azure_key_id for ha in
+                         db_adapter.find_all_objects_by(HackathonAzureKey, hackathon_id=self.hackathon_id)]
+        placement = SubscriptionPlacement(self.hackathon_id)
+        capacity = sum(placement.get_capacity(template_units, azure_key_id) for azure_key_id in azure_key_ids)
+        size = min(headcount, capacity)
+        if size < headcount:
+            log.warn('provision planner: quota holds %d of %d experiments of hackathon [%d]' %
+                     (size, headcount, self.hackathon_id))
+        if size == 0:
+            return []
+        # a stage should not exceed in-flight limit, and should be issued within its interval at rate limit
+        stage_size = max(1, min(self.STAGE_SIZE,
+                                RateLimiter.MAX_IN_FLIGHT * len(azure_key_ids) / len(template_units)))
+        mutations = stage_size * len(template_units) * self.MUTATIONS_PER_VIRTUAL_MACHINE
+        interval = max(self.MIN_INTERVAL, mutations / (RateLimiter.RATE * len(azure_key_ids)))
+        stages = int(math.ceil(float(size) / stage_size))
+        now = datetime.utcnow()
+        first = max(now, start_time - timedelta(seconds=self.LEAD_TIME + (stages - 1) * interval))
+        plan = []
+        for i in range(stages):
+            run_time = first + timedelta(seconds=i * interval)
+            pool_size = min(size, (i + 1) * stage_size)
+            # grow warm pool, with members deallocated
+            run_job(TASKS['WarmPool.set_size'],
+                    (None, ),
+                    (template_id, self.hackathon_id, pool_size, VEStatus.Stopped),
+                    (run_time - now).total_seconds())
+            plan.append((run_time, pool_size))
+        log.debug('provision planner: hackathon [%d] plan %s' % (self.hackathon_id, plan))
+        return plan
@@ -0,0 +1,240 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.database import (
+    db_adapter,
+    db_session,
+)
+from src.azureformation.database.models import (
+    AzureCircuitBreaker,
+    AzureRateLimit,
+    AzureInFlightOperation,
+)
+from src.azureformation.functions import (
+    safe_get_config,
+)
+from src.azureformation.log import (
+    log,
+)
+from src.azureformation.metrics import (
+    metrics,
+)
+from datetime import (
+    datetime,
+    timedelta,
+)
+from sqlalchemy.exc import (
+    IntegrityError,
+)
+import time
+
+
+class RateLimitError(Exception):
+    """
+    Raised when no token or in-flight slot becomes available in time
+    """
+    pass
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when circuit breaker of azure subscription is open
+    """
+    pass
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter and in-flight async operation governor of one azure subscription
+    State is kept in database with row lock, so that it is shared by all worker processes
+    Throttle responses from azure halve the rate, which then recovers linearly
+    """
+    RATE = safe_get_config("azure.rate_limit.rate", 2)
+    BURST = safe_get_config("azure.rate_limit.burst", 20)
+    MAX_IN_FLIGHT = safe_get_config("azure.rate_limit.max_in_flight", 30)
+    MAX_WAIT = safe_get_config("azure.rate_limit.max_wait", 30)
+    MIN_RATE = 0.1
+    # rate recovered per second after throttle
+    RECOVERY = 0.01
+    THROTTLE_BACKOFF = 30
+    # in-flight operations older than this are considered leaked, e.g. process crashed before completion
+    IN_FLIGHT_TTL = 1800
+    IN_FLIGHT_TICK = 1
+    WAIT = 'azure.rate_limit.wait'
+    THROTTLED = 'azure.rate_limit.throttled'
+
+    def __init__(self, azure_key_id):
+        self.azure_key_id = azure_key_id
+
+    def acquire(self):
+        """
+        Block until a token and an in-flight slot are available, up to MAX_WAIT seconds
+        Raise RateLimitError if timed out
+        :return: slot: id of AzureInFlightOperation
+        """
+        start = time.time()
+        self.__purge()
+        while True:
+            wait, slot = self.__try_acquire()
+            if slot is not None:
+                metrics.observe(self.WAIT, time.time() - start)
+                return slot
+            if time.time() + wait - start > self.MAX_WAIT:
+                raise RateLimitError('azure key [%s] throttled: no capacity within %d seconds' %
+                                     (self.azure_key_id, self.MAX_WAIT))
+            log.debug('rate limiter: azure key [%s] wait %.2f seconds' % (self.azure_key_id, wait))
+            time.sleep(wait)
+
+    def bind(self, slot, request_id):
+        """
+        Bind in-flight slot to request id of azure async operation, which will be released once completed
+        """
+        db_adapter.update_object(db_adapter.get_object(AzureInFlightOperation, slot), request_id=request_id)
+        db_adapter.commit()
+
+    def release_slot(self, slot):
+        db_adapter.delete_all_objects(AzureInFlightOperation, AzureInFlightOperation.id == slot)
+        db_adapter.commit()
+
+    def release(self, request_id):
+        db_adapter.delete_all_objects_by(AzureInFlightOperation, request_id=request_id)
+        db_adapter.commit()
+
+    def throttled(self):
+        """
+        Slow down bucket after azure throttles
+        """
+        metrics.incr(self.THROTTLED)
+        try:
+            bucket = self.__lock_bucket()
+            bucket.rate = max(self.MIN_RATE, bucket.rate / 2)
+            bucket.tokens = 0
+            bucket.throttled_until = datetime.utcnow() + timedelta(seconds=self.THROTTLE_BACKOFF)
+            db_adapter.commit()
+            log.warn('rate limiter: azure key [%s] throttled, rate lowered to %.2f' % (self.azure_key_id, bucket.rate))
+        except Exception as e:
+            db_adapter.rollback()
+            log.error(e)
+
+    # --------------------------------------------- helper function ---------------------------------------------#
+
+    def __try_acquire(self):
+        """
+        Return (0, slot) if acquired, else (seconds to wait, None)
+        """
+        try:
+            bucket = self.__lock_bucket()
+            now = datetime.utcnow()
+            elapsed = max(0, (now - bucket.last_refill_time).total_seconds())
+            bucket.rate = min(self.RATE, bucket.rate + elapsed * self.RECOVERY)
+            bucket.tokens = min(self.BURST, bucket.tokens + elapsed * bucket.rate)
+            bucket.last_refill_time = now
+            if bucket.throttled_until is not None and now < bucket.throttled_until:
+                wait = (bucket.throttled_until - now).total_seconds()
+            elif bucket.tokens < 1:
+                wait = (1 - bucket.tokens) / bucket.rate
+            elif AzureInFlightOperation.query.filter(
+                    AzureInFlightOperation.azure_key_id == self.azure_key_id,
+                    AzureInFlightOperation.create_time > now - timedelta(seconds=self.IN_FLIGHT_TTL)
+            ).count() >= self.MAX_IN_FLIGHT:
+                wait = self.IN_FLIGHT_TICK
+            else:
+                bucket.tokens -= 1
+                operation = AzureInFlightOperation(azure_key_id=self.azure_key_id)
+                db_session.add(operation)
+                db_adapter.commit()
+                return 0, operation.id
+            db_adapter.commit()
+            return wait, None
+        except Exception:
+            db_adapter.rollback()
+            raise
+
+    def __purge(self):
+        """
+        Delete leaked in-flight operations, which are no longer counted anyway
+        """
+        db_adapter.delete_all_objects(AzureInFlightOperation,
+                                      AzureInFlightOperation.azure_key_id == self.azure_key_id,
+                                      AzureInFlightOperation.create_time <=
+                                      datetime.utcnow() - timedelta(seconds=self.IN_FLIGHT_TTL))
+
+    def __lock_bucket(self):
+        bucket = AzureRateLimit.query.filter_by(azure_key_id=self.azure_key_id).with_for_update().first()
+        if bucket is None:
+            try:
+                db_session.add(AzureRateLimit(azure_key_id=self.azure_key_id, rate=self.RATE, tokens=self.BURST))
+                db_adapter.commit()
+            except IntegrityError:
+                # created by another worker in the meantime
+                db_adapter.rollback()
+            bucket = AzureRateLimit.query.filter_by(azure_key_id=self.azure_key_id).with_for_update().first()
+        return bucket
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of azure mutations of one azure subscription
+    Circuit opens for OPEN_TIME seconds when transient error rate in current window reaches ERROR_RATE
+    State is kept in database with row lock, so that it is shared by all worker processes
+    """
+    WINDOW = safe_get_config("azure.circuit_breaker.window", 60)
+    MIN_REQUESTS = safe_get_config("azure.circuit_breaker.min_requests", 10)
+    ERROR_RATE = safe_get_config("azure.circuit_breaker.error_rate", 0.5)
+    OPEN_TIME = safe_get_config("azure.circuit_breaker.open_time", 120)
+    OPENED = 'azure.circuit_breaker.opened'
+
+    def __init__(self, azure_key_id):
+        self.azure_key_id = azure_key_id
+
+    def get_open_seconds(self):
+        """
+        Return seconds before circuit closes, 0 if closed
+        :return:
+        """
+        breaker = db_adapter.find_first_object_by(AzureCircuitBreaker, azure_key_id=self.azure_key_id)
+        if breaker is None or breaker.open_until is None:
+            return 0
+        return max(0, (breaker.open_until - datetime.utcnow()).total_seconds())
+
+    def record(self, error):
+        """
+        Record result of a mutation, and open circuit if error rate spikes
+        :param error: whether mutation failed with transient error
+        :return:
+        """
+        try:
+            breaker = self.__lock_breaker()
+            now = datetime.utcnow()
+            if (now - breaker.window_start_time).total_seconds() > self.WINDOW:
+                breaker.request_count = 0
+                breaker.error_count = 0
+                breaker.window_start_time = now
+            breaker.request_count += 1
+            if error:
+                breaker.error_count += 1
+            if breaker.request_count >= self.MIN_REQUESTS and \
+                    float(breaker.error_count) / breaker.request_count >= self.ERROR_RATE:
+                breaker.open_until = now + timedelta(seconds=self.OPEN_TIME)
+                breaker.request_count = 0
+                breaker.error_count = 0
+                breaker.window_start_time = breaker.open_until
+                metrics.incr(self.OPENED)
+                log.warn('circuit breaker: azure key [%s] opened until %s' % (self.azure_key_id, breaker.open_until))
+            db_adapter.commit()
+        except Exception as e:
+            db_adapter.rollback()
+            log.error(e)
+
+    # --------------------------------------------- helper function ---------------------------------------------#
+
+    def __lock_breaker(self):
+        breaker = AzureCircuitBreaker.query.filter_by(azure_key_id=self.azure_key_id).with_for_update().first()
+        if breaker is None:
+            try:
+                db_session.add(AzureCircuitBreaker(azure_key_id=self.azure_key_id))
+                db_adapter.commit()
+            except IntegrityError:
+                # created by another worker in the meantime
+                db_adapter.rollback()
+            breaker = AzureCircuitBreaker.query.filter_by(azure_key_id=self.azure_key_id).with_for_update().first()
+        return breaker
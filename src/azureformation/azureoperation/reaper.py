@@ -0,0 +1,100 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.utility import (
+    TASKS,
+    is_azure_operation_pending,
+    run_interval_job,
+    run_job,
+)
+from src.azureformation.database import (
+    db_adapter,
+)
+from src.azureformation.database.models import (
+    Experiment,
+)
+from src.azureformation.enum import (
+    ALOperation,
+    AVMStatus,
+    EStatus,
+)
+from src.azureformation.functions import (
+    safe_get_config,
+)
+from src.azureformation.log import (
+    log,
+)
+from src.azureformation.metrics import (
+    metrics,
+)
+from sqlalchemy import (
+    and_,
+    or_,
+)
+from datetime import (
+    datetime,
+    timedelta,
+)
+
+
+class Reaper:
+    """
+    Reaper stops experiments abandoned by their users, judged by heart beat of experiment
+    Idle experiments are found batch by batch with range query on index of status and heart beat, and stopped
+    through batch stop path of AzureFormation. Deallocated virtual machines return their cores to quota of
+    azure subscription, which placement reads live
+    Experiments without user (e.g. members of warm pool) send no heart beat and are never reaped
+    """
+    IDLE_TIMEOUT = safe_get_config("azure.reaper.idle_timeout", 3600)
+    TICK = safe_get_config("azure.reaper.tick", 300)
+    BATCH_SIZE = safe_get_config("azure.reaper.batch_size", 100)
+    DEALLOCATE = safe_get_config("azure.reaper.deallocate", True)
+    JOB_ID = 'azure-reaper'
+    REAP_INFO = 'experiment [%d] idle since %s, stop it'
+    REAPED = 'azure.reaper.reaped'
+
+    @classmethod
+    def schedule(cls):
+        """
+        Run reaper every TICK seconds
+        """
+        run_interval_job(TASKS['Reaper.reap'], (), (), cls.TICK, cls.JOB_ID)
+
+    def reap(self):
+        """
+        Stop running experiments without heart beat for IDLE_TIMEOUT seconds
+        :return: count of experiments stopped
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.IDLE_TIMEOUT)
+        # stop mode is left to StopPolicy unless reaped experiments are always deallocated
+        action = AVMStatus.STOPPED_DEALLOCATED if self.DEALLOCATE else None
+        count = 0
+        last = None
+        while True:
+            batch = self.__find_idle(cutoff, last)
+            for e in batch:
+                # experiment being stopped stays running until all its virtual machines are stopped
+                if is_azure_operation_pending(e.id, ALOperation.STOP_VIRTUAL_MACHINE):
+                    continue
+                log.debug(self.REAP_INFO % (e.id, e.last_heart_beat_time))
+                run_job(TASKS['AzureFormation.stop'], (e.azure_key_id, ), (e.id, action))
+                metrics.incr(self.REAPED)
+                count += 1
+            if len(batch) < self.BATCH_SIZE:
+                return count
+            last = (batch[-1].last_heart_beat_time, batch[-1].id)
+
+    # --------------------------------------------- helper function ---------------------------------------------#
+
+    def __find_idle(self, cutoff, last):
+        """
+        Next batch of idle experiments in order of heart beat, after (last_heart_beat_time, id) of last batch
+        """
+        query = Experiment.query.filter(Experiment.status == EStatus.Running,
+                                        Experiment.last_heart_beat_time < cutoff,
+                                        Experiment.user_id.isnot(None))
+        if last is not None:
+            query = query.filter(or_(Experiment.last_heart_beat_time > last[0],
+                                     and_(Experiment.last_heart_beat_time == last[0], Experiment.id > last[1])))
+        batch = query.order_by(Experiment.last_heart_beat_time, Experiment.id).limit(self.BATCH_SIZE).all()
+        db_adapter.commit()
+        return batch
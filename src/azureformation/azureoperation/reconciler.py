@@ -0,0 +1,173 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.service import (
+    Service,
+)
+from src.azureformation.azureoperation.utility import (
+    TASKS,
+    check_experiment_done,
+    is_azure_operation_pending,
+    run_interval_job,
+)
+from src.azureformation.database import (
+    db_adapter,
+    db_session,
+)
+from src.azureformation.database.models import (
+    AzureCloudService,
+    AzureDeployment,
+    AzureVirtualMachine,
+    Experiment,
+    VirtualEnvironment,
+)
+from src.azureformation.enum import (
+    ALOperation,
+    AVMStatus,
+    EStatus,
+    VEStatus,
+)
+from src.azureformation.functions import (
+    safe_get_config,
+)
+from src.azureformation.log import (
+    log,
+)
+from src.azureformation.metrics import (
+    metrics,
+)
+from datetime import (
+    datetime,
+)
+
+
+class Reconciler:
+    """
+    Reconciler detects drift between azure and database, e.g. virtual machines stopped in azure portal
+    Role instances of every deployment of a cloud service come from one detailed get of the cloud service, which
+    are diffed against azure virtual machines and virtual environments of running and stopped experiments, and
+    changes are written in one batched update per status
+    Experiments being stopped or started by us are left to their own chains, and transitional role instance status
+    (e.g. StoppingVM) is not reconciled
+    """
+    TICK = safe_get_config("azure.reconciler.tick", 300)
+    JOB_ID = 'azure-reconciler'
+    # role instance status -> virtual environment status
+    VE_STATUS = {
+        AVMStatus.READY_ROLE: VEStatus.Running,
+        AVMStatus.STOPPED_VM: VEStatus.Stopped,
+        AVMStatus.STOPPED_DEALLOCATED: VEStatus.Stopped,
+    }
+    EXPERIMENT_STATUS = [
+        EStatus.Running,
+        EStatus.Stopped,
+    ]
+    DRIFT_INFO = 'reconciler: virtual machine [%s] of experiment [%d] is %s in azure, %s in database'
+    MISSING_INFO = 'reconciler: virtual machine [%s] of experiment [%d] not found in cloud service [%s]'
+    DRIFT = 'azure.reconciler.drift'
+    MISSING = 'azure.reconciler.missing'
+
+    @classmethod
+    def schedule(cls):
+        """
+        Run reconciler every TICK seconds
+        """
+        run_interval_job(TASKS['Reconciler.reconcile'], (), (), cls.TICK, cls.JOB_ID)
+
+    def reconcile(self):
+        """
+        Reconcile status of virtual machines of all cloud services with running or stopped experiments
+        :return: count of virtual machines updated
+        """
+        groups = {}
+        for virtual_machine in self.__find_virtual_machines():
+            groups.setdefault((virtual_machine.azure_key_id, virtual_machine.cloud_service_name), []). \
+                append(virtual_machine)
+        # new status -> ids
+        avm_changes = {}
+        ve_changes = {}
+        experiment_ids = set()
+        for (azure_key_id, cloud_service_name), virtual_machines in groups.items():
+            status = self.get_role_instance_status(azure_key_id, cloud_service_name)
+            if status is None:
+                continue
+            for virtual_machine in virtual_machines:
+                if virtual_machine.name not in status:
+                    metrics.incr(self.MISSING)
+                    log.warn(self.MISSING_INFO % (virtual_machine.name, virtual_machine.experiment_id,
+                                                  cloud_service_name))
+                    continue
+                new_status = status[virtual_machine.name]
+                if new_status == virtual_machine.status or new_status not in self.VE_STATUS:
+                    continue
+                metrics.incr(self.DRIFT)
+                log.warn(self.DRIFT_INFO % (virtual_machine.name, virtual_machine.experiment_id, new_status,
+                                            virtual_machine.status))
+                avm_changes.setdefault(new_status, []).append(virtual_machine.id)
+                ve_changes.setdefault(self.VE_STATUS[new_status], []).append(virtual_machine.virtual_environment_id)
+                experiment_ids.add(virtual_machine.experiment_id)
+        if not self.__commit(avm_changes, ve_changes):
+            return 0
+        # experiment follows its virtual environments
+        for experiment_id in experiment_ids:
+            check_experiment_done(experiment_id, EStatus.Running)
+            check_experiment_done(experiment_id, EStatus.Stopped)
+        return sum(len(ids) for ids in avm_changes.values())
+
+    def get_role_instance_status(self, azure_key_id, cloud_service_name):
+        """
+        Status of role instances of all deployments of cloud service from one streamed call, None if failed
+        :param azure_key_id:
+        :param cloud_service_name:
+        :return: a dict of virtual machine name -> status
+        """
+        try:
+            role_instances = Service(azure_key_id).get_hosted_service_summary(cloud_service_name)[1]
+        except Exception as e:
+            log.error(e)
+            return None
+        return dict((name, r[0]) for name, r in role_instances.items())
+
+    # --------------------------------------------- helper function ---------------------------------------------#
+
+    def __find_virtual_machines(self):
+        """
+        Virtual machines of running and stopped experiments, with their cloud services and azure keys
+        Experiments with stop or start in progress are skipped
+        """
+        rows = db_session.query(AzureVirtualMachine.id,
+                                AzureVirtualMachine.name,
+                                AzureVirtualMachine.status,
+                                AzureVirtualMachine.experiment_id,
+                                AzureVirtualMachine.virtual_environment_id,
+                                AzureCloudService.name.label('cloud_service_name'),
+                                Experiment.azure_key_id). \
+            join(AzureDeployment, AzureVirtualMachine.deployment_id == AzureDeployment.id). \
+            join(AzureCloudService, AzureDeployment.cloud_service_id == AzureCloudService.id). \
+            join(Experiment, AzureVirtualMachine.experiment_id == Experiment.id). \
+            filter(Experiment.status.in_(self.EXPERIMENT_STATUS)).all()
+        db_adapter.commit()
+        pending = {}
+        for row in rows:
+            experiment_id = row.experiment_id
+            if experiment_id not in pending:
+                pending[experiment_id] = \
+                    is_azure_operation_pending(experiment_id, ALOperation.STOP_VIRTUAL_MACHINE) or \
+                    is_azure_operation_pending(experiment_id, ALOperation.START_VIRTUAL_MACHINE)
+            if not pending[experiment_id]:
+                yield row
+
+    def __commit(self, avm_changes, ve_changes):
+        try:
+            now = datetime.utcnow()
+            for status, ids in avm_changes.items():
+                AzureVirtualMachine.query.filter(AzureVirtualMachine.id.in_(ids)).update(
+                    {'status': status, 'last_modify_time': now}, synchronize_session=False)
+            for status, ids in ve_changes.items():
+                VirtualEnvironment.query.filter(VirtualEnvironment.id.in_(ids)).update(
+                    {'status': status}, synchronize_session=False)
+            db_adapter.commit()
+            return True
+        except Exception as e:
+            db_adapter.rollback()
+            log.error(e)
+            return False
@@ -6,6 +6,9 @@ from src.azureformation.azureoperation.service import (
 from src.azureformation.azureoperation.subscription import(
     Subscription,
 )
+from src.azureformation.azureoperation.retryEngine import (
+    RetryEngine,
+)
 
 
 class ResourceBase(object):
@@ -13,4 +16,5 @@ class ResourceBase(object):
     def __init__(self, azure_key_id):
         self.azure_key_id = azure_key_id
         self.service = Service(self.azure_key_id)
-        self.subscription = Subscription(self.service)
\ No newline at end of file
+        self.subscription = Subscription(self.service)
+        self.retry_engine = RetryEngine(self.azure_key_id)
@@ -0,0 +1,125 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.utility import (
+    commit_azure_log,
+    run_job,
+)
+from src.azureformation.azureoperation.rateLimiter import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RateLimitError,
+)
+from src.azureformation.database import (
+    db_adapter,
+)
+from src.azureformation.database.models import (
+    AzureLog,
+)
+from src.azureformation.enum import (
+    ALStatus,
+    AzureErrorType,
+)
+from src.azureformation.functions import (
+    safe_get_config,
+)
+from src.azureformation.log import (
+    log,
+)
+from src.azureformation.metrics import (
+    metrics,
+)
+import random
+
+
+class RetryEngine:
+    """
+    Retry azure mutations failed with transient errors, by rescheduling the failed step on scheduler with backoff
+    Attempts are counted from azure log, so that retry survives restart and works across worker processes
+    """
+    MAX_ATTEMPTS = safe_get_config("azure.retry.max_attempts", 5)
+    BASE_DELAY = safe_get_config("azure.retry.base_delay", 10)
+    MAX_DELAY = safe_get_config("azure.retry.max_delay", 300)
+    # lower case message fragments of azure errors
+    # only conflicts of deployment lock or operation in progress are transient, others (e.g. dns name is already
+    # taken) are permanent and classified as OTHER
+    ERROR_MESSAGES = [
+        (AzureErrorType.CONFLICT, ['currently performing an operation', 'requires exclusive access',
+                                   'conflicting operation', 'operation is in progress', 'operation in progress']),
+        (AzureErrorType.THROTTLING, ['too many requests', 'toomanyrequests', 'service unavailable', 'serverbusy',
+                                     'throttl']),
+        (AzureErrorType.INTERNAL_ERROR, ['internal server error', 'internalerror', 'internal error',
+                                         'timed out', 'timeout']),
+        (AzureErrorType.NOT_FOUND, ['not found']),
+    ]
+    RETRYABLE = [
+        AzureErrorType.CONFLICT,
+        AzureErrorType.THROTTLING,
+        AzureErrorType.INTERNAL_ERROR,
+        AzureErrorType.CIRCUIT_OPEN,
+    ]
+    RETRY_NOTE = '%s [%s] retry %d in %d seconds because of %s: %s'
+    RETRY = 'azure.retry.%s'
+
+    def __init__(self, azure_key_id):
+        self.azure_key_id = azure_key_id
+        self.circuit_breaker = CircuitBreaker(azure_key_id)
+
+    @classmethod
+    def classify(cls, exception):
+        """
+        Classify azure error by its type and message
+        :param exception:
+        :return: AzureErrorType in enum.py
+        """
+        if isinstance(exception, CircuitOpenError):
+            return AzureErrorType.CIRCUIT_OPEN
+        if isinstance(exception, RateLimitError):
+            return AzureErrorType.THROTTLING
+        message = str(exception).lower()
+        for error_type, fragments in cls.ERROR_MESSAGES:
+            if any(f in message for f in fragments):
+                return error_type
+        return AzureErrorType.OTHER
+
+    @classmethod
+    def is_retryable(cls, exception):
+        return cls.classify(exception) in cls.RETRYABLE
+
+    def retry(self, experiment_id, operation, resource_type, name, exception, task, cls_args, func_args):
+        """
+        Reschedule failed step if its error is transient and attempts remain
+        Return False if caller should fail as before
+        :param experiment_id:
+        :param operation: ALOperation in enum.py
+        :param resource_type: e.g. STORAGE_ACCOUNT in enum.py
+        :param name: name of resource
+        :param exception: error of azure mutation
+        :param task: step to retry
+        :param cls_args:
+        :param func_args:
+        :return:
+        """
+        error_type = self.classify(exception)
+        if error_type not in self.RETRYABLE:
+            return False
+        prefix = '%s [%s]' % (resource_type, name)
+        attempts = db_adapter.count(AzureLog,
+                                    AzureLog.experiment_id == experiment_id,
+                                    AzureLog.operation == operation,
+                                    AzureLog.status == ALStatus.RETRY,
+                                    AzureLog.note.like(prefix + '%'))
+        if attempts >= self.MAX_ATTEMPTS:
+            log.error('%s retry attempts exhausted' % prefix)
+            return False
+        if error_type == AzureErrorType.CIRCUIT_OPEN:
+            delay = max(self.BASE_DELAY, int(self.circuit_breaker.get_open_seconds()))
+        else:
+            # exponential backoff with jitter, spreading retries of a burst
+            delay = int(min(self.MAX_DELAY, self.BASE_DELAY * 2 ** attempts))
+            delay = random.randint(delay / 2, delay)
+        m = self.RETRY_NOTE % (resource_type, name, attempts + 1, delay, error_type, str(exception))
+        commit_azure_log(experiment_id, operation, ALStatus.RETRY, m[:500])
+        log.warn(m)
+        metrics.incr(self.RETRY % error_type)
+        run_job(task, cls_args, func_args, delay)
+        return True
@@ -1,7 +1,11 @@
 __author__ = 'Yifu Huang'
 
 from src.azureformation.enum import (
+    STORAGE_ACCOUNT,
+    CLOUD_SERVICE,
+    DEPLOYMENT,
     ADStatus,
+    AzureErrorType,
 )
 from src.azureformation.log import (
     log,
@@ -10,9 +14,23 @@ from src.azureformation.azureoperation.utility import (
     ASYNC_TICK,
     DEPLOYMENT_TICK,
     VIRTUAL_MACHINE_TICK,
-    MDL_CLS_FUNC,
+    TASKS,
     run_job,
 )
+from src.azureformation.azureoperation.rateLimiter import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RateLimiter,
+)
+from src.azureformation.azureoperation.retryEngine import (
+    RetryEngine,
+)
+from src.azureformation.azureoperation.inventory import (
+    Inventory,
+)
+from src.azureformation.azureoperation.singleFlight import (
+    SingleFlight,
+)
 from src.azureformation.database import (
     db_adapter,
 )
@@ -23,12 +41,21 @@ from azure.servicemanagement import (
     ServiceManagementService,
     Deployment,
 )
+from io import (
+    BytesIO,
+)
+from xml.etree.cElementTree import (
+    iterparse,
+)
 import time
 
 
 class Service(ServiceManagementService):
     """
     Wrapper of azure service management service
+    Azure mutations are governed by rate limiter and circuit breaker of azure subscription
+    Existence checks are answered by inventory of azure subscription if possible
+    Identical concurrent reads of cloud service and deployment share one request, see SingleFlight
     """
     IN_PROGRESS = 'InProgress'
     SUCCEEDED = 'Succeeded'
@@ -39,6 +66,10 @@ class Service(ServiceManagementService):
         self.azure_key_id = azure_key_id
         azure_key = db_adapter.get_object(AzureKey, self.azure_key_id)
         super(Service, self).__init__(azure_key.subscription_id, azure_key.pem_url, azure_key.management_host)
+        self.rate_limiter = RateLimiter(self.azure_key_id)
+        self.circuit_breaker = CircuitBreaker(self.azure_key_id)
+        self.inventory = Inventory.get(self.azure_key_id)
+        self.single_flight = SingleFlight.get(self.azure_key_id)
 
     # ---------------------------------------- subscription ---------------------------------------- #
 
@@ -50,30 +81,71 @@ class Service(ServiceManagementService):
     def get_storage_account_properties(self, name):
         return super(Service, self).get_storage_account_properties(name)
 
+    def list_storage_accounts(self):
+        return super(Service, self).list_storage_accounts()
+
     def storage_account_exists(self, name):
         """
         Check whether specific storage account exist in specific azure subscription
         :param name:
         :return:
         """
+        if self.inventory is not None:
+            exists = self.inventory.storage_account_exists(self, name)
+            if exists is not None:
+                return exists
         try:
             props = self.get_storage_account_properties(name)
         except Exception as e:
             if e.message != self.NOT_FOUND:
                 log.error(e)
-            return False
+                return False
+            props = None
+        if self.inventory is not None:
+            self.inventory.set_storage_account(name, props is not None)
         return props is not None
 
     def check_storage_account_name_availability(self, name):
         return super(Service, self).check_storage_account_name_availability(name)
 
     def create_storage_account(self, name, description, label, location):
-        return super(Service, self).create_storage_account(name, description, label, location=location)
+        result = self.__governed(super(Service, self).create_storage_account,
+                                 name, description, label, location=location)
+        self.__track(result, STORAGE_ACCOUNT, name)
+        return result
+
+    def delete_storage_account(self, name):
+        """
+        Delete storage account with its blobs, azure refuses if disks are still registered in it
+        """
+        result = self.__governed(super(Service, self).delete_storage_account, name)
+        if self.inventory is not None:
+            self.inventory.set_storage_account(name, False)
+            self.inventory.publish(STORAGE_ACCOUNT, name)
+        return result
 
     # ---------------------------------------- cloud service ---------------------------------------- #
 
     def get_hosted_service_properties(self, name, detail=False):
-        return super(Service, self).get_hosted_service_properties(name, detail)
+        return self.__single_flight(('get_hosted_service_properties', name, detail),
+                                    super(Service, self).get_hosted_service_properties, name, detail)
+
+    def list_hosted_services(self):
+        return super(Service, self).list_hosted_services()
+
+    def get_hosted_service_summary(self, name):
+        """
+        Detailed properties of cloud service reduced to input endpoint ports and role instances
+        Response is parsed as a stream of xml elements, each dropped once read, instead of deserializing every
+        deployment, role and configuration set into objects
+        :param name:
+        :return: (ports, role_instances): a list of int, a dict of role instance name -> (status, private ip, vip)
+        """
+        # raw response, response_type is required by older azure sdk
+        response = self.__single_flight(('get_hosted_service_summary', name),
+                                        self._perform_get, self._get_hosted_service_path(name) + '?embed-detail=true',
+                                        None)
+        return self.__parse_hosted_service_summary(response.body)
 
     def cloud_service_exists(self, name):
         """
@@ -81,19 +153,35 @@ class Service(ServiceManagementService):
         :param name:
         :return:
         """
+        if self.inventory is not None:
+            exists = self.inventory.cloud_service_exists(self, name)
+            if exists is not None:
+                return exists
         try:
             props = self.get_hosted_service_properties(name)
         except Exception as e:
             if e.message != self.NOT_FOUND:
                 log.error(e)
-            return False
+                return False
+            props = None
+        if self.inventory is not None:
+            self.inventory.set_cloud_service(name, props is not None)
         return props is not None
 
     def check_hosted_service_name_availability(self, name):
         return super(Service, self).check_hosted_service_name_availability(name)
 
     def create_hosted_service(self, name, label, location):
-        return super(Service, self).create_hosted_service(name, label, location=location)
+        result = self.__governed(super(Service, self).create_hosted_service, name, label, location=location)
+        if self.inventory is not None:
+            self.inventory.set_cloud_service(name, True)
+            self.inventory.publish(CLOUD_SERVICE, name)
+        return result
+
+    def delete_cloud_service(self, name):
+        result = self.__governed(super(Service, self).delete_hosted_service, name)
+        self.__track(result, CLOUD_SERVICE, name)
+        return result
 
     # ---------------------------------------- deployment ---------------------------------------- #
 
@@ -101,17 +189,34 @@ class Service(ServiceManagementService):
         return super(Service, self).get_deployment_by_slot(cloud_service_name, deployment_slot)
 
     def get_deployment_by_name(self, cloud_service_name, deployment_name):
-        return super(Service, self).get_deployment_by_name(cloud_service_name, deployment_name)
+        return self.__single_flight(('get_deployment_by_name', cloud_service_name, deployment_name),
+                                    super(Service, self).get_deployment_by_name, cloud_service_name, deployment_name)
 
     def deployment_exists(self, cloud_service_name, deployment_slot):
+        if self.inventory is not None:
+            exists = self.inventory.deployment_exists(self, cloud_service_name, deployment_slot)
+            if exists is not None:
+                return exists
         try:
             props = self.get_deployment_by_slot(cloud_service_name, deployment_slot)
         except Exception as e:
             if e.message != self.NOT_FOUND:
                 log.error(e)
-            return False
+                return False
+            props = None
+        if self.inventory is not None:
+            self.inventory.set_deployment(cloud_service_name, deployment_slot, props)
         return props is not None
 
+    def delete_deployment(self, cloud_service_name, deployment_name):
+        """
+        Delete deployment with its roles, disks and virtual hard disk blobs in one async operation
+        """
+        result = self.__governed(super(Service, self).delete_deployment,
+                                 cloud_service_name, deployment_name, delete_vhd=True)
+        self.__track(result, DEPLOYMENT, cloud_service_name)
+        return result
+
     def get_deployment_name(self, cloud_service_name, deployment_slot):
         try:
             props = self.get_deployment_by_slot(cloud_service_name, deployment_slot)
@@ -158,16 +263,19 @@ class Service(ServiceManagementService):
                                           network_config,
                                           virtual_machine_size,
                                           vm_image_name):
-        return super(Service, self).create_virtual_machine_deployment(cloud_service_name,
-                                                                      deployment_name,
-                                                                      deployment_slot,
-                                                                      virtual_machine_label,
-                                                                      virtual_machine_name,
-                                                                      system_config,
-                                                                      os_virtual_hard_disk,
-                                                                      network_config=network_config,
-                                                                      role_size=virtual_machine_size,
-                                                                      vm_image_name=vm_image_name)
+        result = self.__governed(super(Service, self).create_virtual_machine_deployment,
+                                 cloud_service_name,
+                                 deployment_name,
+                                 deployment_slot,
+                                 virtual_machine_label,
+                                 virtual_machine_name,
+                                 system_config,
+                                 os_virtual_hard_disk,
+                                 network_config=network_config,
+                                 role_size=virtual_machine_size,
+                                 vm_image_name=vm_image_name)
+        self.__track(result, DEPLOYMENT, cloud_service_name)
+        return result
 
     def get_virtual_machine_instance_status(self, deployment, virtual_machine_name):
         if deployment is not None and isinstance(deployment, Deployment):
@@ -176,6 +284,18 @@ class Service(ServiceManagementService):
                     return role_instance.instance_status
         return None
 
+    def get_virtual_machines_instance_status(self, deployment, virtual_machine_names):
+        """
+        Return status of given virtual machines from one deployment
+        :return: a dict of virtual machine name -> status, None if not found
+        """
+        status = dict.fromkeys(virtual_machine_names)
+        if deployment is not None and isinstance(deployment, Deployment):
+            for role_instance in deployment.role_instance_list:
+                if role_instance.instance_name in status:
+                    status[role_instance.instance_name] = role_instance.instance_status
+        return status
+
     def wait_for_virtual_machine(self,
                                  cloud_service_name,
                                  deployment_name,
@@ -200,10 +320,11 @@ class Service(ServiceManagementService):
                                               deployment_name,
                                               virtual_machine_name,
                                               network_config):
-        return super(Service, self).update_role(cloud_service_name,
-                                                deployment_name,
-                                                virtual_machine_name,
-                                                network_config=network_config)
+        return self.__governed(super(Service, self).update_role,
+                               cloud_service_name,
+                               deployment_name,
+                               virtual_machine_name,
+                               network_config=network_config)
 
     def get_virtual_machine_public_endpoint(self,
                                             cloud_service_name,
@@ -238,6 +359,11 @@ class Service(ServiceManagementService):
         return super(Service, self).get_role(cloud_service_name, deployment_name, role_name)
 
     def virtual_machine_exists(self, cloud_service_name, deployment_name, virtual_machine_name):
+        if self.inventory is not None:
+            exists = self.inventory.virtual_machine_exists(self, cloud_service_name, deployment_name,
+                                                           virtual_machine_name)
+            if exists is not None:
+                return exists
         try:
             props = self.get_virtual_machine(cloud_service_name, deployment_name, virtual_machine_name)
         except Exception as e:
@@ -255,14 +381,17 @@ class Service(ServiceManagementService):
                             network_config,
                             virtual_machine_size,
                             vm_image_name):
-        return super(Service, self).add_role(cloud_service_name,
-                                             deployment_name,
-                                             virtual_machine_name,
-                                             system_config,
-                                             os_virtual_hard_disk,
-                                             network_config=network_config,
-                                             role_size=virtual_machine_size,
-                                             vm_image_name=vm_image_name)
+        result = self.__governed(super(Service, self).add_role,
+                                 cloud_service_name,
+                                 deployment_name,
+                                 virtual_machine_name,
+                                 system_config,
+                                 os_virtual_hard_disk,
+                                 network_config=network_config,
+                                 role_size=virtual_machine_size,
+                                 vm_image_name=vm_image_name)
+        self.__track(result, DEPLOYMENT, cloud_service_name)
+        return result
 
     def get_virtual_machine_network_config(self, cloud_service_name, deployment_name, virtual_machine_name):
         try:
@@ -277,10 +406,41 @@ class Service(ServiceManagementService):
         return None
 
     def stop_virtual_machine(self, cloud_service_name, deployment_name, virtual_machine_name, type):
-        return super(Service, self).shutdown_role(cloud_service_name, deployment_name, virtual_machine_name, type)
+        return self.__governed(super(Service, self).shutdown_role,
+                               cloud_service_name, deployment_name, virtual_machine_name, type)
 
     def start_virtual_machine(self, cloud_service_name, deployment_name, virtual_machine_name):
-        return super(Service, self).start_role(cloud_service_name, deployment_name, virtual_machine_name)
+        return self.__governed(super(Service, self).start_role,
+                               cloud_service_name, deployment_name, virtual_machine_name)
+
+    def stop_virtual_machines(self, cloud_service_name, deployment_name, virtual_machine_names, type):
+        """
+        Stop virtual machines of a deployment in one async operation
+        """
+        return self.__governed(super(Service, self).shutdown_roles,
+                               cloud_service_name, deployment_name, virtual_machine_names, type)
+
+    def start_virtual_machines(self, cloud_service_name, deployment_name, virtual_machine_names):
+        """
+        Start virtual machines of a deployment in one async operation
+        """
+        return self.__governed(super(Service, self).start_roles,
+                               cloud_service_name, deployment_name, virtual_machine_names)
+
+    def delete_virtual_machine(self, cloud_service_name, deployment_name, virtual_machine_name):
+        """
+        Delete role from deployment, its os disk is kept and should be deleted by delete_disk afterwards
+        """
+        result = self.__governed(super(Service, self).delete_role,
+                                 cloud_service_name, deployment_name, virtual_machine_name)
+        self.__track(result, DEPLOYMENT, cloud_service_name)
+        return result
+
+    def delete_disk(self, disk_name):
+        """
+        Delete disk with its virtual hard disk blob
+        """
+        return self.__governed(super(Service, self).delete_disk, disk_name, delete_vhd=True)
 
     # ---------------------------------------- endpoint ---------------------------------------- #
 
@@ -290,16 +450,7 @@ class Service(ServiceManagementService):
         :param cloud_service_name:
         :return: endpoints: a list of int
         """
-        properties = self.get_hosted_service_properties(cloud_service_name, True)
-        endpoints = []
-        for deployment in properties.deployments.deployments:
-            for role in deployment.role_list.roles:
-                for configuration_set in role.configuration_sets.configuration_sets:
-                    if configuration_set.configuration_set_type == self.NETWORK_CONFIGURATION:
-                        if configuration_set.input_endpoints is not None:
-                            for input_endpoint in configuration_set.input_endpoints.input_endpoints:
-                                endpoints.append(input_endpoint.port)
-        return map(int, endpoints)
+        return self.get_hosted_service_summary(cloud_service_name)[0]
 
     # ---------------------------------------- other ---------------------------------------- #
 
@@ -313,15 +464,20 @@ class Service(ServiceManagementService):
         :return:
         """
         count = 0
-        result = self.get_operation_status(request_id)
-        while result.status == self.IN_PROGRESS:
-            log.debug('wait for async [%s] loop count [%d]' % (request_id, count))
-            count += 1
-            if count > loop:
-                log.error('Timed out waiting for async operation to complete.')
-                return False
-            time.sleep(second_per_loop)
+        try:
             result = self.get_operation_status(request_id)
+            while result.status == self.IN_PROGRESS:
+                log.debug('wait for async [%s] loop count [%d]' % (request_id, count))
+                count += 1
+                if count > loop:
+                    log.error('Timed out waiting for async operation to complete.')
+                    return False
+                time.sleep(second_per_loop)
+                result = self.get_operation_status(request_id)
+        finally:
+            # in-flight slot is released whether the operation completed, timed out or could not be queried
+            self.rate_limiter.release(request_id)
+            self.__settle(request_id)
         if result.status != self.SUCCEEDED:
             log.error(vars(result))
             if result.error:
@@ -331,51 +487,155 @@ class Service(ServiceManagementService):
             return False
         return True
 
+    def __governed(self, operation, *args, **kwargs):
+        """
+        Call azure mutation under rate limit and in-flight operation limit of azure subscription
+        Throttle errors slow down the rate limiter, and transient errors are counted by circuit breaker
+        :param operation: bound method of ServiceManagementService
+        :return: result of operation
+        """
+        open_seconds = self.circuit_breaker.get_open_seconds()
+        if open_seconds > 0:
+            raise CircuitOpenError('azure key [%s] circuit open for %d seconds' % (self.azure_key_id, open_seconds))
+        slot = self.rate_limiter.acquire()
+        try:
+            result = operation(*args, **kwargs)
+        except Exception as e:
+            self.rate_limiter.release_slot(slot)
+            error_type = RetryEngine.classify(e)
+            if error_type == AzureErrorType.THROTTLING:
+                self.rate_limiter.throttled()
+            self.circuit_breaker.record(error_type in RetryEngine.RETRYABLE)
+            raise
+        self.circuit_breaker.record(False)
+        # sync operation returns no request id
+        if result is not None and getattr(result, 'request_id', None) is not None:
+            self.rate_limiter.bind(slot, result.request_id)
+        else:
+            self.rate_limiter.release_slot(slot)
+        return result
+
+    def __track(self, result, resource_type, name):
+        """
+        Keep inventory of azure subscription up to date with our own mutation
+        """
+        if self.inventory is not None:
+            self.inventory.track(getattr(result, 'request_id', None), resource_type, name)
+
+    def __settle(self, request_id):
+        if self.inventory is not None:
+            self.inventory.settle(request_id)
+
+    def __parse_hosted_service_summary(self, body):
+        """
+        Collect input endpoint ports of network configuration sets and role instances from xml of cloud service
+        """
+        ports = []
+        role_instances = {}
+        # local names of open elements
+        path = []
+        configuration_set_type = None
+        role_instance = {}
+        for event, element in iterparse(BytesIO(body), events=('start', 'end')):
+            tag = element.tag.rsplit('}', 1)[-1]
+            if event == 'start':
+                path.append(tag)
+                continue
+            path.pop()
+            parent = path[-1] if path else None
+            if tag == 'ConfigurationSetType':
+                configuration_set_type = element.text
+            elif tag == 'Port' and parent == 'InputEndpoint':
+                if configuration_set_type == self.NETWORK_CONFIGURATION:
+                    ports.append(int(element.text))
+            elif parent == 'RoleInstance' and tag in ('InstanceName', 'InstanceStatus', 'IpAddress'):
+                role_instance[tag] = element.text
+            elif tag == 'Vip' and parent == 'InstanceEndpoint':
+                role_instance.setdefault(tag, element.text)
+            elif tag == 'RoleInstance':
+                role_instances[role_instance.get('InstanceName')] = (role_instance.get('InstanceStatus'),
+                                                                     role_instance.get('IpAddress'),
+                                                                     role_instance.get('Vip'))
+                role_instance = {}
+            elif tag == 'ConfigurationSet':
+                configuration_set_type = None
+            # drop what is read
+            if tag in ('RoleInstance', 'ConfigurationSet', 'Role', 'Deployment'):
+                element.clear()
+        return ports, role_instances
+
+    def __single_flight(self, key, read, *args):
+        """
+        Share identical read in flight of azure subscription
+        """
+        if self.single_flight is None:
+            return read(*args)
+        return self.single_flight.do(key, read, *args)
+
     # ---------------------------------------- call ---------------------------------------- #
 
     def query_async_operation_status(self, request_id,
-                                     true_mdl_cls_func, true_cls_args, true_func_args,
-                                     false_mdl_cls_func, false_cls_args, false_func_args):
+                                     true_task, true_cls_args, true_func_args,
+                                     false_task, false_cls_args, false_func_args):
         log.debug('query async operation status: request_id [%s]' % request_id)
         result = self.get_operation_status(request_id)
         if result.status == self.IN_PROGRESS:
             # query async operation status
-            run_job(MDL_CLS_FUNC[2],
+            run_job(TASKS['Service.query_async_operation_status'],
                     (self.azure_key_id, ),
                     (request_id,
-                     true_mdl_cls_func, true_cls_args, true_func_args,
-                     false_mdl_cls_func, false_cls_args, false_func_args),
+                     true_task, true_cls_args, true_func_args,
+                     false_task, false_cls_args, false_func_args),
                     ASYNC_TICK)
         elif result.status == self.SUCCEEDED:
-            run_job(true_mdl_cls_func, true_cls_args, true_func_args)
+            self.rate_limiter.release(request_id)
+            self.__settle(request_id)
+            run_job(true_task, true_cls_args, true_func_args)
         else:
-            run_job(false_mdl_cls_func, false_cls_args, false_func_args)
+            self.rate_limiter.release(request_id)
+            self.__settle(request_id)
+            run_job(false_task, false_cls_args, false_func_args)
 
     def query_deployment_status(self, cloud_service_name, deployment_name,
-                                true_mdl_cls_func, true_cls_args, true_func_args):
+                                true_task, true_cls_args, true_func_args):
         log.debug('query deployment status: deployment_name [%s]' % deployment_name)
         result = self.get_deployment_by_name(cloud_service_name, deployment_name)
         if result.status == ADStatus.RUNNING:
-            run_job(true_mdl_cls_func, true_cls_args, true_func_args)
+            run_job(true_task, true_cls_args, true_func_args)
         else:
             # query deployment status
-            run_job(MDL_CLS_FUNC[15],
+            run_job(TASKS['Service.query_deployment_status'],
                     (self.azure_key_id, ),
                     (cloud_service_name, deployment_name,
-                     true_mdl_cls_func, true_cls_args, true_func_args),
+                     true_task, true_cls_args, true_func_args),
                     DEPLOYMENT_TICK)
 
     def query_virtual_machine_status(self, cloud_service_name, deployment_name, virtual_machine_name, status,
-                                     true_mdl_cls_func, true_cls_args, true_func_args):
+                                     true_task, true_cls_args, true_func_args):
         log.debug('query virtual machine status: virtual_machine_name [%s]' % virtual_machine_name)
         deployment = self.get_deployment_by_name(cloud_service_name, deployment_name)
         result = self.get_virtual_machine_instance_status(deployment, virtual_machine_name)
         if result == status:
-            run_job(true_mdl_cls_func, true_cls_args, true_func_args)
+            run_job(true_task, true_cls_args, true_func_args)
         else:
             # query virtual machine status
-            run_job(MDL_CLS_FUNC[8],
+            run_job(TASKS['Service.query_virtual_machine_status'],
                     (self.azure_key_id, ),
                     (cloud_service_name, deployment_name, virtual_machine_name, status,
-                     true_mdl_cls_func, true_cls_args, true_func_args),
+                     true_task, true_cls_args, true_func_args),
+                    VIRTUAL_MACHINE_TICK)
+
+    def query_virtual_machines_status(self, cloud_service_name, deployment_name, virtual_machine_names, status,
+                                      true_task, true_cls_args, true_func_args):
+        log.debug('query virtual machines status: virtual_machine_names %s' % virtual_machine_names)
+        deployment = self.get_deployment_by_name(cloud_service_name, deployment_name)
+        result = self.get_virtual_machines_instance_status(deployment, virtual_machine_names)
+        if all(s == status for s in result.values()):
+            run_job(true_task, true_cls_args, true_func_args)
+        else:
+            # query virtual machines status
+            run_job(TASKS['Service.query_virtual_machines_status'],
+                    (self.azure_key_id, ),
+                    (cloud_service_name, deployment_name, virtual_machine_names, status,
+                     true_task, true_cls_args, true_func_args),
                     VIRTUAL_MACHINE_TICK)
\ No newline at end of file
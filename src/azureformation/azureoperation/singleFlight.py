@@ -0,0 +1,89 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.functions import (
+    safe_get_config,
+)
+from src.azureformation.metrics import (
+    metrics,
+)
+from threading import (
+    Event,
+    Lock,
+)
+
+
+class Flight(object):
+    """
+    A read in flight, whose result or error is shared by all callers of the same key
+    """
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesce identical concurrent reads of one azure subscription into a single request
+    The first caller of a key performs the read, and callers arriving while it is in flight wait for it and share
+    its result or error; nothing is kept once the read completes, so no stale data is ever served
+    Results are shared objects and must be treated as read-only by callers
+    Dedup ratio is azure.single_flight.shared / azure.single_flight.call
+    """
+    ENABLED = safe_get_config("azure.single_flight.enabled", True)
+    CALL = 'azure.single_flight.call'
+    SHARED = 'azure.single_flight.shared'
+    instances = {}
+    instances_lock = Lock()
+
+    @classmethod
+    def get(cls, azure_key_id):
+        """
+        Return the shared single flight of given azure key, None if disabled
+        :param azure_key_id:
+        :return:
+        """
+        if not cls.ENABLED:
+            return None
+        with cls.instances_lock:
+            if azure_key_id not in cls.instances:
+                cls.instances[azure_key_id] = SingleFlight(azure_key_id)
+            return cls.instances[azure_key_id]
+
+    def __init__(self, azure_key_id):
+        self.azure_key_id = azure_key_id
+        self.lock = Lock()
+        # key -> Flight
+        self.flights = {}
+
+    def do(self, key, function, *args):
+        """
+        Call function, or wait for the identical call in flight and share its result
+        :param key: hashable identity of the read, e.g. (method name, arguments)
+        :param function: the read
+        :return: result of function
+        """
+        metrics.incr(self.CALL)
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = Flight()
+                self.flights[key] = flight
+        if not leader:
+            metrics.incr(self.SHARED)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = function(*args)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                self.flights.pop(key, None)
+            flight.done.set()
+        return flight.result
@@ -0,0 +1,163 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.service import (
+    Service,
+)
+from src.azureformation.azureoperation.utility import (
+    TASKS,
+    run_job,
+)
+from src.azureformation.database import (
+    db_adapter,
+)
+from src.azureformation.database.models import (
+    AzureLog,
+    Experiment,
+)
+from src.azureformation.enum import (
+    ALOperation,
+    ALStatus,
+    AVMStatus,
+    EStatus,
+)
+from src.azureformation.functions import (
+    safe_get_config,
+)
+from src.azureformation.log import (
+    log,
+)
+from datetime import (
+    datetime,
+)
+
+
+class StopPolicy:
+    """
+    Choose stop mode of experiment: stopped virtual machines keep their cores reserved and resume fast, while
+    deallocated ones free cores for new starts but resume slowly
+    Experiment is kept stopped if it is expected to resume within RESUME_WINDOW seconds, judged by its past gaps
+    between stop and start at similar time of day, unless azure subscription is under quota pressure
+    Experiment kept stopped is downgraded to deallocated if it is not started within RESUME_WINDOW seconds
+    """
+    RESUME_WINDOW = safe_get_config("azure.stop_policy.resume_window", 1800)
+    QUOTA_PRESSURE = safe_get_config("azure.stop_policy.quota_pressure", 0.8)
+    # hours in utc, [start, end)
+    OFF_HOURS = safe_get_config("azure.stop_policy.off_hours", {"start": 22, "end": 7})
+    # gaps of stops within HOUR_WINDOW hours of day are preferred if there are at least MIN_HISTORY of them
+    HOUR_WINDOW = 2
+    MIN_HISTORY = 3
+    HISTORY = 20
+    CHOOSE_INFO = 'experiment [%d] stop mode %s: expected gap %s, core usage %.2f'
+
+    def __init__(self, azure_key_id):
+        self.azure_key_id = azure_key_id
+
+    def choose(self, experiment_id, now=None):
+        """
+        Choose stop mode of experiment
+        :param experiment_id:
+        :param now: utc time of stop, default now
+        :return: AVMStatus.STOPPED or AVMStatus.STOPPED_DEALLOCATED
+        """
+        now = now or datetime.utcnow()
+        usage = self.get_core_usage()
+        gap = self.get_expected_gap(experiment_id, now.hour)
+        if usage >= self.QUOTA_PRESSURE:
+            action = AVMStatus.STOPPED_DEALLOCATED
+        elif gap is None:
+            # no history, users seldom come back during off hours
+            action = AVMStatus.STOPPED_DEALLOCATED if self.is_off_hours(now.hour) else AVMStatus.STOPPED
+        elif gap > self.RESUME_WINDOW:
+            action = AVMStatus.STOPPED_DEALLOCATED
+        else:
+            action = AVMStatus.STOPPED
+        log.debug(self.CHOOSE_INFO % (experiment_id, action, gap, usage))
+        return action
+
+    def get_expected_gap(self, experiment_id, hour):
+        """
+        Median seconds from stop to next start of experiment, None if experiment has never resumed
+        :param experiment_id:
+        :param hour: hour of day of stop, gaps of stops around this hour are preferred
+        :return:
+        """
+        gaps = self.get_gaps(experiment_id)[-self.HISTORY:]
+        if not gaps:
+            return None
+        near = [g for h, g in gaps if min(abs(h - hour), 24 - abs(h - hour)) <= self.HOUR_WINDOW]
+        values = sorted(near if len(near) >= self.MIN_HISTORY else [g for h, g in gaps])
+        return values[len(values) / 2]
+
+    def get_gaps(self, experiment_id):
+        """
+        Gaps between end of stop and end of next start of experiment, in order of time
+        :param experiment_id:
+        :return: a list of (hour of day of stop, seconds)
+        """
+        logs = AzureLog.query.filter(AzureLog.experiment_id == experiment_id,
+                                     AzureLog.operation.in_([ALOperation.STOP_VIRTUAL_MACHINE,
+                                                             ALOperation.START_VIRTUAL_MACHINE]),
+                                     AzureLog.status == ALStatus.END).order_by(AzureLog.exec_time).all()
+        gaps = []
+        stop_time = None
+        for l in logs:
+            if l.operation == ALOperation.STOP_VIRTUAL_MACHINE:
+                # last virtual machine stopped
+                stop_time = l.exec_time
+            elif stop_time is not None:
+                gaps.append((stop_time.hour, (l.exec_time - stop_time).total_seconds()))
+                stop_time = None
+        return gaps
+
+    def get_core_usage(self):
+        """
+        Fraction of cores used in azure subscription, 0 if subscription could not be queried
+        """
+        try:
+            subscription = Service(self.azure_key_id).get_subscription()
+        except Exception as e:
+            log.error(e)
+            return 0
+        if subscription.max_core_count == 0:
+            return 1
+        return float(subscription.current_core_count) / subscription.max_core_count
+
+    def is_off_hours(self, hour):
+        start = self.OFF_HOURS["start"]
+        end = self.OFF_HOURS["end"]
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    def schedule_downgrade(self, experiment_id):
+        """
+        Deallocate experiment kept stopped if it is not started within RESUME_WINDOW seconds
+        :param experiment_id:
+        :return:
+        """
+        run_job(TASKS['StopPolicy.downgrade'],
+                (self.azure_key_id, ),
+                (experiment_id, self.__count_start(experiment_id)),
+                self.RESUME_WINDOW)
+
+    def downgrade(self, experiment_id, start_count):
+        """
+        :param experiment_id:
+        :param start_count: count of starts of experiment when downgrade was scheduled
+        :return:
+        """
+        e = db_adapter.get_object(Experiment, experiment_id)
+        # started (and maybe stopped again) in the meantime, or no longer stopped
+        if e is None or e.status != EStatus.Stopped or self.__count_start(experiment_id) != start_count:
+            return False
+        log.debug('experiment [%d] not resumed in %d seconds, deallocate it' % (experiment_id, self.RESUME_WINDOW))
+        run_job(TASKS['AzureFormation.stop'], (self.azure_key_id, ), (experiment_id, AVMStatus.STOPPED_DEALLOCATED))
+        return True
+
+    # --------------------------------------------- helper function ---------------------------------------------#
+
+    def __count_start(self, experiment_id):
+        return db_adapter.count_by(AzureLog,
+                                   experiment_id=experiment_id,
+                                   operation=ALOperation.START_VIRTUAL_MACHINE,
+                                   status=ALStatus.START)
@@ -3,12 +3,17 @@ __author__ = 'Yifu Huang'
 from src.azureformation.azureoperation.resourceBase import(
     ResourceBase,
 )
+from src.azureformation.azureoperation.provisionGraph import (
+    ProvisionGraph,
+)
 from src.azureformation.azureoperation.utility import (
     AZURE_FORMATION,
-    MDL_CLS_FUNC,
+    TASKS,
     commit_azure_log,
     commit_azure_storage_account,
     contain_azure_storage_account,
+    is_azure_storage_account_imported,
+    count_azure_virtual_hard_disk,
     delete_azure_storage_account,
     run_job,
 )
@@ -39,6 +44,15 @@ class StorageAccount(ResourceBase):
         '%s [%s] exist and created by %s before',
         '%s [%s] exist but not created by %s before',
     ]
+    DELETE_STORAGE_ACCOUNT_ERROR = [
+        '%s [%s] %s',
+    ]
+    DELETE_STORAGE_ACCOUNT_INFO = [
+        '%s [%s] deleted',
+        '%s [%s] not managed by %s, kept',
+        '%s [%s] still has %d disks, kept',
+        '%s [%s] not exist',
+    ]
     NEED_COUNT = 1
 
     def __init__(self, azure_key_id):
@@ -77,16 +91,23 @@ class StorageAccount(ResourceBase):
                                                              label,
                                                              location)
             except Exception as e:
+                # retry transient error on scheduler instead of failing experiment
+                if self.retry_engine.retry(experiment_id, ALOperation.CREATE_STORAGE_ACCOUNT, STORAGE_ACCOUNT, name, e,
+                                           TASKS['StorageAccount.create_storage_account'],
+                                           (self.azure_key_id, ), (experiment_id, template_unit)):
+                    return True
                 m = self.CREATE_STORAGE_ACCOUNT_ERROR[0] % (STORAGE_ACCOUNT, name, e.message)
                 commit_azure_log(experiment_id, ALOperation.CREATE_STORAGE_ACCOUNT, ALStatus.FAIL, m, 0)
                 log.error(e)
                 return False
             # query async operation status
-            run_job(MDL_CLS_FUNC[2],
+            run_job(TASKS['Service.query_async_operation_status'],
                     (self.azure_key_id, ),
                     (result.request_id,
-                     MDL_CLS_FUNC[3], (self.azure_key_id, ), (experiment_id, template_unit),
-                     MDL_CLS_FUNC[4], (self.azure_key_id, ), (experiment_id, template_unit)))
+                     TASKS['StorageAccount.create_storage_account_async_true'],
+                     (self.azure_key_id, ), (experiment_id, template_unit),
+                     TASKS['StorageAccount.create_storage_account_async_false'],
+                     (self.azure_key_id, ), (experiment_id, template_unit)))
         else:
             # check whether storage account created by azure formation before
             if contain_azure_storage_account(name):
@@ -97,8 +118,8 @@ class StorageAccount(ResourceBase):
                 commit_azure_storage_account(name, description, label, location, ASAStatus.ONLINE, experiment_id)
                 commit_azure_log(experiment_id, ALOperation.CREATE_STORAGE_ACCOUNT, ALStatus.END, m, 2)
             log.debug(m)
-            # create cloud service
-            run_job(MDL_CLS_FUNC[1], (self.azure_key_id,), (experiment_id, template_unit))
+            # create virtual machines depending on storage account, if their cloud services are ready too
+            ProvisionGraph(self.azure_key_id).launch(experiment_id)
         return True
 
     def create_storage_account_async_true(self, experiment_id, template_unit):
@@ -116,8 +137,8 @@ class StorageAccount(ResourceBase):
             commit_azure_storage_account(name, description, label, location, ASAStatus.ONLINE, experiment_id)
             commit_azure_log(experiment_id, ALOperation.CREATE_STORAGE_ACCOUNT, ALStatus.END, m, 0)
             log.debug(m)
-            # create cloud service
-            run_job(MDL_CLS_FUNC[1], (self.azure_key_id,), (experiment_id, template_unit))
+            # create virtual machines depending on storage account, if their cloud services are ready too
+            ProvisionGraph(self.azure_key_id).launch(experiment_id)
 
     def create_storage_account_async_false(self, experiment_id, template_unit):
         name = template_unit.get_storage_account_name()
@@ -129,6 +150,39 @@ class StorageAccount(ResourceBase):
     def update_storage_account(self):
         raise NotImplementedError
 
-    # todo delete storage account
-    def delete_storage_account(self):
-        raise NotImplementedError
\ No newline at end of file
+    def delete_storage_account(self, experiment_id, name):
+        """
+        Delete storage account created by azure formation once no disk of any experiment is placed in it
+        Storage account is deleted synchronously by azure
+        :return:
+        """
+        commit_azure_log(experiment_id, ALOperation.DELETE_STORAGE_ACCOUNT, ALStatus.START)
+        if not contain_azure_storage_account(name) or is_azure_storage_account_imported(name):
+            m = self.DELETE_STORAGE_ACCOUNT_INFO[1] % (STORAGE_ACCOUNT, name, AZURE_FORMATION)
+            commit_azure_log(experiment_id, ALOperation.DELETE_STORAGE_ACCOUNT, ALStatus.END, m, 1)
+            log.debug(m)
+            return True
+        count = count_azure_virtual_hard_disk(name)
+        if count > 0:
+            m = self.DELETE_STORAGE_ACCOUNT_INFO[2] % (STORAGE_ACCOUNT, name, count)
+            commit_azure_log(experiment_id, ALOperation.DELETE_STORAGE_ACCOUNT, ALStatus.END, m, 2)
+            log.debug(m)
+            return True
+        if not self.service.storage_account_exists(name):
+            m = self.DELETE_STORAGE_ACCOUNT_INFO[3] % (STORAGE_ACCOUNT, name)
+            delete_azure_storage_account(name)
+            commit_azure_log(experiment_id, ALOperation.DELETE_STORAGE_ACCOUNT, ALStatus.END, m, 3)
+            log.debug(m)
+            return True
+        try:
+            self.service.delete_storage_account(name)
+        except Exception as e:
+            m = self.DELETE_STORAGE_ACCOUNT_ERROR[0] % (STORAGE_ACCOUNT, name, e.message)
+            commit_azure_log(experiment_id, ALOperation.DELETE_STORAGE_ACCOUNT, ALStatus.FAIL, m, 0)
+            log.error(e)
+            return False
+        m = self.DELETE_STORAGE_ACCOUNT_INFO[0] % (STORAGE_ACCOUNT, name)
+        delete_azure_storage_account(name)
+        commit_azure_log(experiment_id, ALOperation.DELETE_STORAGE_ACCOUNT, ALStatus.END, m, 0)
+        log.debug(m)
+        return True
\ No newline at end of file
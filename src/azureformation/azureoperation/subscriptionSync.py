@@ -0,0 +1,301 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.service import (
+    Service,
+)
+from src.azureformation.azureoperation.utility import (
+    TASKS,
+    run_interval_job,
+    run_job,
+)
+from src.azureformation.database import (
+    db_adapter,
+    db_session,
+)
+from src.azureformation.database.models import (
+    AzureCloudService,
+    AzureDeployment,
+    AzureEndpoint,
+    AzureStorageAccount,
+    AzureSyncFingerprint,
+    AzureVirtualMachine,
+)
+from src.azureformation.enum import (
+    STORAGE_ACCOUNT,
+    CLOUD_SERVICE,
+    ACSStatus,
+    ASAStatus,
+)
+from src.azureformation.functions import (
+    safe_get_config,
+)
+from src.azureformation.log import (
+    log,
+)
+from src.azureformation.metrics import (
+    metrics,
+)
+from concurrent.futures import (
+    ThreadPoolExecutor,
+)
+from datetime import (
+    datetime,
+)
+import hashlib
+
+
+class SubscriptionSync:
+    """
+    Sync existing resources of azure subscription into database, so that templates could reuse them
+    Storage accounts and cloud services come from bulk list calls, and deployments, virtual machines and endpoints
+    of a cloud service from one detailed get of it, fetched in parallel
+    Fingerprint of every storage account and cloud service (with its deployments) is stored, and only resources
+    whose fingerprint changed are written, committed batch by batch
+    Rows created by experiments are left to their experiments; imported rows (without experiment) are updated,
+    and deleted once their resources are gone from azure subscription
+    """
+    TICK = safe_get_config("azure.subscription_sync.tick", 3600)
+    FETCHERS = safe_get_config("azure.subscription_sync.fetchers", 10)
+    BATCH_SIZE = safe_get_config("azure.subscription_sync.batch_size", 100)
+    JOB_ID = 'azure-subscription-sync-%d'
+    SYNC_INFO = 'subscription sync: azure key [%d] %d storage accounts and %d cloud services changed'
+    CHANGED = 'azure.subscription_sync.changed'
+    SKIPPED = 'azure.subscription_sync.skipped'
+
+    def __init__(self, azure_key_id):
+        self.azure_key_id = azure_key_id
+        self.service = Service(azure_key_id)
+
+    def schedule(self):
+        """
+        Sync azure subscription now and every TICK seconds
+        """
+        run_job(TASKS['SubscriptionSync.sync'], (self.azure_key_id, ), ())
+        run_interval_job(TASKS['SubscriptionSync.sync'], (self.azure_key_id, ), (),
+                         self.TICK, self.JOB_ID % self.azure_key_id)
+
+    def sync(self):
+        """
+        Sync storage accounts and cloud services of azure subscription into database
+        :return: count of storage accounts and cloud services changed
+        """
+        fingerprints = dict(((f.resource_type, f.name), f) for f in
+                            AzureSyncFingerprint.query.filter_by(azure_key_id=self.azure_key_id).all())
+        try:
+            storage_account_count = self.sync_storage_accounts(fingerprints)
+            cloud_service_count = self.sync_cloud_services(fingerprints)
+        except Exception:
+            db_adapter.rollback()
+            raise
+        log.debug(self.SYNC_INFO % (self.azure_key_id, storage_account_count, cloud_service_count))
+        return storage_account_count + cloud_service_count
+
+    def sync_storage_accounts(self, fingerprints):
+        storage_services = self.service.list_storage_accounts().storage_services
+        names = [s.service_name for s in storage_services]
+        rows = self.__find_rows(AzureStorageAccount, names)
+        count = 0
+        for storage_service in storage_services:
+            name = storage_service.service_name
+            properties = storage_service.storage_service_properties
+            fingerprint = self.__fingerprint(properties.description, properties.label, properties.location,
+                                             properties.status)
+            if not self.__is_changed(fingerprints, STORAGE_ACCOUNT, name, fingerprint):
+                continue
+            row = rows.get(name)
+            if row is None:
+                db_session.add(AzureStorageAccount(name=name,
+                                                   description=properties.description,
+                                                   label=properties.label,
+                                                   location=properties.location,
+                                                   status=ASAStatus.ONLINE))
+            elif row.experiment_id is None:
+                row.description = properties.description
+                row.label = properties.label
+                row.location = properties.location
+                row.last_modify_time = datetime.utcnow()
+            count += 1
+            if count % self.BATCH_SIZE == 0:
+                db_adapter.commit()
+        self.__delete_gone(fingerprints, STORAGE_ACCOUNT, AzureStorageAccount, names)
+        db_adapter.commit()
+        return count
+
+    def sync_cloud_services(self, fingerprints):
+        names = [h.service_name for h in self.service.list_hosted_services().hosted_services]
+        rows = self.__find_rows(AzureCloudService, names)
+        # cloud services created by experiments are left to them
+        fetch_names = [n for n in names if n not in rows or rows[n].experiment_id is None]
+        executor = ThreadPoolExecutor(self.FETCHERS)
+        try:
+            hosted_services = list(executor.map(self.__get_hosted_service, fetch_names))
+        finally:
+            executor.shutdown()
+        count = 0
+        for name, hosted_service in zip(fetch_names, hosted_services):
+            if hosted_service is None:
+                continue
+            fingerprint = self.__fingerprint(self.__describe(hosted_service))
+            if not self.__is_changed(fingerprints, CLOUD_SERVICE, name, fingerprint):
+                continue
+            self.__upsert_cloud_service(rows.get(name), hosted_service)
+            count += 1
+            if count % self.BATCH_SIZE == 0:
+                db_adapter.commit()
+        self.__delete_gone(fingerprints, CLOUD_SERVICE, AzureCloudService, names)
+        db_adapter.commit()
+        return count
+
+    # --------------------------------------------- helper function ---------------------------------------------#
+
+    def __get_hosted_service(self, name):
+        try:
+            return self.service.get_hosted_service_properties(name, True)
+        except Exception as e:
+            log.error(e)
+            return None
+
+    def __describe(self, hosted_service):
+        """
+        What is synced of cloud service, in a stable order
+        """
+        properties = hosted_service.hosted_service_properties
+        deployments = []
+        for deployment in hosted_service.deployments.deployments:
+            role_instances = sorted((r.instance_name, r.role_name, r.instance_status, r.ip_address,
+                                     self.__get_public_ip(r)) for r in deployment.role_instance_list)
+            endpoints = sorted((role_name, e.name, e.protocol, e.port, e.local_port)
+                               for role_name, endpoints in self.__get_input_endpoints(deployment).items()
+                               for e in endpoints)
+            deployments.append((deployment.name, deployment.deployment_slot, deployment.status, deployment.url,
+                                role_instances, endpoints))
+        return properties.label, properties.location, properties.status, sorted(deployments)
+
+    def __upsert_cloud_service(self, cloud_service, hosted_service):
+        now = datetime.utcnow()
+        properties = hosted_service.hosted_service_properties
+        if cloud_service is None:
+            cloud_service = AzureCloudService(name=hosted_service.service_name,
+                                              label=properties.label,
+                                              location=properties.location,
+                                              status=ACSStatus.CREATED)
+            db_session.add(cloud_service)
+            deployments = {}
+        else:
+            cloud_service.label = properties.label
+            cloud_service.location = properties.location
+            cloud_service.last_modify_time = now
+            deployments = dict((d.name, d) for d in
+                               AzureDeployment.query.filter_by(cloud_service_id=cloud_service.id).all())
+        for deployment in hosted_service.deployments.deployments:
+            row = deployments.pop(deployment.name, None)
+            if row is None:
+                row = AzureDeployment(name=deployment.name,
+                                      slot=deployment.deployment_slot,
+                                      status=deployment.status,
+                                      cloud_service=cloud_service)
+                db_session.add(row)
+                virtual_machines = {}
+            else:
+                row.slot = deployment.deployment_slot
+                row.status = deployment.status
+                row.last_modify_time = now
+                virtual_machines = dict((v.name, v) for v in
+                                        AzureVirtualMachine.query.filter_by(deployment_id=row.id).all())
+            input_endpoints = self.__get_input_endpoints(deployment)
+            for role_instance in deployment.role_instance_list:
+                self.__upsert_virtual_machine(virtual_machines.pop(role_instance.instance_name, None),
+                                              row, deployment, role_instance,
+                                              input_endpoints.get(role_instance.role_name, []))
+            # imported virtual machines gone from deployment
+            for virtual_machine in virtual_machines.values():
+                if virtual_machine.experiment_id is None:
+                    db_session.delete(virtual_machine)
+        # imported deployments gone from cloud service, cascade delete their virtual machines and endpoints
+        for deployment in deployments.values():
+            if deployment.experiment_id is None:
+                db_session.delete(deployment)
+
+    def __upsert_virtual_machine(self, virtual_machine, deployment_row, deployment, role_instance, input_endpoints):
+        if virtual_machine is None:
+            virtual_machine = AzureVirtualMachine(name=role_instance.instance_name, deployment=deployment_row)
+            db_session.add(virtual_machine)
+        elif virtual_machine.experiment_id is None:
+            AzureEndpoint.query.filter_by(virtual_machine_id=virtual_machine.id).delete(synchronize_session=False)
+            virtual_machine.last_modify_time = datetime.utcnow()
+        else:
+            # created by experiment
+            return
+        virtual_machine.label = role_instance.role_name
+        virtual_machine.status = role_instance.instance_status
+        virtual_machine.dns = deployment.url
+        virtual_machine.public_ip = self.__get_public_ip(role_instance)
+        virtual_machine.private_ip = role_instance.ip_address
+        for input_endpoint in input_endpoints:
+            db_session.add(AzureEndpoint(name=input_endpoint.name,
+                                         protocol=input_endpoint.protocol,
+                                         public_port=int(input_endpoint.port),
+                                         private_port=int(input_endpoint.local_port),
+                                         virtual_machine=virtual_machine))
+
+    def __get_input_endpoints(self, deployment):
+        """
+        Return a dict of role name -> a list of input endpoints
+        """
+        input_endpoints = {}
+        for role in deployment.role_list.roles:
+            for configuration_set in role.configuration_sets.configuration_sets:
+                if configuration_set.configuration_set_type == Service.NETWORK_CONFIGURATION and \
+                        configuration_set.input_endpoints is not None:
+                    input_endpoints.setdefault(role.role_name, []).extend(
+                        configuration_set.input_endpoints.input_endpoints)
+        return input_endpoints
+
+    def __get_public_ip(self, role_instance):
+        if role_instance.instance_endpoints is not None:
+            for instance_endpoint in role_instance.instance_endpoints:
+                return instance_endpoint.vip
+        return None
+
+    def __find_rows(self, ObjectClass, names):
+        rows = {}
+        for i in range(0, len(names), self.BATCH_SIZE):
+            for row in ObjectClass.query.filter(ObjectClass.name.in_(names[i:i + self.BATCH_SIZE])).all():
+                rows[row.name] = row
+        return rows
+
+    def __fingerprint(self, *values):
+        return hashlib.md5(repr(values)).hexdigest()
+
+    def __is_changed(self, fingerprints, resource_type, name, fingerprint):
+        """
+        Compare fingerprint with the one last synced, and record it if changed
+        """
+        row = fingerprints.get((resource_type, name))
+        if row is not None and row.fingerprint == fingerprint:
+            metrics.incr(self.SKIPPED)
+            return False
+        if row is None:
+            row = AzureSyncFingerprint(azure_key_id=self.azure_key_id, resource_type=resource_type, name=name)
+            db_session.add(row)
+            fingerprints[(resource_type, name)] = row
+        row.fingerprint = fingerprint
+        row.update_time = datetime.utcnow()
+        metrics.incr(self.CHANGED)
+        return True
+
+    def __delete_gone(self, fingerprints, resource_type, ObjectClass, names):
+        """
+        Delete imported rows and fingerprints of resources synced before but gone from azure subscription
+        """
+        names = set(names)
+        gone = [name for (t, name) in fingerprints.keys() if t == resource_type and name not in names]
+        for i in range(0, len(gone), self.BATCH_SIZE):
+            batch = gone[i:i + self.BATCH_SIZE]
+            ObjectClass.query.filter(ObjectClass.name.in_(batch),
+                                     ObjectClass.experiment_id.is_(None)).delete(synchronize_session=False)
+            AzureSyncFingerprint.query.filter(AzureSyncFingerprint.azure_key_id == self.azure_key_id,
+                                              AzureSyncFingerprint.resource_type == resource_type,
+                                              AzureSyncFingerprint.name.in_(batch)).delete(synchronize_session=False)
+        for name in gone:
+            fingerprints.pop((resource_type, name))
@@ -0,0 +1,157 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.log import (
+    log,
+)
+from src.azureformation.metrics import (
+    metrics,
+)
+from threading import (
+    local,
+)
+import importlib
+import time
+
+
+class Task(object):
+    """
+    A step of azure operation chains, i.e. a function of a class, registered once by a stable name
+    """
+
+    def __init__(self, name, mdl_name, cls_name, func_name, executor):
+        self.name = name
+        self.mdl_name = mdl_name
+        self.cls_name = cls_name
+        self.func_name = func_name
+        # alias of executor pool of scheduler running jobs of task
+        self.executor = executor
+        # resolved on first dispatch, or at startup by TaskRegistry.resolve
+        self.cls = None
+
+    def __repr__(self):
+        # stable across processes, since it is part of job keys
+        return 'Task(%s)' % self.name
+
+    def __eq__(self, other):
+        return isinstance(other, Task) and other.name == self.name
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __reduce__(self):
+        # jobs in persistent job store keep name only, and get the registered task back when loaded
+        return get_task, (self.name, )
+
+
+class TaskRegistry(object):
+    """
+    Registry of tasks by stable name 'ClassName.function_name'
+    A task is dispatched without importing its module or looking up its class again, and instances of a class
+    are reused per thread and class arguments, as classes of tasks keep no state besides what __init__ sets
+    Every dispatch is passed to timing hooks, the default one records time and errors of each task in metrics
+    """
+    TIME = 'azure.task.%s.time'
+    ERROR = 'azure.task.%s.error'
+
+    def __init__(self):
+        self.tasks = {}
+        self.hooks = [self.__record]
+        # per thread: (class, class arguments) -> instance
+        self.instances = local()
+
+    def register(self, mdl_name, cls_name, func_name, executor):
+        """
+        Register function of class, whose module need not be imported yet
+        :param mdl_name:
+        :param cls_name:
+        :param func_name:
+        :param executor: alias of executor pool of scheduler running jobs of task
+        :return: task
+        """
+        name = '%s.%s' % (cls_name, func_name)
+        if name in self.tasks:
+            raise ValueError('task [%s] is already registered' % name)
+        task = Task(name, mdl_name, cls_name, func_name, executor)
+        self.tasks[name] = task
+        return task
+
+    def __getitem__(self, name):
+        return self.tasks[name]
+
+    def get_tasks(self):
+        return self.tasks.values()
+
+    def add_hook(self, hook):
+        """
+        :param hook: called with (task, seconds, error) after every dispatch, error is None if task succeeded
+        :return:
+        """
+        self.hooks.append(hook)
+
+    def resolve(self):
+        """
+        Resolve classes of all tasks, called once at startup when all modules could be imported
+        """
+        for task in self.tasks.values():
+            self.__resolve(task)
+
+    def dispatch(self, task, cls_args, func_args):
+        """
+        Call function of task on instance of its class
+        :param task:
+        :param cls_args: arguments to construct instance
+        :param func_args: arguments of function
+        :return:
+        """
+        log.debug('dispatch: task [%s]' % task.name)
+        start = time.time()
+        error = None
+        try:
+            getattr(self.__get_instance(task, cls_args), task.func_name)(*func_args)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            seconds = time.time() - start
+            for hook in self.hooks:
+                try:
+                    hook(task, seconds, error)
+                except Exception as e:
+                    log.error(e)
+
+    # --------------------------------------------- helper function ---------------------------------------------#
+
+    def __resolve(self, task):
+        if task.cls is None:
+            task.cls = getattr(importlib.import_module(task.mdl_name), task.cls_name)
+        return task.cls
+
+    def __get_instance(self, task, cls_args):
+        cls = self.__resolve(task)
+        cache = getattr(self.instances, 'cache', None)
+        if cache is None:
+            cache = self.instances.cache = {}
+        key = (cls, tuple(cls_args))
+        instance = cache.get(key)
+        if instance is None:
+            instance = cls(*cls_args)
+            cache[key] = instance
+        return instance
+
+    def __record(self, task, seconds, error):
+        metrics.observe(self.TIME % task.name, seconds)
+        if error is not None:
+            metrics.incr(self.ERROR % task.name)
+
+
+# the registry of all tasks, see utility.py for registration
+TASKS = TaskRegistry()
+
+
+def get_task(name):
+    # tasks are registered by utility.py, which is not necessarily imported yet when jobs are loaded
+    importlib.import_module('src.azureformation.azureoperation.utility')
+    return TASKS[name]
@@ -1,6 +1,10 @@
 __author__ = 'Yifu Huang'
 
 from src.azureformation.azureoperation.utility import (
+    get_azure_virtual_hard_disk,
+    get_azure_virtual_machine_placement,
+    get_experiment_subscription_suffix,
+    get_virtual_machine_name,
     load_template_from_experiment,
     set_template_virtual_environment_count,
 )
@@ -13,8 +17,24 @@ class TemplateFramework():
     VIRTUAL_ENVIRONMENTS = 'virtual_environments'
 
     def __init__(self, experiment_id):
+        self.experiment_id = experiment_id
         self.template = load_template_from_experiment(experiment_id)
         set_template_virtual_environment_count(experiment_id, len(self.template[self.VIRTUAL_ENVIRONMENTS]))
+        self.suffix = get_experiment_subscription_suffix(experiment_id)
 
     def get_template_units(self):
-        return map(TemplateUnit, self.template[self.VIRTUAL_ENVIRONMENTS])
+        template_units = map(TemplateUnit, self.template[self.VIRTUAL_ENVIRONMENTS])
+        if self.suffix is not None:
+            for template_unit in template_units:
+                template_unit.add_name_suffix(self.suffix)
+        # follow cloud service the virtual machine is packed into, if any
+        for template_unit in template_units:
+            virtual_machine_name = get_virtual_machine_name(self.experiment_id, template_unit)
+            placement = get_azure_virtual_machine_placement(self.experiment_id, virtual_machine_name)
+            if placement is not None:
+                template_unit.set_cloud_service_name(placement.cloud_service_name)
+            # follow storage account the os virtual hard disk is placed in, if any
+            disk = get_azure_virtual_hard_disk(template_unit.get_cloud_service_name(), virtual_machine_name)
+            if disk is not None:
+                template_unit.set_storage_account_name(disk.storage_account_name)
+        return template_units
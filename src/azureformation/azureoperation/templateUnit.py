@@ -72,10 +72,19 @@ class TemplateUnit:
     # other constants
     BLOB_BASE = '%s-%s-%s-%s-%s-%s-%s-%s.vhd'
     MEDIA_BASE = 'https://%s.%s/%s/%s'
+    STORAGE_ACCOUNT_NAME_LENGTH = 24
+    CLOUD_SERVICE_NAME_BASE = '%s-%s'
 
     def __init__(self, virtual_environment):
         self.virtual_environment = virtual_environment
 
+    def __repr__(self):
+        # identifies the unit in job keys, so keep it stable and free of credentials
+        return '%s: %s/%s/%s' % (self.__class__.__name__,
+                                 self.get_cloud_service_name(),
+                                 self.get_deployment_slot(),
+                                 self.get_virtual_machine_name())
+
     def get_image_type(self):
         return self.virtual_environment[self.T_I][self.T_I_T]
 
@@ -171,9 +180,15 @@ class TemplateUnit:
             )
         return network_config
 
+    def get_input_endpoint_count(self):
+        return len(self.virtual_environment[self.T_NC][self.T_NC_IE])
+
     def get_storage_account_name(self):
         return self.virtual_environment[self.T_SA][self.T_SA_SN]
 
+    def set_storage_account_name(self, name):
+        self.virtual_environment[self.T_SA][self.T_SA_SN] = name
+
     def get_storage_account_description(self):
         return self.virtual_environment[self.T_SA][self.T_SA_D]
 
@@ -186,6 +201,20 @@ class TemplateUnit:
     def get_cloud_service_name(self):
         return self.virtual_environment[self.T_CS][self.T_CS_SN]
 
+    def set_cloud_service_name(self, name):
+        self.virtual_environment[self.T_CS][self.T_CS_SN] = name
+
+    def add_name_suffix(self, suffix):
+        """
+        Make names of storage account and cloud service unique in another azure subscription,
+        since these names are global in azure
+        :param suffix: str
+        :return:
+        """
+        name = self.get_storage_account_name()
+        self.set_storage_account_name(name[:self.STORAGE_ACCOUNT_NAME_LENGTH - len(suffix)] + suffix)
+        self.set_cloud_service_name(self.CLOUD_SERVICE_NAME_BASE % (self.get_cloud_service_name(), suffix))
+
     def get_cloud_service_label(self):
         return self.virtual_environment[self.T_CS][self.T_CS_LA]
 
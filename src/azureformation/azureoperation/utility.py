@@ -5,7 +5,10 @@ from src.azureformation.database import (
 )
 from src.azureformation.database.models import (
     AzureLog,
+    AzureProvisionJournal,
     AzureStorageAccount,
+    AzureVirtualHardDisk,
+    AzureVirtualMachinePlacement,
     AzureCloudService,
     AzureDeployment,
     AzureVirtualMachine,
@@ -13,13 +16,29 @@ from src.azureformation.database.models import (
     VirtualEnvironment,
     Template,
     Experiment,
+    HackathonAzureKey,
+)
+from src.azureformation.azureoperation.taskRegistry import (
+    TASKS,
 )
 from src.azureformation.functions import (
     load_template,
-    call,
+    safe_get_config,
 )
 from src.azureformation.scheduler import (
+    JOB_CANCELLED,
+    JOB_COALESCED,
+    EXECUTOR_POLL,
+    EXECUTOR_MUTATION,
+    EXECUTOR_DB,
     scheduler,
+    is_overloaded,
+)
+from src.azureformation.metrics import (
+    metrics,
+)
+from src.azureformation.log import (
+    log,
 )
 from src.azureformation.enum import (
     ALStatus,
@@ -31,10 +50,15 @@ from azure.servicemanagement import (
     ConfigurationSet,
     ConfigurationSetInputEndpoint,
 )
+from apscheduler.jobstores.base import (
+    ConflictingIdError,
+    JobLookupError,
+)
 from datetime import (
     datetime,
     timedelta,
 )
+import hashlib
 # -------------------------------------------------- constants --------------------------------------------------#
 # project name
 AZURE_FORMATION = 'Azure Formation'
@@ -46,40 +70,126 @@ DEPLOYMENT_LOOP = 60
 VIRTUAL_MACHINE_TICK = 30
 VIRTUAL_MACHINE_LOOP = 60
 PORT_BOUND = 65536
+# virtual machine name: role name in template and id of experiment it is created for
+VIRTUAL_MACHINE_NAME_BASE = '%s-%d'
 # endpoint constants
 ENDPOINT_PREFIX = 'AUTO-'
 ENDPOINT_PROTOCOL = 'TCP'
 # module base
 MDL_BASE = 'src.azureformation.azureoperation.'
-# module name, class name and function name
-MDL_CLS_FUNC = [
-    [MDL_BASE + 'storageAccount', 'StorageAccount', 'create_storage_account'],
-    [MDL_BASE + 'cloudService', 'CloudService', 'create_cloud_service'],
-    [MDL_BASE + 'service', 'Service', 'query_async_operation_status'],
-    [MDL_BASE + 'storageAccount', 'StorageAccount', 'create_storage_account_async_true'],
-    [MDL_BASE + 'storageAccount', 'StorageAccount', 'create_storage_account_async_false'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_async_true_1'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_async_false_1'],
-    [MDL_BASE + 'service', 'Service', 'query_virtual_machine_status'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_vm_true_1'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_async_true_2'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_async_false_2'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_vm_true_2'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_async_true_3'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_async_false_3'],
-    [MDL_BASE + 'service', 'Service', 'query_deployment_status'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_dm_true'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'stop_virtual_machine'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'stop_virtual_machine_async_true'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'stop_virtual_machine_async_false'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'stop_virtual_machine_vm_true'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'start_virtual_machine'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'start_virtual_machine_async_true'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'start_virtual_machine_async_false'],
-    [MDL_BASE + 'virtualMachine', 'VirtualMachine', 'start_virtual_machine_vm_true'],
+# tasks of azure operation chains, registered by name 'ClassName.function_name': module, class, function and
+# executor pool running its jobs: polls to poll pool, continuations only doing db bookkeeping to db pool, and others
+# (which call azure mutations) to mutation pool
+TASKS.register(MDL_BASE + 'storageAccount', 'StorageAccount', 'create_storage_account', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'cloudService', 'CloudService', 'create_cloud_service', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'service', 'Service', 'query_async_operation_status', EXECUTOR_POLL)
+TASKS.register(MDL_BASE + 'storageAccount', 'StorageAccount', 'create_storage_account_async_true', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'storageAccount', 'StorageAccount', 'create_storage_account_async_false', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_async_true_1', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_async_false_1', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'service', 'Service', 'query_virtual_machine_status', EXECUTOR_POLL)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_vm_true_1', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_async_true_2', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_async_false_2', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_vm_true_2', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_async_true_3', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_async_false_3', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'service', 'Service', 'query_deployment_status', EXECUTOR_POLL)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'create_virtual_machine_dm_true', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'stop_virtual_machine', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'stop_virtual_machine_async_true', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'stop_virtual_machine_async_false', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'stop_virtual_machine_vm_true', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'start_virtual_machine', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'start_virtual_machine_async_true', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'start_virtual_machine_async_false', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'start_virtual_machine_vm_true', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'networkConfigQueue', 'NetworkConfigQueue', 'flush', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'networkConfigQueue', 'NetworkConfigQueue', 'flush_async_true', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'networkConfigQueue', 'NetworkConfigQueue', 'flush_async_false', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'networkConfigQueue', 'NetworkConfigQueue', 'flush_vm_true', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'warmPool', 'WarmPool', 'refill', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'azureFormation', 'AzureFormation', 'create', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'azureFormation', 'AzureFormation', 'stop', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'azureFormation', 'AzureFormation', 'start', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'warmPool', 'WarmPool', 'set_size', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'service', 'Service', 'query_virtual_machines_status', EXECUTOR_POLL)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'stop_virtual_machines', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'stop_virtual_machines_async_true', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'stop_virtual_machines_async_false', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'stop_virtual_machines_vm_true', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'start_virtual_machines', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'start_virtual_machines_async_true', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'start_virtual_machines_async_false', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'start_virtual_machines_vm_true', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'delete_virtual_machines', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'delete_virtual_machines_async_true', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'delete_virtual_machines_async_false', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'virtualMachine', 'VirtualMachine', 'delete_virtual_machine_disk', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'cloudService', 'CloudService', 'delete_cloud_service', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'cloudService', 'CloudService', 'delete_cloud_service_async_true', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'cloudService', 'CloudService', 'delete_cloud_service_async_false', EXECUTOR_DB)
+TASKS.register(MDL_BASE + 'storageAccount', 'StorageAccount', 'delete_storage_account', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'azureFormation', 'AzureFormation', 'delete', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'azureFormation', 'AzureFormation', 'rollback', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'reaper', 'Reaper', 'reap', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'stopPolicy', 'StopPolicy', 'downgrade', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'provisionJournal', 'ProvisionJournal', 'resume', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'reconciler', 'Reconciler', 'reconcile', EXECUTOR_MUTATION)
+TASKS.register(MDL_BASE + 'subscriptionSync', 'SubscriptionSync', 'sync', EXECUTOR_MUTATION)
+# poll jobs which could be coalesced when scheduler is overloaded
+POLL_TASKS = [
+    TASKS['Service.query_async_operation_status'],
+    TASKS['Service.query_virtual_machine_status'],
+    TASKS['Service.query_deployment_status'],
+    TASKS['Service.query_virtual_machines_status'],
+]
+# jobs of an experiment (taking experiment id as first argument) which are skipped once experiment is cancelled,
+# teardown jobs are not among them
+CANCELLABLE_TASKS = [
+    TASKS['StorageAccount.create_storage_account'],
+    TASKS['CloudService.create_cloud_service'],
+    TASKS['StorageAccount.create_storage_account_async_true'],
+    TASKS['StorageAccount.create_storage_account_async_false'],
+    TASKS['VirtualMachine.create_virtual_machine'],
+    TASKS['VirtualMachine.create_virtual_machine_async_true_1'],
+    TASKS['VirtualMachine.create_virtual_machine_async_false_1'],
+    TASKS['VirtualMachine.create_virtual_machine_vm_true_1'],
+    TASKS['VirtualMachine.create_virtual_machine_async_true_2'],
+    TASKS['VirtualMachine.create_virtual_machine_async_false_2'],
+    TASKS['VirtualMachine.create_virtual_machine_vm_true_2'],
+    TASKS['VirtualMachine.create_virtual_machine_async_true_3'],
+    TASKS['VirtualMachine.create_virtual_machine_async_false_3'],
+    TASKS['VirtualMachine.create_virtual_machine_dm_true'],
+    TASKS['VirtualMachine.stop_virtual_machine'],
+    TASKS['VirtualMachine.stop_virtual_machine_async_true'],
+    TASKS['VirtualMachine.stop_virtual_machine_async_false'],
+    TASKS['VirtualMachine.stop_virtual_machine_vm_true'],
+    TASKS['VirtualMachine.start_virtual_machine'],
+    TASKS['VirtualMachine.start_virtual_machine_async_true'],
+    TASKS['VirtualMachine.start_virtual_machine_async_false'],
+    TASKS['VirtualMachine.start_virtual_machine_vm_true'],
+    TASKS['AzureFormation.create'],
+    TASKS['AzureFormation.stop'],
+    TASKS['AzureFormation.start'],
+    TASKS['VirtualMachine.stop_virtual_machines'],
+    TASKS['VirtualMachine.stop_virtual_machines_async_true'],
+    TASKS['VirtualMachine.stop_virtual_machines_async_false'],
+    TASKS['VirtualMachine.stop_virtual_machines_vm_true'],
+    TASKS['VirtualMachine.start_virtual_machines'],
+    TASKS['VirtualMachine.start_virtual_machines_async_true'],
+    TASKS['VirtualMachine.start_virtual_machines_async_false'],
+    TASKS['VirtualMachine.start_virtual_machines_vm_true'],
+    TASKS['StopPolicy.downgrade'],
 ]
 DEFAULT_TICK = 3
+# rollback of failed experiments, see AzureFormation.rollback
+TEARDOWN_ROLLBACK = safe_get_config("azure.teardown.rollback", True)
+TEARDOWN_ROLLBACK_DELAY = safe_get_config("azure.teardown.rollback_delay", 60)
+TEARDOWN_CANCEL_DELAY = safe_get_config("azure.teardown.cancel_delay", 60)
+# experiments being torn down, whose pending provisioning jobs are skipped and which are never done any more
+ABORTED_STATUS = [EStatus.Cancelled, EStatus.Rollbacking, EStatus.Rollbacked]
 
 
 # -------------------------------------------------- azure log --------------------------------------------------#
@@ -91,8 +201,17 @@ def commit_azure_log(experiment_id, operation, status, note=None, code=None):
                                  note=note,
                                  code=code)
     db_adapter.commit()
-    if status == ALStatus.FAIL:
+    if operation.startswith(ALOperation.DELETE):
+        if operation == ALOperation.DELETE_VIRTUAL_MACHINE and status in [ALStatus.END, ALStatus.FAIL]:
+            check_experiment_deleted(experiment_id)
+    elif status == ALStatus.FAIL:
+        # steps still in flight may fail while experiment is rolled back or cancelled
+        if db_adapter.get_object(Experiment, experiment_id).status in ABORTED_STATUS:
+            return
         update_experiment_status(experiment_id, EStatus.Failed)
+        if operation.startswith(ALOperation.CREATE) and TEARDOWN_ROLLBACK:
+            # stop concurrent steps and tear down what was provisioned before failure
+            run_job(TASKS['AzureFormation.rollback'], (), (experiment_id, ))
     elif status == ALStatus.END:
         need_status = EStatus.Running
         if operation == ALOperation.STOP_VIRTUAL_MACHINE:
@@ -100,6 +219,51 @@ def commit_azure_log(experiment_id, operation, status, note=None, code=None):
         check_experiment_done(experiment_id, need_status)
 
 
+def is_azure_operation_pending(experiment_id, operation):
+    """
+    Whether operation of experiment is still in progress, i.e. it has more starts than ends and failures in azure log
+    """
+    started = db_adapter.count_by(AzureLog,
+                                  experiment_id=experiment_id,
+                                  operation=operation,
+                                  status=ALStatus.START)
+    finished = db_adapter.count(AzureLog,
+                                AzureLog.experiment_id == experiment_id,
+                                AzureLog.operation == operation,
+                                AzureLog.status.in_([ALStatus.END, ALStatus.FAIL]))
+    return started > finished
+
+
+# ------------------------------------------- azure provision journal -------------------------------------------#
+def commit_provision_journal(experiment_id, template_unit, step):
+    """
+    Record step as last completed provisioning step of virtual machine of template unit
+    :param experiment_id:
+    :param template_unit:
+    :param step: PJStep in enum.py
+    :return:
+    """
+    virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
+    journal = db_adapter.find_first_object_by(AzureProvisionJournal,
+                                              experiment_id=experiment_id,
+                                              virtual_machine_name=virtual_machine_name)
+    if journal is None:
+        db_adapter.add_object_kwargs(AzureProvisionJournal,
+                                     experiment_id=experiment_id,
+                                     virtual_machine_name=virtual_machine_name,
+                                     step=step)
+    else:
+        db_adapter.update_object(journal, step=step, update_time=datetime.utcnow())
+    db_adapter.commit()
+
+
+def get_provision_journal_step(experiment_id, virtual_machine_name):
+    journal = db_adapter.find_first_object_by(AzureProvisionJournal,
+                                              experiment_id=experiment_id,
+                                              virtual_machine_name=virtual_machine_name)
+    return journal.step if journal is not None else None
+
+
 # --------------------------------------------- azure storage account ---------------------------------------------#
 def commit_azure_storage_account(name, description, label, location, status, experiment_id):
     db_adapter.add_object_kwargs(AzureStorageAccount,
@@ -116,11 +280,56 @@ def contain_azure_storage_account(name):
     return db_adapter.count_by(AzureStorageAccount, name=name) != 0
 
 
+def is_azure_storage_account_imported(name):
+    """
+    Whether storage account is imported by subscription sync, rather than created for an experiment
+    :param name:
+    :return:
+    """
+    return db_adapter.count_by(AzureStorageAccount, name=name, experiment_id=None) != 0
+
+
 def delete_azure_storage_account(name):
     db_adapter.delete_all_objects_by(AzureStorageAccount, name=name)
     db_adapter.commit()
 
 
+# --------------------------------------------- azure virtual hard disk ---------------------------------------------#
+def commit_azure_virtual_hard_disk(storage_account_name, cloud_service_name, virtual_machine_name, experiment_id):
+    db_adapter.add_object_kwargs(AzureVirtualHardDisk,
+                                 storage_account_name=storage_account_name,
+                                 cloud_service_name=cloud_service_name,
+                                 virtual_machine_name=virtual_machine_name,
+                                 experiment_id=experiment_id)
+    db_adapter.commit()
+
+
+def count_azure_virtual_hard_disk(storage_account_name):
+    return db_adapter.count_by(AzureVirtualHardDisk, storage_account_name=storage_account_name)
+
+
+def update_azure_virtual_hard_disk_media_link(cloud_service_name, virtual_machine_name, media_link):
+    disk = db_adapter.find_first_object_by(AzureVirtualHardDisk,
+                                           cloud_service_name=cloud_service_name,
+                                           virtual_machine_name=virtual_machine_name)
+    if disk is not None:
+        db_adapter.update_object(disk, media_link=media_link)
+        db_adapter.commit()
+
+
+def get_azure_virtual_hard_disk(cloud_service_name, virtual_machine_name):
+    return db_adapter.find_first_object_by(AzureVirtualHardDisk,
+                                           cloud_service_name=cloud_service_name,
+                                           virtual_machine_name=virtual_machine_name)
+
+
+def delete_azure_virtual_hard_disk(cloud_service_name, virtual_machine_name):
+    db_adapter.delete_all_objects_by(AzureVirtualHardDisk,
+                                     cloud_service_name=cloud_service_name,
+                                     virtual_machine_name=virtual_machine_name)
+    db_adapter.commit()
+
+
 # --------------------------------------------- azure cloud service ---------------------------------------------#
 def commit_azure_cloud_service(name, label, location, status, experiment_id):
     db_adapter.add_object_kwargs(AzureCloudService,
@@ -136,11 +345,78 @@ def contain_azure_cloud_service(name):
     return db_adapter.count_by(AzureCloudService, name=name) != 0
 
 
+def is_azure_cloud_service_imported(name):
+    """
+    Whether cloud service is imported by subscription sync, rather than created for an experiment
+    :param name:
+    :return:
+    """
+    return db_adapter.count_by(AzureCloudService, name=name, experiment_id=None) != 0
+
+
 def delete_azure_cloud_service(name):
     db_adapter.delete_all_objects_by(AzureCloudService, name=name)
     db_adapter.commit()
 
 
+def is_azure_cloud_service_in_use(name):
+    """
+    Whether any virtual machine is created or placed in cloud service
+    :param name:
+    :return:
+    """
+    if db_adapter.count_by(AzureVirtualMachinePlacement, cloud_service_name=name) != 0:
+        return True
+    return AzureVirtualMachine.query.join(AzureDeployment).join(AzureCloudService).filter(
+        AzureCloudService.name == name).count() != 0
+
+
+# --------------------------------------------- azure virtual machine placement ---------------------------------------#
+def commit_azure_virtual_machine_placement(cloud_service_name, deployment_slot, virtual_machine_name, endpoint_count,
+                                           experiment_id):
+    db_adapter.add_object_kwargs(AzureVirtualMachinePlacement,
+                                 cloud_service_name=cloud_service_name,
+                                 deployment_slot=deployment_slot,
+                                 virtual_machine_name=virtual_machine_name,
+                                 endpoint_count=endpoint_count,
+                                 experiment_id=experiment_id)
+    db_adapter.commit()
+
+
+def get_azure_virtual_machine_placement(experiment_id, virtual_machine_name):
+    return db_adapter.find_first_object_by(AzureVirtualMachinePlacement,
+                                           experiment_id=experiment_id,
+                                           virtual_machine_name=virtual_machine_name)
+
+
+def get_azure_cloud_service_usage(cloud_service_name, deployment_slot):
+    """
+    Return (role count, endpoint count) of deployment, including virtual machines placed but not created yet
+    and virtual machines not placed by azure formation
+    :param cloud_service_name:
+    :param deployment_slot:
+    :return:
+    """
+    placements = db_adapter.find_all_objects_by(AzureVirtualMachinePlacement,
+                                                cloud_service_name=cloud_service_name,
+                                                deployment_slot=deployment_slot)
+    virtual_machines = AzureVirtualMachine.query.join(AzureDeployment).join(AzureCloudService).filter(
+        AzureCloudService.name == cloud_service_name,
+        AzureDeployment.slot == deployment_slot)
+    endpoints = AzureEndpoint.query.join(AzureVirtualMachine).join(AzureDeployment).join(AzureCloudService).filter(
+        AzureCloudService.name == cloud_service_name,
+        AzureDeployment.slot == deployment_slot)
+    return (max(len(placements), virtual_machines.count()),
+            max(sum(p.endpoint_count for p in placements), endpoints.count()))
+
+
+def delete_azure_virtual_machine_placement(experiment_id, virtual_machine_name):
+    db_adapter.delete_all_objects_by(AzureVirtualMachinePlacement,
+                                     experiment_id=experiment_id,
+                                     virtual_machine_name=virtual_machine_name)
+    db_adapter.commit()
+
+
 # --------------------------------------------- azure deployment ---------------------------------------------#
 def commit_azure_deployment(name, slot, status, cloud_service_name, experiment_id):
     cs = db_adapter.find_first_object_by(AzureCloudService, name=cloud_service_name)
@@ -160,6 +436,13 @@ def contain_azure_deployment(cloud_service_name, deployment_slot):
                                cloud_service_id=cs.id) != 0
 
 
+def delete_azure_deployment_by_name(cloud_service_name, deployment_name):
+    cs = db_adapter.find_first_object_by(AzureCloudService, name=cloud_service_name)
+    if cs is not None:
+        db_adapter.delete_all_objects_by(AzureDeployment, name=deployment_name, cloud_service_id=cs.id)
+        db_adapter.commit()
+
+
 def delete_azure_deployment(cloud_service_name, deployment_slot):
     cs = db_adapter.find_first_object_by(AzureCloudService, name=cloud_service_name)
     db_adapter.delete_all_objects_by(AzureDeployment,
@@ -195,6 +478,21 @@ def contain_azure_virtual_machine(cloud_service_name, deployment_name, virtual_m
                                deployment_id=dm.id) != 0
 
 
+def get_virtual_machine_name(experiment_id, template_unit):
+    """
+    Return name of virtual machine of template unit in experiment
+    Virtual machine handed over from warm pool keeps the name it is created with, so look up database first
+    :param experiment_id:
+    :param template_unit:
+    :return:
+    """
+    role_name = template_unit.get_virtual_machine_name()
+    for vm in db_adapter.find_all_objects_by(AzureVirtualMachine, experiment_id=experiment_id):
+        if vm.name.rsplit('-', 1)[0] == role_name:
+            return vm.name
+    return VIRTUAL_MACHINE_NAME_BASE % (role_name, experiment_id)
+
+
 def delete_azure_virtual_machine(cloud_service_name, deployment_name, virtual_machine_name):
     cs = db_adapter.find_first_object_by(AzureCloudService, name=cloud_service_name)
     dm = db_adapter.find_first_object_by(AzureDeployment, name=deployment_name, cloud_service=cs)
@@ -204,6 +502,29 @@ def delete_azure_virtual_machine(cloud_service_name, deployment_name, virtual_ma
     db_adapter.commit()
 
 
+def delete_experiment_virtual_machine(experiment_id, virtual_machine_name):
+    """
+    Delete database rows of a deleted virtual machine of experiment, and mark its virtual environment deleted
+    :param experiment_id:
+    :param virtual_machine_name:
+    :return:
+    """
+    for vm in db_adapter.find_all_objects_by(AzureVirtualMachine,
+                                             experiment_id=experiment_id,
+                                             name=virtual_machine_name):
+        if vm.virtual_environment is not None:
+            vm.virtual_environment.status = VEStatus.Deleted
+        db_adapter.delete_all_objects_by(AzureEndpoint, virtual_machine_id=vm.id)
+        db_adapter.delete_object(vm)
+    db_adapter.delete_all_objects_by(AzureVirtualMachinePlacement,
+                                     experiment_id=experiment_id,
+                                     virtual_machine_name=virtual_machine_name)
+    db_adapter.delete_all_objects_by(AzureProvisionJournal,
+                                     experiment_id=experiment_id,
+                                     virtual_machine_name=virtual_machine_name)
+    db_adapter.commit()
+
+
 def get_azure_virtual_machine_status(cloud_service_name, deployment_name, virtual_machine_name):
     cs = db_adapter.find_first_object_by(AzureCloudService, name=cloud_service_name)
     dm = db_adapter.find_first_object_by(AzureDeployment, name=deployment_name, cloud_service=cs)
@@ -344,6 +665,28 @@ def load_template_from_experiment(experiment_id):
     return load_template(t.url)
 
 
+def get_subscription_suffix(hackathon_id, azure_key_id):
+    """
+    Return name suffix of storage account and cloud service on given azure subscription, which is needed
+    if it is not the first azure subscription of hackathon, None if no suffix needed
+    :param hackathon_id:
+    :param azure_key_id:
+    :return:
+    """
+    if azure_key_id is None or hackathon_id is None:
+        return None
+    azure_key_ids = sorted(ha.azure_key_id for ha in
+                           db_adapter.find_all_objects_by(HackathonAzureKey, hackathon_id=hackathon_id))
+    if not azure_key_ids or azure_key_id == azure_key_ids[0]:
+        return None
+    return str(azure_key_id)
+
+
+def get_experiment_subscription_suffix(experiment_id):
+    e = db_adapter.get_object(Experiment, experiment_id)
+    return get_subscription_suffix(e.hackathon_id, e.azure_key_id)
+
+
 def set_template_virtual_environment_count(experiment_id, count):
     e = db_adapter.get_object(Experiment, experiment_id)
     t = db_adapter.get_object(Template, e.template_id)
@@ -352,9 +695,148 @@ def set_template_virtual_environment_count(experiment_id, count):
 
 
 # --------------------------------------------- scheduler ---------------------------------------------#
-def run_job(mdl_cls_func, cls_args, func_args, second=DEFAULT_TICK):
+def get_job_key(task, cls_args, func_args):
+    """
+    Return a stable job id, identical for jobs calling same function with same arguments
+    :return:
+    """
+    digest = hashlib.md5(repr((task, cls_args, func_args))).hexdigest()
+    return '%s-%s' % (task.func_name, digest)
+
+
+def get_job_experiment_id(task, func_args):
+    """
+    Return id of experiment which a cancellable job works for, else None
+    A status poll works for experiment of its continuation, except async operation polls, which release
+    in-flight slots of rate limiter once completed
+    :return:
+    """
+    if task in CANCELLABLE_TASKS:
+        return func_args[0]
+    if task in POLL_TASKS and task != TASKS['Service.query_async_operation_status']:
+        return get_continuation_experiment_id(func_args)
+    return None
+
+
+def get_continuation_experiment_id(func_args):
+    """
+    Return id of experiment which the cancellable continuation in arguments of a poll job works for, else None
+    """
+    for i, arg in enumerate(func_args):
+        if arg in CANCELLABLE_TASKS:
+            return func_args[i + 2][0]
+    return None
+
+
+def get_pending_experiment_ids():
+    """
+    Return ids of experiments which have pending jobs in scheduler, including async operation polls
+    """
+    experiment_ids = set()
+    for job in scheduler.get_jobs():
+        if job.func is not call_job:
+            continue
+        task, cls_args, func_args = job.args
+        experiment_id = get_job_experiment_id(task, func_args)
+        if experiment_id is None and task == TASKS['Service.query_async_operation_status']:
+            experiment_id = get_continuation_experiment_id(func_args)
+        if experiment_id is not None:
+            experiment_ids.add(experiment_id)
+    return experiment_ids
+
+
+def is_async_operation_pending(experiment_id):
+    """
+    Whether an azure async operation started by a step of experiment is still polled, e.g. creation of a role which
+    holds lock of its deployment
+    Async operation polls are kept in scheduler when experiment is cancelled or rolled back, until azure completes
+    """
+    for job in scheduler.get_jobs():
+        if job.func is call_job and job.args[0] == TASKS['Service.query_async_operation_status'] and \
+                get_continuation_experiment_id(job.args[2]) == experiment_id:
+            return True
+    return False
+
+
+def is_job_cancelled(task, func_args):
+    experiment_id = get_job_experiment_id(task, func_args)
+    if experiment_id is None:
+        return False
+    if db_adapter.count(Experiment, Experiment.id == experiment_id, Experiment.status.in_(ABORTED_STATUS)) == 0:
+        return False
+    metrics.incr(JOB_CANCELLED)
+    log.debug('job %s of cancelled or rolled back experiment [%d] skipped' % (task.name, experiment_id))
+    return True
+
+
+def call_job(task, cls_args, func_args):
+    """
+    Call given function unless experiment it works for is cancelled after it was scheduled
+    """
+    if is_job_cancelled(task, func_args):
+        return
+    TASKS.dispatch(task, cls_args, func_args)
+
+
+def call_task(task, cls_args, func_args):
+    TASKS.dispatch(task, cls_args, func_args)
+
+
+def remove_experiment_jobs(experiment_id):
+    """
+    Remove pending cancellable jobs of experiment from scheduler
+    :return: count of jobs removed
+    """
+    count = 0
+    for job in scheduler.get_jobs():
+        if job.func is call_job and get_job_experiment_id(job.args[0], job.args[2]) == experiment_id:
+            try:
+                job.remove()
+                count += 1
+            except JobLookupError:
+                # executed in the meantime
+                pass
+    metrics.incr(JOB_CANCELLED, count)
+    return count
+
+
+def run_job(task, cls_args, func_args, second=DEFAULT_TICK, job_id=None):
+    """
+    Schedule given function to run after given seconds
+    Job of given id replaces pending job of same id, e.g. restored from persistent job store
+    Poll jobs always get a stable id, so that duplicates pending since before an overload are matched too:
+    a duplicate pending poll job is kept as is when scheduler is overloaded, and rescheduled otherwise
+    Jobs of cancelled experiment are dropped, here and again when they are due
+    """
+    if is_job_cancelled(task, func_args):
+        return
     exec_time = datetime.now() + timedelta(seconds=second)
-    scheduler.add_job(call, 'date', run_date=exec_time, args=[mdl_cls_func, cls_args, func_args])
+    replace_existing = job_id is not None
+    if task in POLL_TASKS:
+        job_id = get_job_key(task, cls_args, func_args)
+        if is_overloaded():
+            if scheduler.get_job(job_id) is not None:
+                metrics.incr(JOB_COALESCED)
+                log.debug('run job: coalesced duplicate job [%s]' % job_id)
+                return
+        else:
+            replace_existing = True
+    try:
+        scheduler.add_job(call_job, 'date', run_date=exec_time, args=[task, cls_args, func_args], id=job_id,
+                          replace_existing=replace_existing, executor=task.executor)
+    except ConflictingIdError:
+        # same job added by another thread in the meantime
+        metrics.incr(JOB_COALESCED)
+        log.debug('run job: coalesced duplicate job [%s]' % job_id)
+
+
+def run_interval_job(task, cls_args, func_args, second, job_id):
+    """
+    Schedule given function to run every given seconds
+    Job of same id, e.g. restored from persistent job store, is replaced, and missed runs are coalesced into one
+    """
+    scheduler.add_job(call_task, 'interval', seconds=second, args=[task, cls_args, func_args], id=job_id,
+                      replace_existing=True, coalesce=True, max_instances=1, executor=task.executor)
 
 
 # --------------------------------------------- experiment ---------------------------------------------#
@@ -364,12 +846,55 @@ def update_experiment_status(experiment_id, status):
     db_adapter.commit()
 
 
+def update_experiment_heart_beat(experiment_id):
+    e = db_adapter.get_object(Experiment, experiment_id)
+    e.last_heart_beat_time = datetime.utcnow()
+    db_adapter.commit()
+
+
+def update_experiment_azure_key(experiment_id, azure_key_id):
+    e = db_adapter.get_object(Experiment, experiment_id)
+    e.azure_key_id = azure_key_id
+    db_adapter.commit()
+
+
 def check_experiment_done(experiment_id, need_status):
     e = db_adapter.get_object(Experiment, experiment_id)
+    if e.status in ABORTED_STATUS:
+        return
     need_ve_status = VEStatus.Running
     if need_status == EStatus.Stopped:
         need_ve_status = VEStatus.Stopped
     if db_adapter.count_by(VirtualEnvironment,
                            experiment_id=experiment_id,
                            status=need_ve_status) == e.template.virtual_environment_count:
-        update_experiment_status(experiment_id, need_status)
\ No newline at end of file
+        update_experiment_status(experiment_id, need_status)
+
+
+def check_experiment_deleted(experiment_id):
+    """
+    Finish deletion of experiment once every virtual machine deletion has ended or failed
+    Experiment rolled back is marked Rollbacked instead of Deleted, and Failed if virtual machines remain
+    :param experiment_id:
+    :return:
+    """
+    started = db_adapter.count_by(AzureLog,
+                                  experiment_id=experiment_id,
+                                  operation=ALOperation.DELETE_VIRTUAL_MACHINE,
+                                  status=ALStatus.START)
+    finished = db_adapter.count(AzureLog,
+                                AzureLog.experiment_id == experiment_id,
+                                AzureLog.operation == ALOperation.DELETE_VIRTUAL_MACHINE,
+                                AzureLog.status.in_([ALStatus.END, ALStatus.FAIL]))
+    if finished < started:
+        return
+    e = db_adapter.get_object(Experiment, experiment_id)
+    if e.status == EStatus.Cancelled:
+        # cancelled experiment stays cancelled, so that continuations still in flight remain no-op
+        return
+    if db_adapter.count_by(AzureVirtualMachine, experiment_id=experiment_id) != 0:
+        update_experiment_status(experiment_id, EStatus.Failed)
+    elif e.status == EStatus.Rollbacking:
+        update_experiment_status(experiment_id, EStatus.Rollbacked)
+    else:
+        update_experiment_status(experiment_id, EStatus.Deleted)
\ No newline at end of file
@@ -7,20 +7,27 @@ from src.azureformation.azureoperation.utility import (
     AZURE_FORMATION,
     DEPLOYMENT_TICK,
     VIRTUAL_MACHINE_TICK,
-    MDL_CLS_FUNC,
+    TASKS,
     commit_azure_log,
     commit_azure_deployment,
+    commit_provision_journal,
     commit_azure_virtual_machine,
     commit_azure_endpoint,
     commit_virtual_environment,
     contain_azure_deployment,
     contain_azure_virtual_machine,
     delete_azure_deployment,
+    delete_azure_deployment_by_name,
+    delete_azure_virtual_hard_disk,
     delete_azure_virtual_machine,
+    delete_experiment_virtual_machine,
+    get_azure_virtual_hard_disk,
     get_azure_virtual_machine_status,
+    get_virtual_machine_name,
     update_azure_virtual_machine_status,
     update_azure_virtual_machine_public_ip,
     update_azure_virtual_machine_private_ip,
+    update_azure_virtual_hard_disk_media_link,
     update_virtual_environment_status,
     update_virtual_environment_remote_paras,
     run_job,
@@ -32,6 +39,7 @@ from src.azureformation.enum import (
     ALStatus,
     ADStatus,
     AVMStatus,
+    PJStep,
     VEProvider,
     VERemoteProvider,
     VEStatus,
@@ -43,10 +51,11 @@ import json
 
 
 # todo take care of resource check
-# todo support batch operations
 class VirtualMachine(ResourceBase):
     """
     Virtual machine is azure virtual machine with its azure deployment
+    Batch stop and start handle all virtual machines of an experiment in one deployment with one async operation
+    Delete runs one async operation at a time per deployment, while deployments are deleted in parallel
     """
     CREATE_DEPLOYMENT_ERROR = [
         '%s [%s] %s',
@@ -88,6 +97,16 @@ class VirtualMachine(ResourceBase):
         '%s [%s] started by %s before',
         '%s [%s] started but not by %s before',
     ]
+    DELETE_VIRTUAL_MACHINE_ERROR = [
+        '%s [%s] %s',
+        '%s [%s] wait for async fail',
+    ]
+    DELETE_VIRTUAL_MACHINE_INFO = [
+        '%s [%s] deleted',
+        '%s [%s] not exist',
+        '%s [%s] deleted with %s [%s]',
+    ]
+    DELETE_DISK_ATTEMPTS = 5
     SIZE_CORE_MAP = {
         'a0': 1,
         'basic_a0': 1,
@@ -131,7 +150,6 @@ class VirtualMachine(ResourceBase):
         'standard_g4': 16,
         'standard_g5': 32,
     }
-    VIRTUAL_MACHINE_NAME_BASE = '%s-%d'
 
     def __init__(self, azure_key_id):
         super(VirtualMachine, self).__init__(azure_key_id)
@@ -150,8 +168,7 @@ class VirtualMachine(ResourceBase):
         commit_azure_log(experiment_id, ALOperation.CREATE_VIRTUAL_MACHINE, ALStatus.START)
         deployment_slot = template_unit.get_deployment_slot()
         # avoid virtual machine name conflict on same name in template
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         virtual_machine_size = template_unit.get_virtual_machine_size()
         if self.subscription.get_available_core_count() < self.SIZE_CORE_MAP[virtual_machine_size.lower()]:
             m = self.CREATE_DEPLOYMENT_ERROR[1] % (DEPLOYMENT, deployment_slot)
@@ -165,6 +182,10 @@ class VirtualMachine(ResourceBase):
         vm_image_name = template_unit.get_vm_image_name()
         system_config = template_unit.get_system_config()
         os_virtual_hard_disk = template_unit.get_os_virtual_hard_disk()
+        if os_virtual_hard_disk is not None:
+            update_azure_virtual_hard_disk_media_link(cloud_service_name,
+                                                      virtual_machine_name,
+                                                      os_virtual_hard_disk.media_link)
         # avoid duplicate deployment in azure subscription
         if self.service.deployment_exists(cloud_service_name, deployment_slot):
             # use deployment name from azure subscription
@@ -185,6 +206,7 @@ class VirtualMachine(ResourceBase):
             if self.service.virtual_machine_exists(cloud_service_name, deployment_name, virtual_machine_name):
                 if contain_azure_virtual_machine(cloud_service_name, deployment_name, virtual_machine_name):
                     m = self.CREATE_VIRTUAL_MACHINE_INFO[1] % (VIRTUAL_MACHINE, virtual_machine_name, AZURE_FORMATION)
+                    commit_provision_journal(experiment_id, template_unit, PJStep.VIRTUAL_MACHINE_READY)
                     commit_azure_log(experiment_id, ALOperation.CREATE_VIRTUAL_MACHINE, ALStatus.END, m, 1)
                     log.debug(m)
                 else:
@@ -206,16 +228,24 @@ class VirtualMachine(ResourceBase):
                                                               virtual_machine_size,
                                                               vm_image_name)
                 except Exception as e:
+                    # retry transient error on scheduler instead of failing experiment
+                    if self.retry_engine.retry(experiment_id, ALOperation.CREATE_VIRTUAL_MACHINE, VIRTUAL_MACHINE,
+                                               virtual_machine_name, e,
+                                               TASKS['VirtualMachine.create_virtual_machine'],
+                                               (self.azure_key_id, ), (experiment_id, template_unit)):
+                        return True
                     m = self.CREATE_VIRTUAL_MACHINE_ERROR[0] % (VIRTUAL_MACHINE, virtual_machine_name, e.message)
                     commit_azure_log(experiment_id, ALOperation.CREATE_VIRTUAL_MACHINE, ALStatus.FAIL, m, 0)
                     log.error(e)
                     return False
                 # query async operation status
-                run_job(MDL_CLS_FUNC[2],
+                run_job(TASKS['Service.query_async_operation_status'],
                         (self.azure_key_id, ),
                         (result.request_id,
-                         MDL_CLS_FUNC[6], (self.azure_key_id, ), (experiment_id, template_unit),
-                         MDL_CLS_FUNC[7], (self.azure_key_id, ), (experiment_id, template_unit)))
+                         TASKS['VirtualMachine.create_virtual_machine_async_true_1'],
+                         (self.azure_key_id, ), (experiment_id, template_unit),
+                         TASKS['VirtualMachine.create_virtual_machine_async_false_1'],
+                         (self.azure_key_id, ), (experiment_id, template_unit)))
         else:
             # delete old azure deployment, cascade delete old azure virtual machine and azure endpoint
             delete_azure_deployment(cloud_service_name, deployment_slot)
@@ -235,6 +265,12 @@ class VirtualMachine(ResourceBase):
                                                                         virtual_machine_size,
                                                                         vm_image_name)
             except Exception as e:
+                # retry transient error on scheduler instead of failing experiment
+                if self.retry_engine.retry(experiment_id, ALOperation.CREATE_VIRTUAL_MACHINE, VIRTUAL_MACHINE,
+                                           virtual_machine_name, e,
+                                           TASKS['VirtualMachine.create_virtual_machine'],
+                                           (self.azure_key_id, ), (experiment_id, template_unit)):
+                    return True
                 m = self.CREATE_DEPLOYMENT_ERROR[0] % (DEPLOYMENT, deployment_slot, e.message)
                 commit_azure_log(experiment_id, ALOperation.CREATE_DEPLOYMENT, ALStatus.FAIL, m, 0)
                 m = self.CREATE_VIRTUAL_MACHINE_ERROR[0] % (VIRTUAL_MACHINE, virtual_machine_name, e.message)
@@ -242,29 +278,31 @@ class VirtualMachine(ResourceBase):
                 log.error(e)
                 return False
             # query async operation status
-            run_job(MDL_CLS_FUNC[2],
+            run_job(TASKS['Service.query_async_operation_status'],
                     (self.azure_key_id, ),
                     (result.request_id,
-                     MDL_CLS_FUNC[13], (self.azure_key_id, ), (experiment_id, template_unit),
-                     MDL_CLS_FUNC[14], (self.azure_key_id, ), (experiment_id, template_unit)))
+                     TASKS['VirtualMachine.create_virtual_machine_async_true_3'],
+                     (self.azure_key_id, ), (experiment_id, template_unit),
+                     TASKS['VirtualMachine.create_virtual_machine_async_false_3'],
+                     (self.azure_key_id, ), (experiment_id, template_unit)))
         return True
 
     def create_virtual_machine_async_true_1(self, experiment_id, template_unit):
+        commit_provision_journal(experiment_id, template_unit, PJStep.ROLE_ADDED)
         cloud_service_name = template_unit.get_cloud_service_name()
         deployment_slot = template_unit.get_deployment_slot()
         deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         # query virtual machine status
-        run_job(MDL_CLS_FUNC[8],
+        run_job(TASKS['Service.query_virtual_machine_status'],
                 (self.azure_key_id, ),
                 (cloud_service_name, deployment_name, virtual_machine_name, AVMStatus.READY_ROLE,
-                 MDL_CLS_FUNC[9], (self.azure_key_id, ), (experiment_id, template_unit)),
+                 TASKS['VirtualMachine.create_virtual_machine_vm_true_1'],
+                 (self.azure_key_id, ), (experiment_id, template_unit)),
                 VIRTUAL_MACHINE_TICK)
 
     def create_virtual_machine_async_false_1(self, experiment_id, template_unit):
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         m = self.CREATE_VIRTUAL_MACHINE_ERROR[2] % (VIRTUAL_MACHINE, virtual_machine_name)
         commit_azure_log(experiment_id, ALOperation.CREATE_VIRTUAL_MACHINE, ALStatus.FAIL, m, 2)
         log.error(m)
@@ -274,38 +312,39 @@ class VirtualMachine(ResourceBase):
             cloud_service_name = template_unit.get_cloud_service_name()
             deployment_slot = template_unit.get_deployment_slot()
             deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
-            virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                     experiment_id)
+            virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
             network_config = template_unit.get_network_config(self.service, True)
             result = self.service.update_virtual_machine_network_config(cloud_service_name,
                                                                         deployment_name,
                                                                         virtual_machine_name,
                                                                         network_config)
             # query async operation status
-            run_job(MDL_CLS_FUNC[2],
+            run_job(TASKS['Service.query_async_operation_status'],
                     (self.azure_key_id, ),
                     (result.request_id,
-                     MDL_CLS_FUNC[10], (self.azure_key_id, ), (experiment_id, template_unit),
-                     MDL_CLS_FUNC[11], (self.azure_key_id, ), (experiment_id, template_unit)))
+                     TASKS['VirtualMachine.create_virtual_machine_async_true_2'],
+                     (self.azure_key_id, ), (experiment_id, template_unit),
+                     TASKS['VirtualMachine.create_virtual_machine_async_false_2'],
+                     (self.azure_key_id, ), (experiment_id, template_unit)))
         else:
             self.__create_virtual_machine_helper(experiment_id, template_unit)
 
     def create_virtual_machine_async_true_2(self, experiment_id, template_unit):
+        commit_provision_journal(experiment_id, template_unit, PJStep.NETWORK_UPDATED)
         cloud_service_name = template_unit.get_cloud_service_name()
         deployment_slot = template_unit.get_deployment_slot()
         deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         # query virtual machine status
-        run_job(MDL_CLS_FUNC[8],
+        run_job(TASKS['Service.query_virtual_machine_status'],
                 (self.azure_key_id, ),
                 (cloud_service_name, deployment_name, virtual_machine_name, AVMStatus.READY_ROLE,
-                 MDL_CLS_FUNC[12], (self.azure_key_id, ), (experiment_id, template_unit)),
+                 TASKS['VirtualMachine.create_virtual_machine_vm_true_2'],
+                 (self.azure_key_id, ), (experiment_id, template_unit)),
                 VIRTUAL_MACHINE_TICK)
 
     def create_virtual_machine_async_false_2(self, experiment_id, template_unit):
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         m = self.CREATE_VIRTUAL_MACHINE_ERROR[3] % (VIRTUAL_MACHINE, virtual_machine_name)
         commit_azure_log(experiment_id, ALOperation.CREATE_VIRTUAL_MACHINE, ALStatus.FAIL, m, 3)
         log.error(m)
@@ -317,16 +356,16 @@ class VirtualMachine(ResourceBase):
         cloud_service_name = template_unit.get_cloud_service_name()
         deployment_name = template_unit.get_deployment_name()
         # query deployment status
-        run_job(MDL_CLS_FUNC[15],
+        run_job(TASKS['Service.query_deployment_status'],
                 (self.azure_key_id, ),
                 (cloud_service_name, deployment_name,
-                 MDL_CLS_FUNC[16], (self.azure_key_id, ), (experiment_id, template_unit)),
+                 TASKS['VirtualMachine.create_virtual_machine_dm_true'],
+                 (self.azure_key_id, ), (experiment_id, template_unit)),
                 DEPLOYMENT_TICK)
 
     def create_virtual_machine_async_false_3(self, experiment_id, template_unit):
         deployment_slot = template_unit.get_deployment_slot()
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         m = self.CREATE_DEPLOYMENT_ERROR[2] % (DEPLOYMENT, deployment_slot)
         commit_azure_log(experiment_id, ALOperation.CREATE_DEPLOYMENT, ALStatus.FAIL, m, 2)
         log.error(m)
@@ -338,8 +377,7 @@ class VirtualMachine(ResourceBase):
         cloud_service_name = template_unit.get_cloud_service_name()
         deployment_slot = template_unit.get_deployment_slot()
         deployment_name = template_unit.get_deployment_name()
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         m = self.CREATE_DEPLOYMENT_INFO[0] % (DEPLOYMENT, deployment_slot)
         commit_azure_deployment(deployment_name,
                                 deployment_slot,
@@ -348,11 +386,13 @@ class VirtualMachine(ResourceBase):
                                 experiment_id)
         commit_azure_log(experiment_id, ALOperation.CREATE_DEPLOYMENT, ALStatus.END, m, 0)
         log.debug(m)
+        commit_provision_journal(experiment_id, template_unit, PJStep.DEPLOYMENT_READY)
         # query virtual machine status
-        run_job(MDL_CLS_FUNC[8],
+        run_job(TASKS['Service.query_virtual_machine_status'],
                 (self.azure_key_id, ),
                 (cloud_service_name, deployment_name, virtual_machine_name, AVMStatus.READY_ROLE,
-                 MDL_CLS_FUNC[9], (self.azure_key_id, ), (experiment_id, template_unit)),
+                 TASKS['VirtualMachine.create_virtual_machine_vm_true_1'],
+                 (self.azure_key_id, ), (experiment_id, template_unit)),
                 VIRTUAL_MACHINE_TICK)
 
     def stop_virtual_machine(self, experiment_id, template_unit, action):
@@ -371,8 +411,7 @@ class VirtualMachine(ResourceBase):
         deployment_slot = template_unit.get_deployment_slot()
         deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
         deployment = self.service.get_deployment_by_name(cloud_service_name, deployment_name)
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         now_status = self.service.get_virtual_machine_instance_status(deployment, virtual_machine_name)
         if need_status == AVMStatus.STOPPED_VM and now_status == AVMStatus.STOPPED_DEALLOCATED:
             m = self.STOP_VIRTUAL_MACHINE_ERROR[1] % (VIRTUAL_MACHINE,
@@ -410,29 +449,30 @@ class VirtualMachine(ResourceBase):
                 log.error(e)
                 return False
             # query async operation status
-            run_job(MDL_CLS_FUNC[2],
+            run_job(TASKS['Service.query_async_operation_status'],
                     (self.azure_key_id, ),
                     (result.request_id,
-                     MDL_CLS_FUNC[18], (self.azure_key_id, ), (experiment_id, template_unit, need_status),
-                     MDL_CLS_FUNC[19], (self.azure_key_id, ), (experiment_id, template_unit, need_status)))
+                     TASKS['VirtualMachine.stop_virtual_machine_async_true'],
+                     (self.azure_key_id, ), (experiment_id, template_unit, need_status),
+                     TASKS['VirtualMachine.stop_virtual_machine_async_false'],
+                     (self.azure_key_id, ), (experiment_id, template_unit, need_status)))
         return True
 
     def stop_virtual_machine_async_true(self, experiment_id, template_unit, need_status):
         cloud_service_name = template_unit.get_cloud_service_name()
         deployment_slot = template_unit.get_deployment_slot()
         deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         # query virtual machine status
-        run_job(MDL_CLS_FUNC[8],
+        run_job(TASKS['Service.query_virtual_machine_status'],
                 (self.azure_key_id, ),
                 (cloud_service_name, deployment_name, virtual_machine_name, need_status,
-                 MDL_CLS_FUNC[20], (self.azure_key_id, ), (experiment_id, template_unit, need_status)),
+                 TASKS['VirtualMachine.stop_virtual_machine_vm_true'],
+                 (self.azure_key_id, ), (experiment_id, template_unit, need_status)),
                 VIRTUAL_MACHINE_TICK)
 
     def stop_virtual_machine_async_false(self, experiment_id, template_unit, need_status):
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         m = self.STOP_VIRTUAL_MACHINE_ERROR[2] % (VIRTUAL_MACHINE, virtual_machine_name, need_status)
         commit_azure_log(experiment_id, ALOperation.STOP_VIRTUAL_MACHINE, ALStatus.FAIL, 2)
         log.error(m)
@@ -441,8 +481,7 @@ class VirtualMachine(ResourceBase):
         cloud_service_name = template_unit.get_cloud_service_name()
         deployment_slot = template_unit.get_deployment_slot()
         deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         self.__stop_virtual_machine_helper(experiment_id, template_unit, need_status)
         m = self.STOP_VIRTUAL_MACHINE_INFO[0] % (VIRTUAL_MACHINE, virtual_machine_name, need_status)
         commit_azure_log(experiment_id, ALOperation.STOP_VIRTUAL_MACHINE, ALStatus.END, m, 0)
@@ -461,8 +500,7 @@ class VirtualMachine(ResourceBase):
         deployment_slot = template_unit.get_deployment_slot()
         deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
         deployment = self.service.get_deployment_by_name(cloud_service_name, deployment_name)
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         status = self.service.get_virtual_machine_instance_status(deployment, virtual_machine_name)
         if status == AVMStatus.READY_ROLE:
             db_status = get_azure_virtual_machine_status(cloud_service_name, deployment_name, virtual_machine_name)
@@ -485,44 +523,328 @@ class VirtualMachine(ResourceBase):
                 log.error(e)
                 return False
             # query async operation status
-            run_job(MDL_CLS_FUNC[2],
+            run_job(TASKS['Service.query_async_operation_status'],
                     (self.azure_key_id, ),
                     (result.request_id,
-                     MDL_CLS_FUNC[22], (self.azure_key_id, ), (experiment_id, template_unit),
-                     MDL_CLS_FUNC[23], (self.azure_key_id, ), (experiment_id, template_unit)))
+                     TASKS['VirtualMachine.start_virtual_machine_async_true'],
+                     (self.azure_key_id, ), (experiment_id, template_unit),
+                     TASKS['VirtualMachine.start_virtual_machine_async_false'],
+                     (self.azure_key_id, ), (experiment_id, template_unit)))
         return True
 
     def start_virtual_machine_async_true(self, experiment_id, template_unit):
         cloud_service_name = template_unit.get_cloud_service_name()
         deployment_slot = template_unit.get_deployment_slot()
         deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         # query virtual machine status
-        run_job(MDL_CLS_FUNC[8],
+        run_job(TASKS['Service.query_virtual_machine_status'],
                 (self.azure_key_id, ),
                 (cloud_service_name, deployment_name, virtual_machine_name, AVMStatus.READY_ROLE,
-                 MDL_CLS_FUNC[24], (self.azure_key_id, ), (experiment_id, template_unit)),
+                 TASKS['VirtualMachine.start_virtual_machine_vm_true'],
+                 (self.azure_key_id, ), (experiment_id, template_unit)),
                 VIRTUAL_MACHINE_TICK)
 
     def start_virtual_machine_async_false(self, experiment_id, template_unit):
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         m = self.START_VIRTUAL_MACHINE_ERROR[1] % (VIRTUAL_MACHINE, virtual_machine_name)
         commit_azure_log(experiment_id, ALOperation.START_VIRTUAL_MACHINE, ALStatus.FAIL, 1)
         log.error(m)
 
     def start_virtual_machine_vm_true(self, experiment_id, template_unit):
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         self.__start_virtual_machine_helper(experiment_id, template_unit)
         m = self.START_VIRTUAL_MACHINE_INFO[0] % (VIRTUAL_MACHINE, virtual_machine_name)
         commit_azure_log(experiment_id, ALOperation.START_VIRTUAL_MACHINE, ALStatus.END, m, 0)
         log.debug(m)
 
-    # todo delete virtual machine
-    def delete_virtual_machine(self):
-        raise NotImplementedError
+    def stop_virtual_machines(self, experiment_id, template_units, action):
+        """
+        Batch version of stop_virtual_machine for template units in same deployment
+        :param experiment_id:
+        :param template_units: template units with same cloud service and deployment slot
+        :param action: AVMStatus.STOPPED or AVMStatus.STOPPED_DEALLOCATED
+        :return:
+        """
+        for template_unit in template_units:
+            commit_azure_log(experiment_id, ALOperation.STOP_VIRTUAL_MACHINE, ALStatus.START)
+        need_status = AVMStatus.STOPPED_VM if action == AVMStatus.STOPPED else AVMStatus.STOPPED_DEALLOCATED
+        cloud_service_name = template_units[0].get_cloud_service_name()
+        deployment_slot = template_units[0].get_deployment_slot()
+        deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
+        deployment = self.service.get_deployment_by_name(cloud_service_name, deployment_name)
+        names = [get_virtual_machine_name(experiment_id, t) for t in template_units]
+        now_status = self.service.get_virtual_machines_instance_status(deployment, names)
+        stop_units = []
+        for template_unit, virtual_machine_name in zip(template_units, names):
+            status = now_status[virtual_machine_name]
+            if need_status == AVMStatus.STOPPED_VM and status == AVMStatus.STOPPED_DEALLOCATED:
+                m = self.STOP_VIRTUAL_MACHINE_ERROR[1] % (VIRTUAL_MACHINE,
+                                                          virtual_machine_name,
+                                                          AVMStatus.STOPPED_VM,
+                                                          AVMStatus.STOPPED_DEALLOCATED)
+                commit_azure_log(experiment_id, ALOperation.STOP_VIRTUAL_MACHINE, ALStatus.FAIL, m, 1)
+                log.error(m)
+            elif need_status == status:
+                db_status = get_azure_virtual_machine_status(cloud_service_name, deployment_name, virtual_machine_name)
+                if db_status == need_status:
+                    m = self.STOP_VIRTUAL_MACHINE_INFO[1] % (VIRTUAL_MACHINE,
+                                                             virtual_machine_name,
+                                                             need_status,
+                                                             AZURE_FORMATION)
+                    commit_azure_log(experiment_id, ALOperation.STOP_VIRTUAL_MACHINE, ALStatus.END, m, 1)
+                else:
+                    m = self.STOP_VIRTUAL_MACHINE_INFO[2] % (VIRTUAL_MACHINE,
+                                                             virtual_machine_name,
+                                                             need_status,
+                                                             AZURE_FORMATION)
+                    self.__stop_virtual_machine_helper(experiment_id, template_unit, need_status)
+                    commit_azure_log(experiment_id, ALOperation.STOP_VIRTUAL_MACHINE, ALStatus.END, m, 2)
+                log.debug(m)
+            else:
+                stop_units.append(template_unit)
+        if not stop_units:
+            return True
+        stop_names = [get_virtual_machine_name(experiment_id, t) for t in stop_units]
+        try:
+            result = self.service.stop_virtual_machines(cloud_service_name, deployment_name, stop_names, action)
+        except Exception as e:
+            for virtual_machine_name in stop_names:
+                m = self.STOP_VIRTUAL_MACHINE_ERROR[0] % (VIRTUAL_MACHINE, virtual_machine_name, e.message)
+                commit_azure_log(experiment_id, ALOperation.STOP_VIRTUAL_MACHINE, ALStatus.FAIL, m, 0)
+            log.error(e)
+            return False
+        # query async operation status
+        run_job(TASKS['Service.query_async_operation_status'],
+                (self.azure_key_id, ),
+                (result.request_id,
+                 TASKS['VirtualMachine.stop_virtual_machines_async_true'],
+                 (self.azure_key_id, ), (experiment_id, stop_units, need_status),
+                 TASKS['VirtualMachine.stop_virtual_machines_async_false'],
+                 (self.azure_key_id, ), (experiment_id, stop_units, need_status)))
+        return True
+
+    def stop_virtual_machines_async_true(self, experiment_id, template_units, need_status):
+        cloud_service_name = template_units[0].get_cloud_service_name()
+        deployment_slot = template_units[0].get_deployment_slot()
+        deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
+        names = [get_virtual_machine_name(experiment_id, t) for t in template_units]
+        # query status of all virtual machines by one deployment
+        run_job(TASKS['Service.query_virtual_machines_status'],
+                (self.azure_key_id, ),
+                (cloud_service_name, deployment_name, names, need_status,
+                 TASKS['VirtualMachine.stop_virtual_machines_vm_true'],
+                 (self.azure_key_id, ), (experiment_id, template_units, need_status)),
+                VIRTUAL_MACHINE_TICK)
+
+    def stop_virtual_machines_async_false(self, experiment_id, template_units, need_status):
+        for template_unit in template_units:
+            self.stop_virtual_machine_async_false(experiment_id, template_unit, need_status)
+
+    def stop_virtual_machines_vm_true(self, experiment_id, template_units, need_status):
+        for template_unit in template_units:
+            self.stop_virtual_machine_vm_true(experiment_id, template_unit, need_status)
+
+    def start_virtual_machines(self, experiment_id, template_units):
+        """
+        Batch version of start_virtual_machine for template units in same deployment
+        :param experiment_id:
+        :param template_units: template units with same cloud service and deployment slot
+        :return:
+        """
+        for template_unit in template_units:
+            commit_azure_log(experiment_id, ALOperation.START_VIRTUAL_MACHINE, ALStatus.START)
+        cloud_service_name = template_units[0].get_cloud_service_name()
+        deployment_slot = template_units[0].get_deployment_slot()
+        deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
+        deployment = self.service.get_deployment_by_name(cloud_service_name, deployment_name)
+        names = [get_virtual_machine_name(experiment_id, t) for t in template_units]
+        now_status = self.service.get_virtual_machines_instance_status(deployment, names)
+        start_units = []
+        for template_unit, virtual_machine_name in zip(template_units, names):
+            if now_status[virtual_machine_name] == AVMStatus.READY_ROLE:
+                db_status = get_azure_virtual_machine_status(cloud_service_name, deployment_name, virtual_machine_name)
+                if db_status == AVMStatus.READY_ROLE:
+                    m = self.START_VIRTUAL_MACHINE_INFO[1] % (VIRTUAL_MACHINE, virtual_machine_name, AZURE_FORMATION)
+                    commit_azure_log(experiment_id, ALOperation.START_VIRTUAL_MACHINE, ALStatus.END, m, 1)
+                else:
+                    m = self.START_VIRTUAL_MACHINE_INFO[2] % (VIRTUAL_MACHINE, virtual_machine_name, AZURE_FORMATION)
+                    self.__start_virtual_machine_helper(experiment_id, template_unit)
+                    commit_azure_log(experiment_id, ALOperation.START_VIRTUAL_MACHINE, ALStatus.END, m, 2)
+                log.debug(m)
+            else:
+                start_units.append(template_unit)
+        if not start_units:
+            return True
+        start_names = [get_virtual_machine_name(experiment_id, t) for t in start_units]
+        try:
+            result = self.service.start_virtual_machines(cloud_service_name, deployment_name, start_names)
+        except Exception as e:
+            for virtual_machine_name in start_names:
+                m = self.START_VIRTUAL_MACHINE_ERROR[0] % (VIRTUAL_MACHINE, virtual_machine_name, e.message)
+                commit_azure_log(experiment_id, ALOperation.START_VIRTUAL_MACHINE, ALStatus.FAIL, m, 0)
+            log.error(e)
+            return False
+        # query async operation status
+        run_job(TASKS['Service.query_async_operation_status'],
+                (self.azure_key_id, ),
+                (result.request_id,
+                 TASKS['VirtualMachine.start_virtual_machines_async_true'],
+                 (self.azure_key_id, ), (experiment_id, start_units),
+                 TASKS['VirtualMachine.start_virtual_machines_async_false'],
+                 (self.azure_key_id, ), (experiment_id, start_units)))
+        return True
+
+    def start_virtual_machines_async_true(self, experiment_id, template_units):
+        cloud_service_name = template_units[0].get_cloud_service_name()
+        deployment_slot = template_units[0].get_deployment_slot()
+        deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
+        names = [get_virtual_machine_name(experiment_id, t) for t in template_units]
+        # query status of all virtual machines by one deployment
+        run_job(TASKS['Service.query_virtual_machines_status'],
+                (self.azure_key_id, ),
+                (cloud_service_name, deployment_name, names, AVMStatus.READY_ROLE,
+                 TASKS['VirtualMachine.start_virtual_machines_vm_true'],
+                 (self.azure_key_id, ), (experiment_id, template_units)),
+                VIRTUAL_MACHINE_TICK)
+
+    def start_virtual_machines_async_false(self, experiment_id, template_units):
+        for template_unit in template_units:
+            self.start_virtual_machine_async_false(experiment_id, template_unit)
+
+    def start_virtual_machines_vm_true(self, experiment_id, template_units):
+        for template_unit in template_units:
+            self.start_virtual_machine_vm_true(experiment_id, template_unit)
+
+    def delete_virtual_machines(self, experiment_id, template_units, virtual_machine_names=None):
+        """
+        Delete virtual machines of template units in same deployment, then their storage accounts and cloud service
+        if nothing else uses them
+        The whole deployment is deleted with its disks in one async operation if it holds no other virtual machine,
+        else virtual machines are deleted one by one, each followed by deleting its os disk
+        Start of deletion is logged by caller once for each template unit
+        :param experiment_id:
+        :param template_units: template units with same cloud service and deployment slot
+        :param virtual_machine_names: names of virtual machines of template units, resolved on first call
+        :return:
+        """
+        if virtual_machine_names is None:
+            virtual_machine_names = [get_virtual_machine_name(experiment_id, t) for t in template_units]
+        cloud_service_name = template_units[0].get_cloud_service_name()
+        deployment_slot = template_units[0].get_deployment_slot()
+        if not self.service.deployment_exists(cloud_service_name, deployment_slot):
+            for virtual_machine_name in virtual_machine_names:
+                self.__delete_virtual_machine_helper(experiment_id, virtual_machine_name, 1)
+            self.__delete_dependencies(experiment_id, template_units, [])
+            return True
+        deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
+        deployment = self.service.get_deployment_by_name(cloud_service_name, deployment_name)
+        roles = dict((role.role_name, role) for role in deployment.role_list.roles)
+        units = []
+        names = []
+        for template_unit, virtual_machine_name in zip(template_units, virtual_machine_names):
+            if virtual_machine_name in roles:
+                units.append(template_unit)
+                names.append(virtual_machine_name)
+            else:
+                self.__delete_virtual_machine_helper(experiment_id, virtual_machine_name, 1)
+        if not units:
+            self.__delete_dependencies(experiment_id, template_units, [])
+            return True
+        if set(roles.keys()) <= set(names):
+            # no other virtual machine in deployment, delete deployment with disks
+            commit_azure_log(experiment_id, ALOperation.DELETE_DEPLOYMENT, ALStatus.START)
+            disk_name = None
+            try:
+                result = self.service.delete_deployment(cloud_service_name, deployment_name)
+            except Exception as e:
+                m = self.DELETE_VIRTUAL_MACHINE_ERROR[0] % (DEPLOYMENT, deployment_name, e.message)
+                commit_azure_log(experiment_id, ALOperation.DELETE_DEPLOYMENT, ALStatus.FAIL, m, 0)
+                self.__delete_virtual_machines_fail(experiment_id, names, e)
+                return False
+        else:
+            disk_name = roles[names[0]].os_virtual_hard_disk.disk_name
+            try:
+                result = self.service.delete_virtual_machine(cloud_service_name, deployment_name, names[0])
+            except Exception as e:
+                self.__delete_virtual_machines_fail(experiment_id, names, e)
+                return False
+        # query async operation status
+        run_job(TASKS['Service.query_async_operation_status'],
+                (self.azure_key_id, ),
+                (result.request_id,
+                 TASKS['VirtualMachine.delete_virtual_machines_async_true'], (self.azure_key_id, ),
+                 (experiment_id, template_units, units, names, deployment_name, disk_name),
+                 TASKS['VirtualMachine.delete_virtual_machines_async_false'],
+                 (self.azure_key_id, ), (experiment_id, names, deployment_name, disk_name)))
+        return True
+
+    def delete_virtual_machines_async_true(self, experiment_id, template_units, units, virtual_machine_names,
+                                           deployment_name, disk_name):
+        cloud_service_name = template_units[0].get_cloud_service_name()
+        if disk_name is None:
+            # deployment deleted with disks and their blobs
+            m = self.DELETE_VIRTUAL_MACHINE_INFO[0] % (DEPLOYMENT, deployment_name)
+            commit_azure_log(experiment_id, ALOperation.DELETE_DEPLOYMENT, ALStatus.END, m, 0)
+            storage_account_names = []
+            for virtual_machine_name in virtual_machine_names:
+                disk = get_azure_virtual_hard_disk(cloud_service_name, virtual_machine_name)
+                if disk is not None:
+                    storage_account_names.append(disk.storage_account_name)
+                    delete_azure_virtual_hard_disk(cloud_service_name, virtual_machine_name)
+                self.__delete_virtual_machine_helper(experiment_id, virtual_machine_name, 2, deployment_name)
+            delete_azure_deployment_by_name(cloud_service_name, deployment_name)
+            self.__delete_dependencies(experiment_id, template_units, storage_account_names)
+            return
+        # os disk is detached from deleted role, its blob is deleted with it
+        run_job(TASKS['VirtualMachine.delete_virtual_machine_disk'],
+                (self.azure_key_id, ),
+                (experiment_id, cloud_service_name, virtual_machine_names[0], disk_name, 0))
+        self.__delete_virtual_machine_helper(experiment_id, virtual_machine_names[0], 0)
+        if len(units) > 1:
+            # delete next virtual machine, azure allows one operation on a deployment at a time
+            run_job(TASKS['VirtualMachine.delete_virtual_machines'],
+                    (self.azure_key_id, ),
+                    (experiment_id, units[1:], virtual_machine_names[1:]))
+        else:
+            self.__delete_dependencies(experiment_id, template_units, [])
+
+    def delete_virtual_machines_async_false(self, experiment_id, virtual_machine_names, deployment_name, disk_name):
+        if disk_name is None:
+            m = self.DELETE_VIRTUAL_MACHINE_ERROR[1] % (DEPLOYMENT, deployment_name)
+            commit_azure_log(experiment_id, ALOperation.DELETE_DEPLOYMENT, ALStatus.FAIL, m, 1)
+        for virtual_machine_name in virtual_machine_names:
+            m = self.DELETE_VIRTUAL_MACHINE_ERROR[1] % (VIRTUAL_MACHINE, virtual_machine_name)
+            commit_azure_log(experiment_id, ALOperation.DELETE_VIRTUAL_MACHINE, ALStatus.FAIL, m, 1)
+            log.error(m)
+
+    def delete_virtual_machine_disk(self, experiment_id, cloud_service_name, virtual_machine_name, disk_name,
+                                    attempt):
+        """
+        Delete os disk of a deleted virtual machine, then its storage account if nothing else uses it
+        Azure may still hold disk shortly after role is deleted, so deletion is retried a few times
+        :return:
+        """
+        try:
+            self.service.delete_disk(disk_name)
+        except Exception as e:
+            if attempt + 1 < self.DELETE_DISK_ATTEMPTS:
+                log.warn('disk [%s] of %s [%s] retry delete: %s' %
+                         (disk_name, VIRTUAL_MACHINE, virtual_machine_name, e.message))
+                run_job(TASKS['VirtualMachine.delete_virtual_machine_disk'],
+                        (self.azure_key_id, ),
+                        (experiment_id, cloud_service_name, virtual_machine_name, disk_name, attempt + 1),
+                        VIRTUAL_MACHINE_TICK)
+            else:
+                # disk is kept in database, so that its storage account is not deleted
+                log.error(e)
+            return False
+        disk = get_azure_virtual_hard_disk(cloud_service_name, virtual_machine_name)
+        delete_azure_virtual_hard_disk(cloud_service_name, virtual_machine_name)
+        if disk is not None:
+            run_job(TASKS['StorageAccount.delete_storage_account'],
+                    (self.azure_key_id, ), (experiment_id, disk.storage_account_name))
+        return True
 
     # --------------------------------------------- helper function ---------------------------------------------#
 
@@ -530,8 +852,7 @@ class VirtualMachine(ResourceBase):
         cloud_service_name = template_unit.get_cloud_service_name()
         deployment_slot = template_unit.get_deployment_slot()
         deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         public_ip = self.service.get_virtual_machine_public_ip(cloud_service_name,
                                                                deployment_name,
                                                                virtual_machine_name)
@@ -574,6 +895,7 @@ class VirtualMachine(ResourceBase):
                                   input_endpoint.port,
                                   input_endpoint.local_port,
                                   virtual_machine)
+        commit_provision_journal(experiment_id, template_unit, PJStep.VIRTUAL_MACHINE_READY)
         m = self.CREATE_VIRTUAL_MACHINE_INFO[0] % (VIRTUAL_MACHINE, virtual_machine_name)
         commit_azure_log(experiment_id, ALOperation.CREATE_VIRTUAL_MACHINE, ALStatus.END, m, 0)
         log.debug(m)
@@ -589,14 +911,45 @@ class VirtualMachine(ResourceBase):
         cloud_service_name = template_unit.get_cloud_service_name()
         deployment_slot = template_unit.get_deployment_slot()
         deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         virtual_machine = update_azure_virtual_machine_status(cloud_service_name,
                                                               deployment_name,
                                                               virtual_machine_name,
                                                               need_status)
         update_virtual_environment_status(virtual_machine, VEStatus.Stopped)
 
+    def __delete_virtual_machine_helper(self, experiment_id, virtual_machine_name, code, deployment_name=None):
+        """
+        Delete database rows of deleted virtual machine and log end of its deletion
+        :param code: index of DELETE_VIRTUAL_MACHINE_INFO
+        """
+        if code == 2:
+            m = self.DELETE_VIRTUAL_MACHINE_INFO[2] % (VIRTUAL_MACHINE,
+                                                       virtual_machine_name,
+                                                       DEPLOYMENT,
+                                                       deployment_name)
+        else:
+            m = self.DELETE_VIRTUAL_MACHINE_INFO[code] % (VIRTUAL_MACHINE, virtual_machine_name)
+        delete_experiment_virtual_machine(experiment_id, virtual_machine_name)
+        commit_azure_log(experiment_id, ALOperation.DELETE_VIRTUAL_MACHINE, ALStatus.END, m, code)
+        log.debug(m)
+
+    def __delete_virtual_machines_fail(self, experiment_id, virtual_machine_names, e):
+        for virtual_machine_name in virtual_machine_names:
+            m = self.DELETE_VIRTUAL_MACHINE_ERROR[0] % (VIRTUAL_MACHINE, virtual_machine_name, e.message)
+            commit_azure_log(experiment_id, ALOperation.DELETE_VIRTUAL_MACHINE, ALStatus.FAIL, m, 0)
+        log.error(e)
+
+    def __delete_dependencies(self, experiment_id, template_units, storage_account_names):
+        """
+        Delete cloud service and storage accounts of template units in parallel, each is kept if still in use
+        """
+        run_job(TASKS['CloudService.delete_cloud_service'],
+                (self.azure_key_id, ), (experiment_id, template_units[0].get_cloud_service_name()))
+        names = set(storage_account_names) | set(t.get_storage_account_name() for t in template_units)
+        for name in sorted(names):
+            run_job(TASKS['StorageAccount.delete_storage_account'], (self.azure_key_id, ), (experiment_id, name))
+
     def __start_virtual_machine_helper(self, experiment_id, template_unit):
         """
         Update status of azure virtual machine and virtual environment
@@ -608,8 +961,7 @@ class VirtualMachine(ResourceBase):
         cloud_service_name = template_unit.get_cloud_service_name()
         deployment_slot = template_unit.get_deployment_slot()
         deployment_name = self.service.get_deployment_name(cloud_service_name, deployment_slot)
-        virtual_machine_name = self.VIRTUAL_MACHINE_NAME_BASE % (template_unit.get_virtual_machine_name(),
-                                                                 experiment_id)
+        virtual_machine_name = get_virtual_machine_name(experiment_id, template_unit)
         virtual_machine = update_azure_virtual_machine_status(cloud_service_name,
                                                               deployment_name,
                                                               virtual_machine_name,
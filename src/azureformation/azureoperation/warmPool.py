@@ -0,0 +1,195 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.utility import (
+    TASKS,
+    commit_azure_log,
+    is_azure_operation_pending,
+    run_job,
+)
+from src.azureformation.database import (
+    db_adapter,
+    db_session,
+)
+from src.azureformation.database.models import (
+    AzureLog,
+    AzureVirtualHardDisk,
+    AzureVirtualMachine,
+    AzureVirtualMachinePlacement,
+    AzureWarmPool,
+    Experiment,
+    VirtualEnvironment,
+)
+from src.azureformation.enum import (
+    ALOperation,
+    ALStatus,
+    AVMStatus,
+    EStatus,
+    VEStatus,
+)
+from src.azureformation.functions import (
+    safe_get_config,
+)
+from src.azureformation.log import (
+    log,
+)
+from src.azureformation.metrics import (
+    metrics,
+)
+
+
+class WarmPool:
+    """
+    Warm pool keeps pre-provisioned virtual environments per template, so that experiment starts in seconds
+    Members of warm pool are experiments without user created by AzureFormation. Once claimed, rows of a member
+    are rebound to the claiming experiment, and warm pool is refilled asynchronously
+    Members are kept ready, or stopped deallocated if status of warm pool is VEStatus.Stopped
+    """
+    TICK = safe_get_config("azure.warm_pool.tick", 30)
+    # rows owned by member which follow its virtual machines to the claiming experiment
+    MEMBER_MODELS = [
+        VirtualEnvironment,
+        AzureVirtualMachine,
+        AzureVirtualMachinePlacement,
+        AzureVirtualHardDisk,
+    ]
+    CLAIM_INFO = 'experiment [%d] claimed member [%d] of warm pool [%d]'
+    CLAIMED = 'azure.warm_pool.claimed'
+    MISSED = 'azure.warm_pool.missed'
+
+    def __init__(self, azure_key_id=None):
+        self.azure_key_id = azure_key_id
+
+    def set_size(self, template_id, hackathon_id, size, status=VEStatus.Running, azure_key_id=None):
+        """
+        Create or resize warm pool of template, and refill it
+        :param template_id:
+        :param hackathon_id:
+        :param size: number of warm experiments to keep
+        :param status: VEStatus.Running or VEStatus.Stopped (deallocated)
+        :param azure_key_id: None if members are placed onto azure subscriptions of hackathon
+        :return: id of warm pool
+        """
+        pool = db_adapter.find_first_object_by(AzureWarmPool, template_id=template_id, hackathon_id=hackathon_id)
+        if pool is None:
+            pool = db_adapter.add_object_kwargs(AzureWarmPool,
+                                                template_id=template_id,
+                                                hackathon_id=hackathon_id,
+                                                azure_key_id=azure_key_id,
+                                                size=size,
+                                                status=status)
+        else:
+            db_adapter.update_object(pool, size=size, status=status, azure_key_id=azure_key_id)
+        db_adapter.commit()
+        run_job(TASKS['WarmPool.refill'], (self.azure_key_id, ), (pool.id, ))
+        return pool.id
+
+    def claim(self, experiment_id):
+        """
+        Hand a warm member of warm pool of experiment's template over to experiment
+        Only members on the requested azure subscription are claimed, if one is requested
+        Return False if there is no warm pool or no warm member
+        :param experiment_id:
+        :return:
+        """
+        e = db_adapter.get_object(Experiment, experiment_id)
+        pool = db_adapter.find_first_object_by(AzureWarmPool, template_id=e.template_id, hackathon_id=e.hackathon_id)
+        if pool is None:
+            return False
+        try:
+            member = self.__lock_member(pool.id)
+            if member is None:
+                db_adapter.commit()
+                metrics.incr(self.MISSED)
+                run_job(TASKS['WarmPool.refill'], (self.azure_key_id, ), (pool.id, ))
+                return False
+            member_id = member.id
+            member_status = member.status
+            for model in self.MEMBER_MODELS:
+                model.query.filter_by(experiment_id=member_id).update({'experiment_id': experiment_id},
+                                                                     synchronize_session=False)
+            # member owns nothing any more
+            member.status = EStatus.Deleted
+            e.azure_key_id = member.azure_key_id
+            db_adapter.commit()
+        except Exception as ex:
+            db_adapter.rollback()
+            log.error(ex)
+            return False
+        metrics.incr(self.CLAIMED)
+        m = self.CLAIM_INFO % (experiment_id, member_id, pool.id)
+        # experiment is running once its virtual environments are
+        commit_azure_log(experiment_id, ALOperation.CREATE, ALStatus.END, m)
+        log.debug(m)
+        if member_status == EStatus.Stopped:
+            run_job(TASKS['AzureFormation.start'], (e.azure_key_id, ), (experiment_id, ))
+        run_job(TASKS['WarmPool.refill'], (self.azure_key_id, ), (pool.id, ))
+        return True
+
+    def refill(self, pool_id):
+        """
+        Create members until warm pool reaches its size, and deallocate ready members if required
+        Run again later while members of a deallocated warm pool are starting
+        :param pool_id:
+        :return:
+        """
+        try:
+            pool = AzureWarmPool.query.filter_by(id=pool_id).with_for_update().first()
+            if pool is None:
+                db_adapter.commit()
+                return
+            members = Experiment.query.filter(Experiment.warm_pool_id == pool_id,
+                                              Experiment.status.in_([EStatus.Starting,
+                                                                     EStatus.Running,
+                                                                     EStatus.Stopped])).all()
+            new_members = []
+            for i in range(pool.size - len(members)):
+                member = Experiment(status=EStatus.Starting,
+                                    template_id=pool.template_id,
+                                    hackathon_id=pool.hackathon_id,
+                                    warm_pool_id=pool_id)
+                db_session.add(member)
+                new_members.append(member)
+            db_adapter.commit()
+        except Exception as e:
+            db_adapter.rollback()
+            log.error(e)
+            return
+        for member in new_members:
+            run_job(TASKS['AzureFormation.create'], (pool.azure_key_id, ), (member.id, ))
+        if pool.status != VEStatus.Stopped:
+            return
+        for member in members:
+            if member.status == EStatus.Running and \
+                    not is_azure_operation_pending(member.id, ALOperation.STOP_VIRTUAL_MACHINE):
+                run_job(TASKS['AzureFormation.stop'],
+                        (member.azure_key_id, ), (member.id, AVMStatus.STOPPED_DEALLOCATED))
+        if new_members or any(member.status == EStatus.Starting for member in members):
+            run_job(TASKS['WarmPool.refill'], (self.azure_key_id, ), (pool_id, ), self.TICK)
+
+    # --------------------------------------------- helper function ---------------------------------------------#
+
+    def __lock_member(self, pool_id):
+        """
+        Return a warm member on requested azure subscription with row lock, ready ones first, None if not found
+        """
+        members = Experiment.query.filter(Experiment.warm_pool_id == pool_id,
+                                          Experiment.status.in_([EStatus.Running, EStatus.Stopped])) \
+            .order_by(Experiment.status).with_for_update().all()
+        for member in members:
+            if self.azure_key_id is not None and member.azure_key_id != self.azure_key_id:
+                continue
+            # skip member being deallocated
+            if member.status == EStatus.Stopped or not self.__is_stop_pending(member.id):
+                return member
+        return None
+
+    def __is_stop_pending(self, member_id):
+        """
+        Same as is_azure_operation_pending of STOP_VIRTUAL_MACHINE, but queried in transaction of row lock,
+        since db adapter commits on every call and would release the lock before member is claimed
+        """
+        logs = AzureLog.query.filter(AzureLog.experiment_id == member_id,
+                                     AzureLog.operation == ALOperation.STOP_VIRTUAL_MACHINE)
+        started = logs.filter(AzureLog.status == ALStatus.START).count()
+        finished = logs.filter(AzureLog.status.in_([ALStatus.END, ALStatus.FAIL])).count()
+        return started > finished
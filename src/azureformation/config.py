@@ -11,9 +11,115 @@ Config = {
     },
     "scheduler": {
         "job_store": "mysql",
-        "job_store_url": 'mysql://%s:%s@%s/%s' % (MYSQL_USER, MYSQL_PWD, MYSQL_HOST, MYSQL_DB)
+        "job_store_url": 'mysql://%s:%s@%s/%s' % (MYSQL_USER, MYSQL_PWD, MYSQL_HOST, MYSQL_DB),
+        # coalesce duplicate poll jobs once queue depth or job lag (in seconds) reaches these thresholds
+        "overload_queue_depth": 1000,
+        "overload_lag": 30,
+        # seconds between samples of queue depth from job store, and after which lag of last job is stale
+        "depth_sample": 5,
+        "lag_window": 60,
+        # max workers of executor pools, see scheduler.py
+        "executors": {
+            "default": 10,
+            "poll": 50,
+            "mutation": 20,
+            "db": 10
+        }
     },
     "azure": {
-        "certBase": "/home/if/If/azure-formation/src/azureformation/certificates"
+        "certBase": "/home/if/If/azure-formation/src/azureformation/certificates",
+        # limits of azure mutations per azure key, see rateLimiter.py
+        "rate_limit": {
+            "rate": 2,
+            "burst": 20,
+            "max_in_flight": 30,
+            "max_wait": 30
+        },
+        # circuit breaker of azure mutations per azure key, see rateLimiter.py
+        "circuit_breaker": {
+            "window": 60,
+            "min_requests": 10,
+            "error_rate": 0.5,
+            "open_time": 120
+        },
+        # pool of storage accounts for os virtual hard disks, see placement.py
+        "storage_placement": {
+            "max_disks": 40,
+            "max_accounts": 10
+        },
+        # index of resources of azure subscription, see inventory.py
+        "inventory": {
+            "enabled": True,
+            "ttl": 300
+        },
+        # merge of network config changes per virtual machine, see networkConfigQueue.py
+        "network_config_queue": {
+            "linger": 1,
+            "flight_ttl": 1000
+        },
+        # coalescing of identical concurrent reads, see singleFlight.py
+        "single_flight": {
+            "enabled": True
+        },
+        # bin-packing of virtual machines into cloud services, see placement.py
+        "cloud_service_placement": {
+            "enabled": False,
+            "max_roles": 50,
+            "max_endpoints": 150,
+            "max_cloud_services": 20
+        },
+        # warm pool of pre-provisioned virtual environments, see warmPool.py
+        "warm_pool": {
+            "tick": 30
+        },
+        # staged warm pool growth ahead of hackathon start, see provisionPlanner.py
+        "provision_planner": {
+            "stage_size": 20,
+            "lead_time": 1800,
+            "min_interval": 300
+        },
+        # resume of provisioning after restart, see provisionJournal.py
+        "provision_journal": {
+            "resume_delay": 30
+        },
+        # stop of idle experiments by heart beat, see reaper.py
+        "reaper": {
+            "idle_timeout": 3600,
+            "tick": 300,
+            "batch_size": 100,
+            "deallocate": True
+        },
+        # drift detection of virtual machine status, see reconciler.py
+        "reconciler": {
+            "tick": 300
+        },
+        # import of existing resources of azure subscription, see subscriptionSync.py
+        "subscription_sync": {
+            "tick": 3600,
+            "fetchers": 10,
+            "batch_size": 100
+        },
+        # choice between stopped and deallocated, see stopPolicy.py
+        "stop_policy": {
+            "resume_window": 1800,
+            "quota_pressure": 0.8,
+            "off_hours": {
+                "start": 22,
+                "end": 7
+            }
+        },
+        # automatic rollback of experiments failed during creation and teardown of cancelled experiments,
+        # see azureFormation.py
+        "teardown": {
+            "rollback": True,
+            "rollback_delay": 60,
+            "cancel_delay": 60
+        },
+        # retry of transient azure errors, see retryEngine.py
+        "retry": {
+            "max_attempts": 5,
+            "base_delay": 10,
+            "max_delay": 300
+        }
     },
 }
@@ -8,8 +8,10 @@ from sqlalchemy import (
     Column,
     Integer,
     String,
+    Float,
     DateTime,
     ForeignKey,
+    Index,
 )
 from sqlalchemy.orm import (
     backref,
@@ -95,6 +97,8 @@ class Hackathon(DBBase):
 
     id = Column(Integer, primary_key=True)
     name = Column(String(50))
+    # utc, None if unknown
+    start_time = Column(DateTime)
 
 
 class AzureKey(DBBase):
@@ -121,6 +125,121 @@ class AzureKey(DBBase):
             self.last_modify_time = datetime.utcnow()
 
 
+class AzureRateLimit(DBBase):
+    """
+    Token bucket of azure management api calls, shared by all worker processes of one azure key
+    """
+    __tablename__ = 'azure_rate_limit'
+
+    id = Column(Integer, primary_key=True)
+    azure_key_id = Column(Integer, ForeignKey('azure_key.id', ondelete='CASCADE'), unique=True)
+    azure_key = relationship('AzureKey', backref=backref('azure_rate_limit', lazy='dynamic'))
+    # tokens refilled per second, lowered when azure throttles and recovered gradually
+    rate = Column(Float)
+    tokens = Column(Float)
+    last_refill_time = Column(DateTime)
+    # no call is issued before this time once azure throttles
+    throttled_until = Column(DateTime)
+
+    def __init__(self, **kwargs):
+        super(AzureRateLimit, self).__init__(**kwargs)
+        if self.last_refill_time is None:
+            self.last_refill_time = datetime.utcnow()
+
+
+class AzureCircuitBreaker(DBBase):
+    """
+    Error rate of azure mutations in current window, shared by all worker processes of one azure key
+    """
+    __tablename__ = 'azure_circuit_breaker'
+
+    id = Column(Integer, primary_key=True)
+    azure_key_id = Column(Integer, ForeignKey('azure_key.id', ondelete='CASCADE'), unique=True)
+    azure_key = relationship('AzureKey', backref=backref('azure_circuit_breaker', lazy='dynamic'))
+    request_count = Column(Integer)
+    error_count = Column(Integer)
+    window_start_time = Column(DateTime)
+    # no mutation is issued before this time once circuit opened
+    open_until = Column(DateTime)
+
+    def __init__(self, **kwargs):
+        super(AzureCircuitBreaker, self).__init__(**kwargs)
+        if self.request_count is None:
+            self.request_count = 0
+        if self.error_count is None:
+            self.error_count = 0
+        if self.window_start_time is None:
+            self.window_start_time = datetime.utcnow()
+
+
+class AzureInFlightOperation(DBBase):
+    """
+    Azure async operation in progress, counted against in-flight operation limit of azure key
+    """
+    __tablename__ = 'azure_in_flight_operation'
+
+    id = Column(Integer, primary_key=True)
+    azure_key_id = Column(Integer, ForeignKey('azure_key.id', ondelete='CASCADE'), index=True)
+    azure_key = relationship('AzureKey', backref=backref('azure_in_flight_operation', lazy='dynamic'))
+    # None before azure returns request id
+    request_id = Column(String(50), index=True)
+    create_time = Column(DateTime)
+
+    def __init__(self, **kwargs):
+        super(AzureInFlightOperation, self).__init__(**kwargs)
+        if self.create_time is None:
+            self.create_time = datetime.utcnow()
+
+
+class AzureSyncFingerprint(DBBase):
+    """
+    Fingerprint of a storage account or cloud service (with its deployments) last synced from azure subscription,
+    resources whose fingerprint is unchanged are skipped by later syncs
+    """
+    __tablename__ = 'azure_sync_fingerprint'
+    __table_args__ = (
+        Index('ix_azure_sync_fingerprint_resource', 'azure_key_id', 'resource_type', 'name', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    azure_key_id = Column(Integer, ForeignKey('azure_key.id', ondelete='CASCADE'))
+    azure_key = relationship('AzureKey', backref=backref('azure_sync_fingerprint', lazy='dynamic'))
+    # STORAGE_ACCOUNT or CLOUD_SERVICE in enum.py
+    resource_type = Column(String(50))
+    name = Column(String(50))
+    fingerprint = Column(String(50))
+    update_time = Column(DateTime)
+
+    def __init__(self, **kwargs):
+        super(AzureSyncFingerprint, self).__init__(**kwargs)
+        if self.update_time is None:
+            self.update_time = datetime.utcnow()
+
+
+class AzureResourceChange(DBBase):
+    """
+    Last mutation of a resource of azure subscription by any worker process, which invalidates what other
+    processes have indexed of it in their inventories
+    """
+    __tablename__ = 'azure_resource_change'
+    __table_args__ = (
+        Index('ix_azure_resource_change_resource', 'azure_key_id', 'resource_type', 'name', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    azure_key_id = Column(Integer, ForeignKey('azure_key.id', ondelete='CASCADE'))
+    azure_key = relationship('AzureKey', backref=backref('azure_resource_change', lazy='dynamic'))
+    # STORAGE_ACCOUNT, CLOUD_SERVICE or DEPLOYMENT in enum.py, name of cloud service for DEPLOYMENT
+    resource_type = Column(String(50))
+    name = Column(String(50))
+    change_time = Column(DateTime)
+
+    def __init__(self, **kwargs):
+        super(AzureResourceChange, self).__init__(**kwargs)
+        if self.change_time is None:
+            self.change_time = datetime.utcnow()
+
+
 class UserAzureKey(DBBase):
     __tablename__ = 'user_azure_key'
 
@@ -157,6 +276,36 @@ class Template(DBBase):
             self.virtual_environment_count = 0
 
 
+class AzureWarmPool(DBBase):
+    """
+    Warm pool of pre-provisioned virtual environments of a template
+    """
+    __tablename__ = 'azure_warm_pool'
+
+    id = Column(Integer, primary_key=True)
+    template_id = Column(Integer, ForeignKey('template.id', ondelete='CASCADE'))
+    template = relationship('Template', backref=backref('azure_warm_pool_t', lazy='dynamic'))
+    # None if warm pool serves user using template directly
+    hackathon_id = Column(Integer, ForeignKey('hackathon.id', ondelete='CASCADE'))
+    hackathon = relationship('Hackathon', backref=backref('azure_warm_pool_h', lazy='dynamic'))
+    # None if members are placed onto azure subscriptions of hackathon
+    azure_key_id = Column(Integer, ForeignKey('azure_key.id', ondelete='CASCADE'))
+    azure_key = relationship('AzureKey', backref=backref('azure_warm_pool_a', lazy='dynamic'))
+    # number of warm experiments to keep
+    size = Column(Integer)
+    # VEStatus in enum.py, Running or Stopped (deallocated)
+    status = Column(Integer)
+    create_time = Column(DateTime)
+    last_modify_time = Column(DateTime)
+
+    def __init__(self, **kwargs):
+        super(AzureWarmPool, self).__init__(**kwargs)
+        if self.create_time is None:
+            self.create_time = datetime.utcnow()
+        if self.last_modify_time is None:
+            self.last_modify_time = datetime.utcnow()
+
+
 class Experiment(DBBase):
     """
     Experiment is launched once template is used:
@@ -165,6 +314,10 @@ class Experiment(DBBase):
     3. user use template via hackathon (online)
     """
     __tablename__ = 'experiment'
+    # idle experiments are found by range query on heart beat of running experiments, see reaper.py
+    __table_args__ = (
+        Index('ix_experiment_status_last_heart_beat_time', 'status', 'last_heart_beat_time'),
+    )
 
     id = Column(Integer, primary_key=True)
     # EStatus in enum.py
@@ -177,6 +330,12 @@ class Experiment(DBBase):
     # None if user use template directly
     hackathon_id = Column(Integer, ForeignKey('hackathon.id', ondelete='CASCADE'))
     hackathon = relationship('Hackathon', backref=backref('experiment_h', lazy='dynamic'))
+    # azure subscription the experiment is placed on
+    azure_key_id = Column(Integer, ForeignKey('azure_key.id', ondelete='CASCADE'))
+    azure_key = relationship('AzureKey', backref=backref('experiment_a', lazy='dynamic'))
+    # not None if experiment is a member of warm pool, which is not claimed yet
+    warm_pool_id = Column(Integer, ForeignKey('azure_warm_pool.id', ondelete='CASCADE'))
+    warm_pool = relationship('AzureWarmPool', backref=backref('experiment_w', lazy='dynamic'))
     create_time = Column(DateTime)
     last_heart_beat_time = Column(DateTime)
 
@@ -265,6 +424,104 @@ class AzureStorageAccount(DBBase):
             self.last_modify_time = datetime.utcnow()
 
 
+class AzureVirtualHardDisk(DBBase):
+    """
+    Azure virtual hard disk of virtual machine, indexed by storage account it is placed in
+    """
+    __tablename__ = 'azure_virtual_hard_disk'
+
+    id = Column(Integer, primary_key=True)
+    storage_account_name = Column(String(50), index=True)
+    # None until virtual machine is created
+    media_link = Column(String(200))
+    cloud_service_name = Column(String(50))
+    virtual_machine_name = Column(String(50))
+    experiment_id = Column(Integer, ForeignKey('experiment.id', ondelete='CASCADE'))
+    experiment = relationship('Experiment', backref=backref('azure_virtual_hard_disk', lazy='dynamic'))
+    create_time = Column(DateTime)
+
+    def __init__(self, **kwargs):
+        super(AzureVirtualHardDisk, self).__init__(**kwargs)
+        if self.create_time is None:
+            self.create_time = datetime.utcnow()
+
+
+class AzureVirtualMachinePlacement(DBBase):
+    """
+    Cloud service a virtual machine is packed into, indexed by cloud service
+    """
+    __tablename__ = 'azure_virtual_machine_placement'
+
+    id = Column(Integer, primary_key=True)
+    cloud_service_name = Column(String(50), index=True)
+    deployment_slot = Column(String(50))
+    virtual_machine_name = Column(String(50))
+    # input endpoints of virtual machine, which take public ports of cloud service
+    endpoint_count = Column(Integer)
+    experiment_id = Column(Integer, ForeignKey('experiment.id', ondelete='CASCADE'))
+    experiment = relationship('Experiment', backref=backref('azure_virtual_machine_placement', lazy='dynamic'))
+    create_time = Column(DateTime)
+
+    def __init__(self, **kwargs):
+        super(AzureVirtualMachinePlacement, self).__init__(**kwargs)
+        if self.create_time is None:
+            self.create_time = datetime.utcnow()
+
+
+class AzureProvisionJournal(DBBase):
+    """
+    Last completed provisioning step of a virtual machine of experiment, from which provisioning is resumed
+    after restart
+    """
+    __tablename__ = 'azure_provision_journal'
+
+    id = Column(Integer, primary_key=True)
+    virtual_machine_name = Column(String(50))
+    # PJStep in enum.py
+    step = Column(String(50))
+    experiment_id = Column(Integer, ForeignKey('experiment.id', ondelete='CASCADE'), index=True)
+    experiment = relationship('Experiment', backref=backref('azure_provision_journal', lazy='dynamic'))
+    update_time = Column(DateTime)
+
+    def __init__(self, **kwargs):
+        super(AzureProvisionJournal, self).__init__(**kwargs)
+        if self.update_time is None:
+            self.update_time = datetime.utcnow()
+
+
+class AzureNetworkConfigChange(DBBase):
+    """
+    A change of network config of a virtual machine, merged with other pending changes of the same virtual machine
+    into one update of its network config, see networkConfigQueue.py
+    """
+    __tablename__ = 'azure_network_config_change'
+
+    id = Column(Integer, primary_key=True)
+    azure_key_id = Column(Integer, ForeignKey('azure_key.id', ondelete='CASCADE'))
+    cloud_service_name = Column(String(50), index=True)
+    deployment_name = Column(String(50))
+    virtual_machine_name = Column(String(50))
+    # NCKind in enum.py
+    kind = Column(String(50))
+    # json list of private endpoints
+    private_endpoints = Column(String(500))
+    # json list of public endpoints assigned by NCKind.ADD
+    public_endpoints = Column(String(500))
+    # NCStatus in enum.py
+    status = Column(String(50))
+    # async operation of update which change is merged into
+    request_id = Column(String(50))
+    create_time = Column(DateTime)
+    last_modify_time = Column(DateTime)
+
+    def __init__(self, **kwargs):
+        super(AzureNetworkConfigChange, self).__init__(**kwargs)
+        if self.create_time is None:
+            self.create_time = datetime.utcnow()
+        if self.last_modify_time is None:
+            self.last_modify_time = datetime.utcnow()
+
+
 class AzureCloudService(DBBase):
     """
     Azure cloud service information
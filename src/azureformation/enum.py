@@ -19,6 +19,7 @@ class EStatus:
     Failed = 5
     Rollbacking = 6
     Rollbacked = 7
+    Cancelled = 8
 
 
 class VEProvider:
@@ -59,6 +60,11 @@ class ALOperation:
     STOP_VIRTUAL_MACHINE = STOP + ' ' + VIRTUAL_MACHINE
     START = 'start'
     START_VIRTUAL_MACHINE = START + VIRTUAL_MACHINE
+    DELETE = 'delete'
+    DELETE_STORAGE_ACCOUNT = DELETE + ' ' + STORAGE_ACCOUNT
+    DELETE_CLOUD_SERVICE = DELETE + ' ' + CLOUD_SERVICE
+    DELETE_DEPLOYMENT = DELETE + ' ' + DEPLOYMENT
+    DELETE_VIRTUAL_MACHINE = DELETE + ' ' + VIRTUAL_MACHINE
 
 
 class ALStatus:
@@ -68,6 +74,50 @@ class ALStatus:
     START = 'start'
     FAIL = 'fail'
     END = 'end'
+    RETRY = 'retry'
+
+
+class PJStep:
+    """
+    For step in db model AzureProvisionJournal, in order of provisioning
+    """
+    # storage account and cloud service ready, virtual machine launched
+    CLOUD_SERVICE_READY = 'cloud service ready'
+    DEPLOYMENT_READY = 'deployment ready'
+    ROLE_ADDED = 'role added'
+    NETWORK_UPDATED = 'network updated'
+    VIRTUAL_MACHINE_READY = 'virtual machine ready'
+
+
+class NCKind:
+    """
+    For kind in db model AzureNetworkConfigChange
+    """
+    ADD = 'add'
+    REMOVE = 'remove'
+
+
+class NCStatus:
+    """
+    For status in db model AzureNetworkConfigChange
+    """
+    PENDING = 'pending'
+    # merged into an update of network config in flight
+    FLUSHING = 'flushing'
+    END = 'end'
+    FAIL = 'fail'
+
+
+class AzureErrorType:
+    """
+    For error classification in RetryEngine
+    """
+    CONFLICT = 'conflict'
+    THROTTLING = 'throttling'
+    INTERNAL_ERROR = 'internal error'
+    NOT_FOUND = 'not found'
+    CIRCUIT_OPEN = 'circuit open'
+    OTHER = 'other'
 
 
 class ASAStatus:
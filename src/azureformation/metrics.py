@@ -0,0 +1,78 @@
+__author__ = 'Yifu Huang'
+
+from threading import (
+    Lock,
+)
+
+
+class Metrics(object):
+    """
+    In-process counters, gauges and histograms for runtime telemetry
+    """
+    # upper bounds (in seconds) of histogram buckets
+    BUCKETS = [0.1, 0.5, 1, 5, 10, 30, 60, 300, 600]
+    INF = '+Inf'
+
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def gauge_add(self, name, delta):
+        with self.lock:
+            self.gauges[name] = self.gauges.get(name, 0) + delta
+
+    def get_counter(self, name):
+        return self.counters.get(name, 0)
+
+    def get_gauge(self, name):
+        return self.gauges.get(name, 0)
+
+    def observe(self, name, value):
+        """
+        Record value into histogram of given name
+        :param name:
+        :param value: a number, usually seconds
+        :return:
+        """
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = {
+                    'count': 0,
+                    'sum': 0.0,
+                    'max': 0.0,
+                    'buckets': dict((str(b), 0) for b in self.BUCKETS + [self.INF]),
+                }
+                self.histograms[name] = histogram
+            histogram['count'] += 1
+            histogram['sum'] += value
+            histogram['max'] = max(histogram['max'], value)
+            for bound in self.BUCKETS:
+                if value <= bound:
+                    histogram['buckets'][str(bound)] += 1
+                    break
+            else:
+                histogram['buckets'][self.INF] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'histograms': dict((k, dict(v, buckets=dict(v['buckets']))) for k, v in self.histograms.items()),
+            }
+
+# usage:
+# from metrics import metrics
+# metrics.incr("some counter")
+metrics = Metrics()
@@ -8,31 +8,164 @@ from src.azureformation import (
 from src.azureformation.log import (
     log,
 )
+from src.azureformation.metrics import (
+    metrics,
+)
 from apscheduler.schedulers.background import (
     BackgroundScheduler,
 )
+from apscheduler.executors.pool import (
+    ThreadPoolExecutor,
+)
 from apscheduler.events import (
+    EVENT_JOB_SUBMITTED,
     EVENT_JOB_EXECUTED,
     EVENT_JOB_ERROR,
+    EVENT_JOB_MISSED,
+    EVENT_JOB_MAX_INSTANCES,
+)
+from datetime import (
+    datetime,
 )
 import os
+import time
+
+# metric names
+JOB_QUEUE_DEPTH = 'scheduler.job.queue_depth'
+JOB_RUNNING = 'scheduler.job.running'
+JOB_LAG = 'scheduler.job.lag'
+JOB_LAST_LAG = 'scheduler.job.last_lag'
+JOB_EXECUTED = 'scheduler.job.executed'
+JOB_ERROR = 'scheduler.job.error'
+JOB_MISSED = 'scheduler.job.missed'
+JOB_MAX_INSTANCES = 'scheduler.job.max_instances'
+JOB_COALESCED = 'scheduler.job.coalesced'
+JOB_CANCELLED = 'scheduler.job.cancelled'
+OVERLOAD = 'scheduler.overload'
+EXECUTOR_BUSY = 'scheduler.executor.%s.busy'
+EXECUTOR_SIZE = 'scheduler.executor.%s.size'
+EXECUTOR_SATURATION = 'scheduler.executor.%s.saturation'
+# executor aliases, cheap status polls, blocking azure mutations and db bookkeeping run in separate pools
+EXECUTOR_DEFAULT = 'default'
+EXECUTOR_POLL = 'poll'
+EXECUTOR_MUTATION = 'mutation'
+EXECUTOR_DB = 'db'
+# max workers of each executor
+EXECUTORS = safe_get_config("scheduler.executors", {
+    EXECUTOR_DEFAULT: 10,
+    EXECUTOR_POLL: 50,
+    EXECUTOR_MUTATION: 20,
+    EXECUTOR_DB: 10,
+})
+# overload thresholds
+OVERLOAD_QUEUE_DEPTH = safe_get_config("scheduler.overload_queue_depth", 1000)
+OVERLOAD_LAG = safe_get_config("scheduler.overload_lag", 30)
+# seconds between samples of queue depth from job store, and after which lag of last submitted job is stale
+DEPTH_SAMPLE = safe_get_config("scheduler.depth_sample", 5)
+LAG_WINDOW = safe_get_config("scheduler.lag_window", 60)
+# time of last queue depth sample and last lag
+samples = {JOB_QUEUE_DEPTH: 0, JOB_LAST_LAG: 0}
+
+
+class MeteredThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    Thread pool executor reporting how many of its threads are busy
+    Saturation above 1 means jobs are queued inside the pool
+    """
+
+    def __init__(self, max_workers):
+        super(MeteredThreadPoolExecutor, self).__init__(max_workers)
+        self.max_workers = max_workers
+        self.alias = None
+
+    def start(self, scheduler, alias):
+        super(MeteredThreadPoolExecutor, self).start(scheduler, alias)
+        self.alias = alias
+        metrics.gauge(EXECUTOR_SIZE % alias, self.max_workers)
+
+    def submit_job(self, job, run_times):
+        super(MeteredThreadPoolExecutor, self).submit_job(job, run_times)
+        self.__update_busy(1)
+
+    def _run_job_success(self, job_id, events):
+        self.__update_busy(-1)
+        super(MeteredThreadPoolExecutor, self)._run_job_success(job_id, events)
+
+    def _run_job_error(self, job_id, exc, traceback=None):
+        self.__update_busy(-1)
+        super(MeteredThreadPoolExecutor, self)._run_job_error(job_id, exc, traceback)
+
+    def __update_busy(self, delta):
+        metrics.gauge_add(EXECUTOR_BUSY % self.alias, delta)
+        metrics.gauge(EXECUTOR_SATURATION % self.alias,
+                      float(metrics.get_gauge(EXECUTOR_BUSY % self.alias)) / self.max_workers)
 
 
 def scheduler_listener(event):
-    if event.code == EVENT_JOB_ERROR:
+    if event.code == EVENT_JOB_SUBMITTED:
+        metrics.gauge_add(JOB_RUNNING, 1)
+        for run_time in event.scheduled_run_times:
+            # lag between run date and actual submission to executor
+            lag = (datetime.now(run_time.tzinfo) - run_time).total_seconds()
+            metrics.observe(JOB_LAG, lag)
+            metrics.gauge(JOB_LAST_LAG, lag)
+            samples[JOB_LAST_LAG] = time.time()
+    elif event.code == EVENT_JOB_MISSED:
+        metrics.incr(JOB_MISSED)
+        log.warn("The schedule job %s missed its run time %s" % (event.job_id, event.scheduled_run_time))
+    elif event.code == EVENT_JOB_MAX_INSTANCES:
+        # executor is saturated by instances of the same job
+        metrics.incr(JOB_MAX_INSTANCES)
+        log.warn("The schedule job %s skipped because of max instances reached" % event.job_id)
+    elif event.code == EVENT_JOB_ERROR:
+        metrics.gauge_add(JOB_RUNNING, -1)
+        metrics.incr(JOB_ERROR)
         print('The job crashed :(')
         log.warn("The schedule job crashed because of %s" % repr(event.exception))
     else:
+        metrics.gauge_add(JOB_RUNNING, -1)
+        metrics.incr(JOB_EXECUTED)
         print('The job executed :)')
         log.debug("The schedule job %s executed and return value is '%s'" % (event.job_id, event.retval))
 
 
+def sample_queue_depth():
+    """
+    Read queue depth from job store at most every DEPTH_SAMPLE seconds
+    Counting job events drifts, since replacing a job fires EVENT_JOB_ADDED without EVENT_JOB_REMOVED
+    :return:
+    """
+    now = time.time()
+    if now - samples[JOB_QUEUE_DEPTH] >= DEPTH_SAMPLE:
+        samples[JOB_QUEUE_DEPTH] = now
+        metrics.gauge(JOB_QUEUE_DEPTH, len(scheduler.get_jobs()))
+    return metrics.get_gauge(JOB_QUEUE_DEPTH)
+
+
+def is_overloaded():
+    """
+    Whether scheduler is overloaded, judged by queue depth and lag of the latest submitted job
+    Lag is ignored once no job is submitted for LAG_WINDOW seconds
+    :return:
+    """
+    if time.time() - samples[JOB_LAST_LAG] >= LAG_WINDOW:
+        metrics.gauge(JOB_LAST_LAG, 0)
+    overloaded = sample_queue_depth() >= OVERLOAD_QUEUE_DEPTH or \
+        metrics.get_gauge(JOB_LAST_LAG) >= OVERLOAD_LAG
+    metrics.gauge(OVERLOAD, 1 if overloaded else 0)
+    return overloaded
+
+
 if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
     scheduler = BackgroundScheduler()
     # job store
     if safe_get_config("scheduler.job_store", "memory") == "mysql":
         scheduler.add_jobstore('sqlalchemy', url=get_config("scheduler.job_store_url"))
+    # executors
+    for alias, max_workers in EXECUTORS.items():
+        scheduler.add_executor(MeteredThreadPoolExecutor(max_workers), alias)
     # listener
-    # do we need listen EVENT_JOB_MISSED?
-    scheduler.add_listener(scheduler_listener, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
-    scheduler.start()
\ No newline at end of file
+    scheduler.add_listener(scheduler_listener,
+                           EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED |
+                           EVENT_JOB_MAX_INSTANCES)
+    scheduler.start()
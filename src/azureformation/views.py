@@ -3,8 +3,19 @@ __author__ = 'Yifu Huang'
 from src.azureformation import (
     app
 )
+from src.azureformation.metrics import (
+    metrics,
+)
+from flask import (
+    jsonify,
+)
 
 
 @app.route('/')
 def index():
-    return 'Hello World!'
\ No newline at end of file
+    return 'Hello World!'
+
+
+@app.route('/metrics')
+def get_metrics():
+    return jsonify(metrics.snapshot())
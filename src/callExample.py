@@ -10,7 +10,6 @@ from src.azureformation.database.models import (
     Template,
     User,
     Hackathon,
-    HackathonAzureKey,
 )
 from src.azureformation.enum import (
     EStatus,
@@ -25,8 +24,8 @@ from src.azureformation.azureoperation.azureFormation import (
 t = db_adapter.find_first_object(Template)
 u = db_adapter.find_first_object(User)
 h = db_adapter.find_first_object(Hackathon)
-ha = db_adapter.find_first_object_by(HackathonAzureKey, hackathon=h)
-af = AzureFormation(ha.azure_key_id)
+# experiment is placed onto the azure subscription of hackathon with most headroom
+af = AzureFormation()
 
 # create
 e = db_adapter.add_object_kwargs(Experiment,
@@ -3,6 +3,30 @@ __author__ = 'Yifu Huang'
 from src.azureformation import (
     app
 )
+from src.azureformation.azureoperation.reaper import (
+    Reaper,
+)
+from src.azureformation.azureoperation.provisionJournal import (
+    ProvisionJournal,
+)
+from src.azureformation.azureoperation.reconciler import (
+    Reconciler,
+)
+from src.azureformation.azureoperation.taskRegistry import (
+    TASKS,
+)
+
+
+def start():
+    """
+    Resolve tasks and schedule background jobs when server starts, not whenever package is imported
+    """
+    TASKS.resolve()
+    Reaper.schedule()
+    ProvisionJournal.schedule_resume()
+    Reconciler.schedule()
+
 
 if __name__ == "__main__":
+    start()
     app.run(host='0.0.0.0', port=80, debug=True)
\ No newline at end of file
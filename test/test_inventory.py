@@ -0,0 +1,95 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.inventory import (
+    Inventory,
+)
+from src.azureformation.enum import (
+    STORAGE_ACCOUNT,
+    DEPLOYMENT,
+)
+from mock import (
+    Mock,
+    patch,
+)
+import unittest
+
+
+class InventoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db_adapter_patcher = patch('src.azureformation.azureoperation.inventory.db_adapter')
+        self.db_adapter = self.db_adapter_patcher.start()
+        # no resource is mutated by other worker processes
+        self.db_adapter.count.return_value = 0
+        self.inventory = Inventory(0)
+        self.service = Mock()
+        self.service.NOT_FOUND = 'Not found (Not Found)'
+
+    def tearDown(self):
+        self.db_adapter_patcher.stop()
+
+    def test_storage_account_exists(self):
+        self.service.list_storage_accounts.return_value.storage_services = [Mock(service_name='sa')]
+        self.assertTrue(self.inventory.storage_account_exists(self.service, 'sa'))
+        self.assertFalse(self.inventory.storage_account_exists(self.service, 'sa-1'))
+        # answered locally once listed
+        self.assertEqual(self.service.list_storage_accounts.call_count, 1)
+
+    def test_changed_by_other_process(self):
+        self.service.list_storage_accounts.return_value.storage_services = []
+        self.assertFalse(self.inventory.storage_account_exists(self.service, 'sa'))
+        # created by another worker process since listed
+        self.db_adapter.count.return_value = 1
+        self.assertIsNone(self.inventory.storage_account_exists(self.service, 'sa'))
+        # answered locally again once service records answer of azure
+        self.inventory.set_storage_account('sa', True)
+        self.db_adapter.count.return_value = 0
+        self.assertTrue(self.inventory.storage_account_exists(self.service, 'sa'))
+        self.assertEqual(self.service.list_storage_accounts.call_count, 1)
+
+    def test_track_publishes_change(self):
+        self.db_adapter.find_first_object_by.return_value = None
+        self.inventory.track('request', STORAGE_ACCOUNT, 'sa')
+        self.assertEqual(self.db_adapter.add_object_kwargs.call_args[1]['name'], 'sa')
+        change = Mock()
+        self.db_adapter.find_first_object_by.return_value = change
+        self.inventory.settle('request')
+        self.assertEqual(self.db_adapter.update_object.call_args[0][0], change)
+
+    def test_track_and_settle(self):
+        self.service.list_storage_accounts.return_value.storage_services = []
+        self.assertFalse(self.inventory.storage_account_exists(self.service, 'sa'))
+        self.inventory.track('request', STORAGE_ACCOUNT, 'sa')
+        self.assertIsNone(self.inventory.storage_account_exists(self.service, 'sa'))
+        self.inventory.set_storage_account('sa', False)
+        self.assertFalse(self.inventory.storage_account_exists(self.service, 'sa'))
+        # unknown again once async operation completes
+        self.inventory.settle('request')
+        self.assertIsNone(self.inventory.storage_account_exists(self.service, 'sa'))
+
+    def test_virtual_machine_exists(self):
+        role = Mock(role_name='vm')
+        deployment = Mock(deployment_slot='Production')
+        deployment.name = 'dn'
+        deployment.role_list.roles = [role]
+        self.service.get_hosted_service_properties.return_value.deployments.deployments = [deployment]
+        self.assertTrue(self.inventory.deployment_exists(self.service, 'cs', 'production'))
+        self.assertFalse(self.inventory.deployment_exists(self.service, 'cs', 'staging'))
+        self.assertTrue(self.inventory.virtual_machine_exists(self.service, 'cs', 'dn', 'vm'))
+        self.assertFalse(self.inventory.virtual_machine_exists(self.service, 'cs', 'dn', 'vm-1'))
+        self.assertEqual(self.service.get_hosted_service_properties.call_count, 1)
+        # detail is fetched again after a mutation of deployment
+        self.inventory.track(None, DEPLOYMENT, 'cs')
+        self.assertTrue(self.inventory.deployment_exists(self.service, 'cs', 'production'))
+        self.assertEqual(self.service.get_hosted_service_properties.call_count, 2)
+        # answer of azure recorded by service
+        self.inventory.set_deployment('cs', 'Production', None)
+        self.assertFalse(self.inventory.deployment_exists(self.service, 'cs', 'production'))
+        self.assertEqual(self.service.get_hosted_service_properties.call_count, 2)
+
+    def test_cloud_service_not_found(self):
+        self.service.get_hosted_service_properties.side_effect = Exception('Not found (Not Found)')
+        self.assertFalse(self.inventory.deployment_exists(self.service, 'cs', 'production'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.metrics import (
+    Metrics,
+)
+import unittest
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def tearDown(self):
+        pass
+
+    def test_incr(self):
+        name = 'fdj34'
+        self.assertEqual(self.metrics.get_counter(name), 0)
+        self.metrics.incr(name)
+        self.metrics.incr(name, 2)
+        self.assertEqual(self.metrics.get_counter(name), 3)
+
+    def test_gauge(self):
+        name = 'dsj43'
+        self.metrics.gauge(name, 5)
+        self.metrics.gauge_add(name, -2)
+        self.assertEqual(self.metrics.get_gauge(name), 3)
+
+    def test_observe(self):
+        name = 'gr4t5'
+        self.metrics.observe(name, 0.05)
+        self.metrics.observe(name, 7)
+        self.metrics.observe(name, 1000)
+        histogram = self.metrics.snapshot()['histograms'][name]
+        self.assertEqual(histogram['count'], 3)
+        self.assertEqual(histogram['max'], 1000)
+        self.assertEqual(histogram['buckets']['0.1'], 1)
+        self.assertEqual(histogram['buckets']['10'], 1)
+        self.assertEqual(histogram['buckets'][Metrics.INF], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.endpoint import (
+    Endpoint,
+)
+from src.azureformation.azureoperation.networkConfigQueue import (
+    NetworkConfigQueue,
+)
+from src.azureformation.azureoperation.service import (
+    Service,
+)
+from src.azureformation.azureoperation.utility import (
+    TASKS,
+)
+from src.azureformation.enum import (
+    NCKind,
+    NCStatus,
+)
+from mock import (
+    Mock,
+    patch,
+)
+from azure.servicemanagement import (
+    ConfigurationSet,
+    ConfigurationSetInputEndpoint,
+)
+from datetime import (
+    datetime,
+    timedelta,
+)
+import json
+import unittest
+
+
+class NetworkConfigQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.service = Mock(spec=Service)
+        self.service.azure_key_id = 1
+        network_config = ConfigurationSet()
+        network_config.configuration_set_type = 'NetworkConfiguration'
+        network_config.input_endpoints.input_endpoints = [
+            ConfigurationSetInputEndpoint('ssh', 'tcp', '10022', '22')]
+        self.service.get_virtual_machine_network_config.return_value = network_config
+        self.service.get_assigned_endpoints.return_value = [10022]
+        self.request_id = 'r'
+        self.service.update_virtual_machine_network_config.return_value.request_id = self.request_id
+        self.queue = NetworkConfigQueue(self.service)
+        self.args = ('cs', 'dm', 'vm')
+        self.job_id = NetworkConfigQueue.FLUSH_JOB_ID % ((1, ) + self.args)
+
+    def tearDown(self):
+        pass
+
+    def new_change(self, id, kind, private_endpoints, status=NCStatus.PENDING, last_modify_time=None):
+        return Mock(id=id, kind=kind, private_endpoints=json.dumps(private_endpoints), status=status,
+                    last_modify_time=last_modify_time or datetime.utcnow())
+
+    def lock_changes(self, model, changes):
+        model.query.filter_by.return_value.filter.return_value.order_by.return_value.with_for_update.return_value \
+            .all.return_value = changes
+
+    @patch('src.azureformation.azureoperation.networkConfigQueue.run_job')
+    @patch('src.azureformation.azureoperation.networkConfigQueue.db_adapter')
+    def test_submit(self, db_adapter, run_job):
+        db_adapter.add_object_kwargs.return_value.id = 3
+        self.assertEqual(self.queue.submit('cs', 'dm', 'vm', NCKind.ADD, [80]), 3)
+        self.queue.submit('cs', 'dm', 'vm', NCKind.ADD, [8080])
+        # changes in a row push back the same flush job of virtual machine
+        run_job.assert_called_with(TASKS['NetworkConfigQueue.flush'], (1, ), self.args, NetworkConfigQueue.LINGER,
+                                   self.job_id)
+        self.assertEqual(run_job.call_count, 2)
+        self.assertEqual(db_adapter.add_object_kwargs.call_args[1]['status'], NCStatus.PENDING)
+
+    @patch('src.azureformation.azureoperation.networkConfigQueue.run_job')
+    @patch('src.azureformation.azureoperation.networkConfigQueue.db_adapter')
+    @patch('src.azureformation.azureoperation.networkConfigQueue.AzureNetworkConfigChange')
+    def test_flush(self, model, db_adapter, run_job):
+        changes = [self.new_change(1, NCKind.ADD, [80]),
+                   self.new_change(2, NCKind.ADD, [80]),
+                   self.new_change(3, NCKind.REMOVE, [22])]
+        self.lock_changes(model, changes)
+        self.queue.flush(*self.args)
+        self.assertEqual(self.service.update_virtual_machine_network_config.call_count, 1)
+        network_config = self.service.update_virtual_machine_network_config.call_args[0][3]
+        self.assertEqual([e.local_port for e in network_config.input_endpoints.input_endpoints], ['80', '80'])
+        # public endpoints of merged changes do not collide
+        self.assertEqual([e.port for e in network_config.input_endpoints.input_endpoints], ['80', '81'])
+        self.assertEqual([c.public_endpoints for c in changes], ['[80]', '[81]', None])
+        self.assertEqual([c.status for c in changes], [NCStatus.FLUSHING] * 3)
+        model.query.filter.return_value.update.assert_called_once_with({'request_id': self.request_id},
+                                                                       synchronize_session=False)
+        self.assertEqual(run_job.call_args[0][0], TASKS['Service.query_async_operation_status'])
+
+    @patch('src.azureformation.azureoperation.networkConfigQueue.run_job')
+    @patch('src.azureformation.azureoperation.networkConfigQueue.db_adapter')
+    @patch('src.azureformation.azureoperation.networkConfigQueue.AzureNetworkConfigChange')
+    def test_flush_in_flight(self, model, db_adapter, run_job):
+        pending = self.new_change(2, NCKind.ADD, [80])
+        self.lock_changes(model, [self.new_change(1, NCKind.REMOVE, [22], NCStatus.FLUSHING), pending])
+        # changes submitted while update is in flight wait for it, whichever process flushes
+        self.queue.flush(*self.args)
+        self.assertFalse(self.service.update_virtual_machine_network_config.called)
+        self.assertEqual(pending.status, NCStatus.PENDING)
+        self.assertTrue(db_adapter.commit.called)
+
+    @patch('src.azureformation.azureoperation.networkConfigQueue.run_job')
+    @patch('src.azureformation.azureoperation.networkConfigQueue.db_adapter')
+    @patch('src.azureformation.azureoperation.networkConfigQueue.AzureNetworkConfigChange')
+    def test_flush_expired(self, model, db_adapter, run_job):
+        expired = self.new_change(1, NCKind.REMOVE, [22], NCStatus.FLUSHING,
+                                  datetime.utcnow() - timedelta(seconds=NetworkConfigQueue.FLIGHT_TTL + 1))
+        pending = self.new_change(2, NCKind.ADD, [80])
+        self.lock_changes(model, [expired, pending])
+        self.queue.flush(*self.args)
+        self.assertEqual(expired.status, NCStatus.FAIL)
+        self.assertEqual(pending.status, NCStatus.FLUSHING)
+        self.assertEqual(self.service.update_virtual_machine_network_config.call_count, 1)
+
+    @patch('src.azureformation.azureoperation.networkConfigQueue.run_job')
+    @patch('src.azureformation.azureoperation.networkConfigQueue.db_adapter')
+    @patch('src.azureformation.azureoperation.networkConfigQueue.AzureNetworkConfigChange')
+    def test_flush_error(self, model, db_adapter, run_job):
+        self.service.update_virtual_machine_network_config.side_effect = Exception('Conflict')
+        self.lock_changes(model, [self.new_change(1, NCKind.ADD, [80])])
+        db_adapter.count_by.return_value = 0
+        self.queue.flush(*self.args)
+        update = model.query.filter.return_value.update
+        self.assertEqual(update.call_args[0][0]['status'], NCStatus.FAIL)
+        self.assertFalse(run_job.called)
+
+    @patch('src.azureformation.azureoperation.networkConfigQueue.run_job')
+    @patch('src.azureformation.azureoperation.networkConfigQueue.db_adapter')
+    @patch('src.azureformation.azureoperation.networkConfigQueue.AzureNetworkConfigChange')
+    def test_flush_vm_true(self, model, db_adapter, run_job):
+        db_adapter.count_by.return_value = 1
+        self.queue.flush_vm_true(self.request_id, *self.args)
+        update = model.query.filter.return_value.update
+        self.assertEqual(update.call_args[0][0]['status'], NCStatus.END)
+        # changes queued in the meantime are flushed at once
+        run_job.assert_called_once_with(TASKS['NetworkConfigQueue.flush'], (1, ), self.args, 0, self.job_id)
+
+    @patch('src.azureformation.azureoperation.networkConfigQueue.time')
+    @patch('src.azureformation.azureoperation.networkConfigQueue.db_adapter')
+    def test_wait(self, db_adapter, time):
+        db_adapter.get_object.side_effect = [Mock(status=NCStatus.PENDING), Mock(status=NCStatus.FLUSHING),
+                                             Mock(status=NCStatus.END)]
+        self.assertEqual(self.queue.wait(3, 5, 2).status, NCStatus.END)
+        self.assertEqual(time.sleep.call_count, 2)
+        db_adapter.get_object.side_effect = None
+        db_adapter.get_object.return_value = Mock(status=NCStatus.PENDING)
+        self.assertIsNone(self.queue.wait(3, 5, 2))
+
+    @patch('src.azureformation.azureoperation.endpoint.NetworkConfigQueue')
+    def test_endpoint(self, queue):
+        queue.return_value.wait.return_value = Mock(status=NCStatus.END, public_endpoints='[81]')
+        endpoint = Endpoint(self.service)
+        self.assertEqual(endpoint.assign_public_endpoints('cs', 'production', 'vm', [80]), [81])
+        self.assertEqual(queue.return_value.submit.call_args[0][3], NCKind.ADD)
+        self.assertTrue(endpoint.release_public_endpoints_async('cs', 'production', 'vm', [80]).result())
+        queue.return_value.wait.return_value = Mock(status=NCStatus.FAIL)
+        self.assertIsNone(endpoint.assign_public_endpoints('cs', 'production', 'vm', [80]))
+
+
+if __name__ == '__main__':
+    unittest.main()
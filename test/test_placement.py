@@ -0,0 +1,148 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.azureFormation import (
+    AzureFormation,
+)
+from src.azureformation.azureoperation.placement import (
+    CloudServicePlacement,
+    StoragePlacement,
+    SubscriptionPlacement,
+)
+from mock import (
+    Mock,
+    patch,
+)
+import unittest
+
+
+class SubscriptionPlacementTest(unittest.TestCase):
+
+    def setUp(self):
+        self.subscription_placement = SubscriptionPlacement(1)
+        self.need = {SubscriptionPlacement.CORES: 4,
+                     SubscriptionPlacement.CLOUD_SERVICES: 1,
+                     SubscriptionPlacement.STORAGE_ACCOUNTS: 0}
+        self.headroom = {
+            1: {SubscriptionPlacement.CORES: 4,
+                SubscriptionPlacement.CLOUD_SERVICES: 5,
+                SubscriptionPlacement.STORAGE_ACCOUNTS: 5},
+            2: {SubscriptionPlacement.CORES: 40,
+                SubscriptionPlacement.CLOUD_SERVICES: 5,
+                SubscriptionPlacement.STORAGE_ACCOUNTS: 0},
+        }
+        self.subscription_placement.get_need = Mock(side_effect=lambda template_units, azure_key_id: self.need)
+        self.subscription_placement.get_headroom = Mock(side_effect=lambda azure_key_id, need:
+                                                        self.headroom[azure_key_id])
+
+    def tearDown(self):
+        pass
+
+    @patch('src.azureformation.azureoperation.placement.update_experiment_azure_key')
+    @patch('src.azureformation.azureoperation.placement.load_template_from_experiment')
+    @patch('src.azureformation.azureoperation.placement.db_adapter')
+    def test_place(self, db_adapter, load_template_from_experiment, update_experiment_azure_key):
+        db_adapter.find_all_objects_by.return_value = [Mock(azure_key_id=1), Mock(azure_key_id=2)]
+        db_adapter.count.return_value = 0
+        load_template_from_experiment.return_value = {SubscriptionPlacement.VIRTUAL_ENVIRONMENTS: []}
+        self.assertEqual(self.subscription_placement.place(7), 2)
+        update_experiment_azure_key.assert_called_once_with(7, 2)
+        # experiment needing nothing fits any subscription
+        self.need = dict.fromkeys(self.need, 0)
+        self.assertEqual(self.subscription_placement.place(7), 1)
+        # no subscription has enough cores
+        self.need[SubscriptionPlacement.CORES] = 41
+        self.assertIsNone(self.subscription_placement.place(7))
+
+    @patch('src.azureformation.azureoperation.azureFormation.SubscriptionPlacement')
+    @patch('src.azureformation.azureoperation.azureFormation.commit_azure_log')
+    @patch('src.azureformation.azureoperation.azureFormation.db_adapter')
+    def test_create_without_hackathon(self, db_adapter, commit_azure_log, subscription_placement):
+        db_adapter.get_object.return_value = Mock(warm_pool_id=1, hackathon_id=None)
+        AzureFormation().create(7)
+        # experiment fails instead of staying in init
+        self.assertEqual(commit_azure_log.call_args[0][0], 7)
+        self.assertEqual(commit_azure_log.call_args[0][3], AzureFormation.NO_SUBSCRIPTION % 7)
+        self.assertFalse(subscription_placement.called)
+
+    def test_get_capacity(self):
+        self.assertEqual(self.subscription_placement.get_capacity([], 2), 10)
+        # no cloud service left for the experiment
+        self.headroom[2][SubscriptionPlacement.CLOUD_SERVICES] = 0
+        self.assertEqual(self.subscription_placement.get_capacity([], 2), 0)
+
+
+class StoragePlacementTest(unittest.TestCase):
+
+    def setUp(self):
+        self.storage_placement = StoragePlacement(1)
+        self.template_unit = Mock()
+        self.template_unit.is_vm_image.return_value = False
+        self.template_unit.get_storage_account_name.return_value = 'ossvhds'
+        self.template_unit.get_virtual_machine_name.return_value = 'vm'
+
+    def tearDown(self):
+        pass
+
+    def test_get_pool(self):
+        pool = self.storage_placement.get_pool('a' * 24)
+        self.assertEqual(len(pool), StoragePlacement.MAX_ACCOUNTS)
+        self.assertEqual(pool[0], 'a' * 24)
+        self.assertEqual(pool[1], 'a' * 23 + '1')
+        self.assertTrue(all(len(name) <= 24 for name in pool))
+
+    @patch('src.azureformation.azureoperation.placement.get_virtual_machine_name', return_value='vm-1')
+    @patch('src.azureformation.azureoperation.placement.commit_azure_virtual_hard_disk')
+    @patch('src.azureformation.azureoperation.placement.contain_azure_storage_account')
+    @patch('src.azureformation.azureoperation.placement.count_azure_virtual_hard_disk')
+    def test_place_least_loaded(self, count, contain, commit, get_virtual_machine_name):
+        disks = {'ossvhds': 30, 'ossvhds1': 5}
+        count.side_effect = lambda name: disks.get(name, 0)
+        contain.side_effect = lambda name: name in disks
+        self.assertEqual(self.storage_placement.place(1, self.template_unit), 'ossvhds1')
+        self.template_unit.set_storage_account_name.assert_called_once_with('ossvhds1')
+        self.assertEqual(commit.call_count, 1)
+
+    @patch('src.azureformation.azureoperation.placement.get_virtual_machine_name', return_value='vm-1')
+    @patch('src.azureformation.azureoperation.placement.commit_azure_virtual_hard_disk')
+    @patch('src.azureformation.azureoperation.placement.contain_azure_storage_account')
+    @patch('src.azureformation.azureoperation.placement.count_azure_virtual_hard_disk')
+    def test_place_new_when_full(self, count, contain, commit, get_virtual_machine_name):
+        disks = {'ossvhds': StoragePlacement.MAX_DISKS}
+        count.side_effect = lambda name: disks.get(name, 0)
+        contain.side_effect = lambda name: name in disks
+        self.assertEqual(self.storage_placement.place(1, self.template_unit), 'ossvhds1')
+
+
+class CloudServicePlacementTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cloud_service_placement = CloudServicePlacement(1)
+        self.template_unit = Mock()
+        self.template_unit.get_cloud_service_name.return_value = 'ot-service'
+        self.template_unit.get_deployment_slot.return_value = 'production'
+        self.template_unit.get_input_endpoint_count.return_value = 3
+        self.template_unit.get_virtual_machine_name.return_value = 'vm'
+
+    def tearDown(self):
+        pass
+
+    def test_get_pool(self):
+        pool = self.cloud_service_placement.get_pool('ot-service')
+        self.assertEqual(pool[:3], ['ot-service', 'ot-service-1', 'ot-service-2'])
+
+    @patch('src.azureformation.azureoperation.placement.get_virtual_machine_name', return_value='vm-1')
+    @patch('src.azureformation.azureoperation.placement.commit_azure_virtual_machine_placement')
+    @patch('src.azureformation.azureoperation.placement.get_azure_cloud_service_usage')
+    def test_place_first_fit(self, usage, commit, get_virtual_machine_name):
+        used = {
+            'ot-service': (CloudServicePlacement.MAX_ROLES, 10),
+            'ot-service-1': (1, CloudServicePlacement.MAX_ENDPOINTS - 2),
+            'ot-service-2': (1, 3),
+        }
+        usage.side_effect = lambda name, slot: used.get(name, (0, 0))
+        self.assertEqual(self.cloud_service_placement.place(1, self.template_unit), 'ot-service-2')
+        self.template_unit.set_cloud_service_name.assert_called_once_with('ot-service-2')
+        commit.assert_called_once_with('ot-service-2', 'production', 'vm-1', 3, 1)
+
+if __name__ == '__main__':
+    unittest.main()
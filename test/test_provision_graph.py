@@ -0,0 +1,77 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.provisionGraph import (
+    ProvisionGraph,
+)
+from src.azureformation.azureoperation.utility import (
+    TASKS,
+)
+from mock import (
+    Mock,
+    patch,
+)
+import unittest
+
+
+class ProvisionGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def __template_unit(self, storage_account_name, cloud_service_name, vm_image=False):
+        template_unit = Mock()
+        template_unit.get_storage_account_name.return_value = storage_account_name
+        template_unit.get_cloud_service_name.return_value = cloud_service_name
+        template_unit.is_vm_image.return_value = vm_image
+        return template_unit
+
+    def test_compile(self):
+        units = [self.__template_unit('sa', 'cs-1'),
+                 self.__template_unit('sa', 'cs-2'),
+                 self.__template_unit('sa-vm', 'cs-1', True)]
+        storage_account_nodes, cloud_service_nodes = ProvisionGraph(1).compile(units)
+        self.assertEqual(storage_account_nodes, [units[0]])
+        self.assertEqual(cloud_service_nodes, [units[0], units[1]])
+
+    @patch('src.azureformation.azureoperation.provisionGraph.run_job')
+    def test_start(self, run_job):
+        units = [self.__template_unit('sa', 'cs'), self.__template_unit('sa', 'cs')]
+        ProvisionGraph(1).start(7, units)
+        self.assertEqual(run_job.call_count, 2)
+        run_job.assert_any_call(TASKS['StorageAccount.create_storage_account'], (1, ), (7, units[0]))
+        run_job.assert_any_call(TASKS['CloudService.create_cloud_service'], (1, ), (7, units[0]))
+
+    @patch('src.azureformation.azureoperation.provisionGraph.run_job')
+    @patch('src.azureformation.azureoperation.provisionGraph.db_session')
+    @patch('src.azureformation.azureoperation.provisionGraph.db_adapter')
+    @patch('src.azureformation.azureoperation.provisionGraph.Experiment')
+    @patch('src.azureformation.azureoperation.provisionGraph.AzureProvisionJournal')
+    @patch('src.azureformation.azureoperation.provisionGraph.AzureCloudService')
+    @patch('src.azureformation.azureoperation.provisionGraph.AzureStorageAccount')
+    @patch('src.azureformation.azureoperation.provisionGraph.get_virtual_machine_name')
+    @patch('src.azureformation.azureoperation.provisionGraph.TemplateFramework')
+    def test_launch(self, template_framework, get_virtual_machine_name, storage_account, cloud_service, journal,
+                    experiment, db_adapter, db_session, run_job):
+        # vm-0 is launched, vm-1 waits for storage account, vm-2 is ready, vm-3 is from vm image
+        units = [self.__template_unit('sa', 'cs'),
+                 self.__template_unit('sa-new', 'cs'),
+                 self.__template_unit('sa', 'cs'),
+                 self.__template_unit('sa-new', 'cs', True)]
+        template_framework.return_value.get_template_units.return_value = units
+        get_virtual_machine_name.side_effect = ['vm-0', 'vm-1', 'vm-2', 'vm-3']
+        journal.query.filter_by.return_value.all.return_value = [Mock(virtual_machine_name='vm-0')]
+        storage_account.query.filter.return_value.all.return_value = [Mock()]
+        storage_account.query.filter.return_value.all.return_value[0].name = 'sa'
+        cloud_service.query.filter.return_value.all.return_value = [Mock()]
+        cloud_service.query.filter.return_value.all.return_value[0].name = 'cs'
+        self.assertEqual(ProvisionGraph(1).launch(7), 2)
+        self.assertEqual(db_session.add.call_count, 2)
+        db_adapter.commit.assert_called_once_with()
+        run_job.assert_any_call(TASKS['VirtualMachine.create_virtual_machine'], (1, ), (7, units[2]))
+        run_job.assert_any_call(TASKS['VirtualMachine.create_virtual_machine'], (1, ), (7, units[3]))
+
+if __name__ == '__main__':
+    unittest.main()
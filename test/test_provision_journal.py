@@ -0,0 +1,71 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.provisionJournal import (
+    ProvisionJournal,
+)
+from src.azureformation.azureoperation.utility import (
+    TASKS,
+)
+from src.azureformation.enum import (
+    AVMStatus,
+    PJStep,
+)
+from mock import (
+    Mock,
+    patch,
+)
+import unittest
+
+
+class ProvisionJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    @patch('src.azureformation.azureoperation.provisionJournal.run_job')
+    def test_schedule_resume(self, run_job):
+        ProvisionJournal.schedule_resume()
+        # a fixed id, so that resume jobs do not pile up in persistent job store
+        run_job.assert_called_once_with(TASKS['ProvisionJournal.resume'], (), (), ProvisionJournal.RESUME_DELAY,
+                                        ProvisionJournal.RESUME_JOB_ID)
+
+    @patch('src.azureformation.azureoperation.provisionJournal.ProvisionJournal.resume_experiment')
+    @patch('src.azureformation.azureoperation.provisionJournal.db_adapter')
+    @patch('src.azureformation.azureoperation.provisionJournal.get_pending_experiment_ids')
+    def test_resume(self, get_pending_experiment_ids, db_adapter, resume_experiment):
+        get_pending_experiment_ids.return_value = set([7])
+        db_adapter.find_all_objects_by.return_value = [Mock(id=7), Mock(id=8)]
+        self.assertEqual(ProvisionJournal().resume(), 1)
+        self.assertEqual(resume_experiment.call_count, 1)
+
+    @patch('src.azureformation.azureoperation.provisionJournal.ProvisionGraph')
+    @patch('src.azureformation.azureoperation.provisionJournal.run_job')
+    @patch('src.azureformation.azureoperation.provisionJournal.Service')
+    @patch('src.azureformation.azureoperation.provisionJournal.get_virtual_machine_name')
+    @patch('src.azureformation.azureoperation.provisionJournal.get_provision_journal_step')
+    @patch('src.azureformation.azureoperation.provisionJournal.TemplateFramework')
+    def test_resume_experiment(self, template_framework, get_provision_journal_step, get_virtual_machine_name,
+                               service, run_job, provision_graph):
+        units = [Mock(), Mock(), Mock()]
+        template_framework.return_value.get_template_units.return_value = units
+        get_virtual_machine_name.side_effect = ['vm-0', 'vm-1', 'vm-2']
+        get_provision_journal_step.side_effect = [None, PJStep.NETWORK_UPDATED, PJStep.VIRTUAL_MACHINE_READY]
+        service.return_value.get_deployment_name.return_value = 'dn'
+        units[1].get_cloud_service_name.return_value = 'cs'
+        ProvisionJournal().resume_experiment(Mock(id=7, azure_key_id=1))
+        provision_graph.return_value.start.assert_called_once_with(7, [units[0]])
+        self.assertEqual(run_job.call_count, 1)
+        self.assertEqual(run_job.call_args[0][2][:5],
+                         ('cs', 'dn', 'vm-1', AVMStatus.READY_ROLE,
+                          TASKS['VirtualMachine.create_virtual_machine_vm_true_2']))
+
+    @patch('src.azureformation.azureoperation.provisionJournal.run_job')
+    def test_resume_experiment_not_placed(self, run_job):
+        ProvisionJournal().resume_experiment(Mock(id=7, azure_key_id=None))
+        run_job.assert_called_once_with(TASKS['AzureFormation.create'], (), (7, ))
+
+if __name__ == '__main__':
+    unittest.main()
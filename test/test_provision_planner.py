@@ -0,0 +1,41 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.provisionPlanner import (
+    ProvisionPlanner,
+)
+from mock import (
+    Mock,
+    patch,
+)
+from datetime import (
+    datetime,
+    timedelta,
+)
+import unittest
+
+
+class ProvisionPlannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.start_time = datetime.utcnow() + timedelta(days=1)
+
+    def tearDown(self):
+        pass
+
+    @patch('src.azureformation.azureoperation.provisionPlanner.run_job')
+    @patch('src.azureformation.azureoperation.provisionPlanner.SubscriptionPlacement')
+    @patch('src.azureformation.azureoperation.provisionPlanner.load_template')
+    @patch('src.azureformation.azureoperation.provisionPlanner.db_adapter')
+    def test_plan(self, db_adapter, load_template, placement, run_job):
+        db_adapter.find_all_objects_by.return_value = [Mock(azure_key_id=1), Mock(azure_key_id=2)]
+        load_template.return_value = {ProvisionPlanner.VIRTUAL_ENVIRONMENTS: [{}]}
+        placement.return_value.get_capacity.return_value = 30
+        plan = ProvisionPlanner(1).plan(1, 100, self.start_time)
+        # cut down to quota
+        self.assertEqual(plan[-1][1], 60)
+        self.assertEqual(len(plan), run_job.call_count)
+        self.assertTrue(all(b[0] > a[0] and b[1] > a[1] for a, b in zip(plan, plan[1:])))
+        self.assertLessEqual(plan[-1][0], self.start_time - timedelta(seconds=ProvisionPlanner.LEAD_TIME))
+
+if __name__ == '__main__':
+    unittest.main()
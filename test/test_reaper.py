@@ -0,0 +1,43 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.reaper import (
+    Reaper,
+)
+from src.azureformation.azureoperation.utility import (
+    TASKS,
+)
+from src.azureformation.enum import (
+    AVMStatus,
+)
+from mock import (
+    Mock,
+    patch,
+)
+import unittest
+
+
+class ReaperTest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    @patch('src.azureformation.azureoperation.reaper.metrics')
+    @patch('src.azureformation.azureoperation.reaper.run_job')
+    @patch('src.azureformation.azureoperation.reaper.is_azure_operation_pending')
+    @patch('src.azureformation.azureoperation.reaper.db_adapter')
+    @patch('src.azureformation.azureoperation.reaper.Experiment')
+    def test_reap(self, experiment, db_adapter, is_azure_operation_pending, run_job, metrics):
+        idle = Mock(id=7, azure_key_id=1)
+        stopping = Mock(id=8, azure_key_id=1)
+        query = experiment.query.filter.return_value
+        query.order_by.return_value.limit.return_value.all.return_value = [idle, stopping]
+        # experiment 8 has a stop in progress
+        is_azure_operation_pending.side_effect = [False, True]
+        self.assertEqual(Reaper().reap(), 1)
+        run_job.assert_called_once_with(TASKS['AzureFormation.stop'], (1, ), (7, AVMStatus.STOPPED_DEALLOCATED))
+
+if __name__ == '__main__':
+    unittest.main()
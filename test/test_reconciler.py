@@ -0,0 +1,71 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.reconciler import (
+    Reconciler,
+)
+from src.azureformation.enum import (
+    AVMStatus,
+    EStatus,
+    VEStatus,
+)
+from mock import (
+    Mock,
+    patch,
+)
+import unittest
+
+
+class ReconcilerTest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def __row(self, id, name, status, experiment_id, cloud_service_name):
+        row = Mock(id=id, status=status, experiment_id=experiment_id, virtual_environment_id=id + 100,
+                   cloud_service_name=cloud_service_name, azure_key_id=1)
+        row.name = name
+        return row
+
+    @patch('src.azureformation.azureoperation.reconciler.check_experiment_done')
+    @patch('src.azureformation.azureoperation.reconciler.VirtualEnvironment')
+    @patch('src.azureformation.azureoperation.reconciler.AzureVirtualMachine')
+    @patch('src.azureformation.azureoperation.reconciler.db_adapter')
+    @patch('src.azureformation.azureoperation.reconciler.is_azure_operation_pending')
+    @patch('src.azureformation.azureoperation.reconciler.db_session')
+    @patch('src.azureformation.azureoperation.reconciler.Service')
+    def test_reconcile(self, service, db_session, is_azure_operation_pending, db_adapter, avm, ve,
+                       check_experiment_done):
+        rows = [self.__row(1, 'vm-1', AVMStatus.READY_ROLE, 7, 'cs'),
+                self.__row(2, 'vm-2', AVMStatus.READY_ROLE, 7, 'cs'),
+                self.__row(3, 'vm-3', AVMStatus.READY_ROLE, 8, 'cs')]
+        db_session.query.return_value.join.return_value.join.return_value.join.return_value.filter.return_value. \
+            all.return_value = rows
+        is_azure_operation_pending.return_value = False
+        service.return_value.get_hosted_service_summary.return_value = ([], {
+            'vm-1': (AVMStatus.STOPPED_VM, '10.0.0.4', '1.2.3.4'),
+            'vm-2': (AVMStatus.READY_ROLE, '10.0.0.5', '1.2.3.4'),
+            'vm-3': ('StoppingVM', '10.0.0.6', '1.2.3.4')})
+        self.assertEqual(Reconciler().reconcile(), 1)
+        # one call per cloud service
+        service.return_value.get_hosted_service_summary.assert_called_once_with('cs')
+        self.assertEqual(avm.query.filter.return_value.update.call_count, 1)
+        ve.query.filter.return_value.update.assert_called_once_with({'status': VEStatus.Stopped},
+                                                                    synchronize_session=False)
+        check_experiment_done.assert_any_call(7, EStatus.Stopped)
+
+    @patch('src.azureformation.azureoperation.reconciler.db_adapter')
+    @patch('src.azureformation.azureoperation.reconciler.is_azure_operation_pending')
+    @patch('src.azureformation.azureoperation.reconciler.db_session')
+    @patch('src.azureformation.azureoperation.reconciler.Service')
+    def test_reconcile_pending(self, service, db_session, is_azure_operation_pending, db_adapter):
+        db_session.query.return_value.join.return_value.join.return_value.join.return_value.filter.return_value. \
+            all.return_value = [self.__row(1, 'vm-1', AVMStatus.READY_ROLE, 7, 'cs')]
+        is_azure_operation_pending.return_value = True
+        self.assertEqual(Reconciler().reconcile(), 0)
+        self.assertFalse(service.called)
+
+if __name__ == '__main__':
+    unittest.main()
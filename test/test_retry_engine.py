@@ -0,0 +1,62 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.retryEngine import (
+    RetryEngine,
+)
+from src.azureformation.azureoperation.rateLimiter import (
+    CircuitOpenError,
+    RateLimitError,
+)
+from src.azureformation.enum import (
+    AzureErrorType,
+)
+from mock import (
+    Mock,
+    patch,
+)
+import unittest
+
+
+class RetryEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_classify(self):
+        self.assertEqual(RetryEngine.classify(Exception('Conflict (Conflict) - Windows Azure is currently '
+                                                        'performing an operation on x')),
+                         AzureErrorType.CONFLICT)
+        self.assertEqual(RetryEngine.classify(Exception('Service Unavailable')), AzureErrorType.THROTTLING)
+        self.assertEqual(RetryEngine.classify(RateLimitError()), AzureErrorType.THROTTLING)
+        self.assertEqual(RetryEngine.classify(Exception('Internal Server Error')), AzureErrorType.INTERNAL_ERROR)
+        self.assertEqual(RetryEngine.classify(Exception('Not found (Not Found)')), AzureErrorType.NOT_FOUND)
+        self.assertEqual(RetryEngine.classify(CircuitOpenError()), AzureErrorType.CIRCUIT_OPEN)
+        self.assertEqual(RetryEngine.classify(Exception('Bad Request')), AzureErrorType.OTHER)
+        # permanent conflict
+        self.assertEqual(RetryEngine.classify(Exception('Conflict (Conflict) - The specified DNS name is already '
+                                                        'taken.')),
+                         AzureErrorType.OTHER)
+
+    def test_is_retryable(self):
+        self.assertTrue(RetryEngine.is_retryable(Exception('Too Many Requests')))
+        self.assertFalse(RetryEngine.is_retryable(Exception('Not found (Not Found)')))
+
+    @patch('src.azureformation.azureoperation.retryEngine.run_job')
+    @patch('src.azureformation.azureoperation.retryEngine.metrics')
+    @patch('src.azureformation.azureoperation.retryEngine.commit_azure_log')
+    @patch('src.azureformation.azureoperation.retryEngine.db_adapter')
+    @patch('src.azureformation.azureoperation.retryEngine.CircuitBreaker')
+    def test_retry_float_base_delay(self, circuit_breaker, db_adapter, commit_azure_log, metrics, run_job):
+        db_adapter.count.return_value = 1
+        task = Mock()
+        with patch.object(RetryEngine, 'BASE_DELAY', 2.5):
+            self.assertTrue(RetryEngine(1).retry(7, 'create', 'storage account', 'sa', Exception('Timed out'),
+                                                 task, (1, ), (7, )))
+        delay = run_job.call_args[0][3]
+        self.assertTrue(isinstance(delay, int) and 2 <= delay <= 5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.utility import (
+    TASKS,
+    get_job_key,
+    run_job,
+)
+from src.azureformation.scheduler import (
+    EXECUTOR_POLL,
+    EXECUTOR_MUTATION,
+)
+from mock import (
+    patch,
+)
+import unittest
+
+
+class RunJobTest(unittest.TestCase):
+
+    def setUp(self):
+        self.task = TASKS['Service.query_async_operation_status']
+        self.func_args = ('r', TASKS['StorageAccount.create_storage_account_async_true'], (1, ), (7, None),
+                          TASKS['StorageAccount.create_storage_account_async_false'], (1, ), (7, None))
+        self.job_id = get_job_key(self.task, (1, ), self.func_args)
+
+    def tearDown(self):
+        pass
+
+    @patch('src.azureformation.azureoperation.utility.is_job_cancelled', return_value=False)
+    @patch('src.azureformation.azureoperation.utility.is_overloaded', return_value=False)
+    @patch('src.azureformation.azureoperation.utility.scheduler')
+    def test_run_job_poll(self, scheduler, is_overloaded, is_job_cancelled):
+        # poll job queued before overload gets the stable id too, and replaces its duplicate
+        run_job(self.task, (1, ), self.func_args)
+        kwargs = scheduler.add_job.call_args[1]
+        self.assertEqual(kwargs['id'], self.job_id)
+        self.assertTrue(kwargs['replace_existing'])
+        self.assertEqual(kwargs['executor'], EXECUTOR_POLL)
+
+    @patch('src.azureformation.azureoperation.utility.is_job_cancelled', return_value=False)
+    @patch('src.azureformation.azureoperation.utility.is_overloaded', return_value=True)
+    @patch('src.azureformation.azureoperation.utility.scheduler')
+    def test_run_job_poll_overloaded(self, scheduler, is_overloaded, is_job_cancelled):
+        run_job(self.task, (1, ), self.func_args)
+        scheduler.get_job.assert_called_once_with(self.job_id)
+        self.assertFalse(scheduler.add_job.called)
+        # no duplicate pending
+        scheduler.get_job.return_value = None
+        run_job(self.task, (1, ), self.func_args)
+        self.assertEqual(scheduler.add_job.call_args[1]['id'], self.job_id)
+
+    @patch('src.azureformation.azureoperation.utility.is_job_cancelled', return_value=False)
+    @patch('src.azureformation.azureoperation.utility.scheduler')
+    def test_run_job_mutation(self, scheduler, is_job_cancelled):
+        run_job(TASKS['AzureFormation.create'], (1, ), (7, ))
+        self.assertIsNone(scheduler.add_job.call_args[1]['id'])
+        # continuation updating network config of vm image calls azure mutation
+        run_job(TASKS['VirtualMachine.create_virtual_machine_vm_true_1'], (1, ), (7, None))
+        self.assertEqual(scheduler.add_job.call_args[1]['executor'], EXECUTOR_MUTATION)
+        # job of given id replaces pending one
+        run_job(TASKS['ProvisionJournal.resume'], (), (), 30, 'resume')
+        kwargs = scheduler.add_job.call_args[1]
+        self.assertEqual(kwargs['id'], 'resume')
+        self.assertTrue(kwargs['replace_existing'])
+
+
+if __name__ == '__main__':
+    unittest.main()
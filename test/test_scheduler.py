@@ -0,0 +1,63 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.scheduler import (
+    JOB_QUEUE_DEPTH,
+    JOB_LAST_LAG,
+    OVERLOAD_QUEUE_DEPTH,
+    OVERLOAD_LAG,
+    LAG_WINDOW,
+    samples,
+    is_overloaded,
+)
+from src.azureformation.metrics import (
+    metrics,
+)
+from mock import (
+    patch,
+)
+import unittest
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        samples[JOB_QUEUE_DEPTH] = 0
+        samples[JOB_LAST_LAG] = 0
+        metrics.gauge(JOB_LAST_LAG, 0)
+
+    def tearDown(self):
+        samples[JOB_QUEUE_DEPTH] = 0
+        samples[JOB_LAST_LAG] = 0
+        metrics.gauge(JOB_QUEUE_DEPTH, 0)
+        metrics.gauge(JOB_LAST_LAG, 0)
+
+    @patch('src.azureformation.scheduler.time')
+    @patch('src.azureformation.scheduler.scheduler')
+    def test_queue_depth_from_job_store(self, scheduler, time):
+        time.time.return_value = 1000
+        scheduler.get_jobs.return_value = range(OVERLOAD_QUEUE_DEPTH)
+        self.assertTrue(is_overloaded())
+        # sampled, not read again within DEPTH_SAMPLE seconds
+        scheduler.get_jobs.return_value = []
+        self.assertTrue(is_overloaded())
+        self.assertEqual(scheduler.get_jobs.call_count, 1)
+        # replaced jobs are not counted twice
+        time.time.return_value = 2000
+        self.assertFalse(is_overloaded())
+        self.assertEqual(metrics.get_gauge(JOB_QUEUE_DEPTH), 0)
+
+    @patch('src.azureformation.scheduler.time')
+    @patch('src.azureformation.scheduler.scheduler')
+    def test_lag_expires(self, scheduler, time):
+        scheduler.get_jobs.return_value = []
+        time.time.return_value = 1000
+        samples[JOB_LAST_LAG] = 1000
+        metrics.gauge(JOB_LAST_LAG, OVERLOAD_LAG)
+        self.assertTrue(is_overloaded())
+        # no job submitted since
+        time.time.return_value = 1000 + LAG_WINDOW
+        self.assertFalse(is_overloaded())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,9 @@ __author__ = 'Yifu Huang'
 from src.azureformation.azureoperation.service import (
     Service,
 )
+from src.azureformation.azureoperation.rateLimiter import (
+    CircuitOpenError,
+)
 from src.azureformation.database.models import (
     AzureKey,
 )
@@ -19,9 +22,6 @@ from azure.servicemanagement import (
     InstanceEndpoint,
     PersistentVMRole,
     ConfigurationSet,
-    HostedService,
-    Role,
-    ConfigurationSetInputEndpoint,
     Operation,
 )
 import unittest
@@ -41,6 +41,11 @@ class ServiceTest(unittest.TestCase):
                                                           management_host=management_host)
             azure_key_id = 0
             self.service = Service(azure_key_id)
+        self.service.rate_limiter = Mock()
+        self.service.circuit_breaker = Mock()
+        self.service.circuit_breaker.get_open_seconds.return_value = 0
+        self.service.inventory = None
+        self.service.single_flight = None
 
     def tearDown(self):
         pass
@@ -75,6 +80,12 @@ class ServiceTest(unittest.TestCase):
         self.assertTrue(self.service.deployment_exists(name, slot))
         self.service.get_deployment_by_slot.side_effect = Exception
         self.assertFalse(self.service.deployment_exists(name, slot))
+        # answer of azure is recorded in inventory
+        self.service.inventory = Mock()
+        self.service.inventory.deployment_exists.return_value = None
+        self.service.get_deployment_by_slot.side_effect = Exception(Service.NOT_FOUND)
+        self.assertFalse(self.service.deployment_exists(name, slot))
+        self.service.inventory.set_deployment.assert_called_once_with(name, slot, None)
 
     def test_wait_for_deployment(self):
         cs_name = 'dhsj23'
@@ -98,6 +109,18 @@ class ServiceTest(unittest.TestCase):
         d.role_instance_list = [r]
         self.assertEqual(self.service.get_virtual_machine_instance_status(d, vm_name), AVMStatus.READY_ROLE)
 
+    def test_get_virtual_machines_instance_status(self):
+        d = Deployment()
+        vm_names = ['dghu34', 'dghu35']
+        r = RoleInstance()
+        r.instance_name = vm_names[0]
+        r.instance_status = AVMStatus.STOPPED_DEALLOCATED
+        d.role_instance_list = [r]
+        self.assertEqual(self.service.get_virtual_machines_instance_status(d, vm_names),
+                         {vm_names[0]: AVMStatus.STOPPED_DEALLOCATED, vm_names[1]: None})
+        self.assertEqual(self.service.get_virtual_machines_instance_status(None, vm_names),
+                         {vm_names[0]: None, vm_names[1]: None})
+
     def test_wait_for_virtual_machine(self):
         cs_name = 'dsandj2'
         dm_name = 'dshudu2'
@@ -192,20 +215,76 @@ class ServiceTest(unittest.TestCase):
         self.service.get_virtual_machine.return_value = p
         self.assertEqual(self.service.get_virtual_machine_network_config(cs_name, dm_name, vm_name), c)
 
+    HOSTED_SERVICE_XML = '''<?xml version="1.0" encoding="utf-8"?>
+<HostedService xmlns="http://schemas.microsoft.com/windowsazure">
+  <ServiceName>dsfsd</ServiceName>
+  <Deployments>
+    <Deployment>
+      <Name>dsfsd</Name>
+      <RoleInstanceList>
+        <RoleInstance>
+          <RoleName>vm-1</RoleName>
+          <InstanceName>vm-1</InstanceName>
+          <InstanceStatus>ReadyRole</InstanceStatus>
+          <IpAddress>10.0.0.4</IpAddress>
+          <InstanceEndpoints>
+            <InstanceEndpoint>
+              <Name>http</Name>
+              <Vip>1.2.3.4</Vip>
+              <PublicPort>80</PublicPort>
+              <LocalPort>80</LocalPort>
+              <Protocol>tcp</Protocol>
+            </InstanceEndpoint>
+          </InstanceEndpoints>
+        </RoleInstance>
+      </RoleInstanceList>
+      <RoleList>
+        <Role>
+          <RoleName>vm-1</RoleName>
+          <ConfigurationSets>
+            <ConfigurationSet>
+              <ConfigurationSetType>LinuxProvisioningConfiguration</ConfigurationSetType>
+            </ConfigurationSet>
+            <ConfigurationSet>
+              <ConfigurationSetType>NetworkConfiguration</ConfigurationSetType>
+              <InputEndpoints>
+                <InputEndpoint>
+                  <LocalPort>80</LocalPort>
+                  <Name>http</Name>
+                  <Port>80</Port>
+                  <Protocol>tcp</Protocol>
+                </InputEndpoint>
+                <InputEndpoint>
+                  <LocalPort>22</LocalPort>
+                  <Name>ssh</Name>
+                  <Port>10022</Port>
+                  <Protocol>tcp</Protocol>
+                </InputEndpoint>
+              </InputEndpoints>
+            </ConfigurationSet>
+          </ConfigurationSets>
+        </Role>
+      </RoleList>
+    </Deployment>
+  </Deployments>
+</HostedService>'''
+
     def test_get_assigned_endpoints(self):
         cs_name = 'dsfsd'
-        self.service.get_hosted_service_properties = Mock()
-        i = ConfigurationSetInputEndpoint('http', 'tcp', '80', '80')
-        c = ConfigurationSet()
-        c.input_endpoints.input_endpoints = [i]
-        r = Role()
-        r.configuration_sets.configuration_sets = [c]
-        d = Deployment()
-        d.role_list.roles = [r]
-        h = HostedService()
-        h.deployments.deployments = [d]
-        self.service.get_hosted_service_properties.return_value = h
-        self.assertEqual(len(self.service.get_assigned_endpoints(cs_name)), 1)
+        # http layer, so that calls of sdk above it are checked
+        self.service._perform_request = Mock()
+        self.service._perform_request.return_value.body = self.HOSTED_SERVICE_XML
+        self.assertEqual(self.service.get_assigned_endpoints(cs_name), [80, 10022])
+        request = self.service._perform_request.call_args[0][0]
+        self.assertEqual(request.method, 'GET')
+        self.assertIn(cs_name + '?embed-detail=true', request.path)
+
+    def test_get_hosted_service_summary(self):
+        cs_name = 'dsfsd'
+        self.service._perform_request = Mock()
+        self.service._perform_request.return_value.body = self.HOSTED_SERVICE_XML
+        ports, role_instances = self.service.get_hosted_service_summary(cs_name)
+        self.assertEqual(role_instances, {'vm-1': (AVMStatus.READY_ROLE, '10.0.0.4', '1.2.3.4')})
 
     def test_wait_for_async(self):
         r_id = 1
@@ -216,8 +295,41 @@ class ServiceTest(unittest.TestCase):
         o.status = 'InProgress'
         self.service.get_operation_status.return_value = o
         self.assertFalse(self.service.wait_for_async(r_id, sec, loop))
+        # in-flight slot is released on time out too
+        self.service.rate_limiter.release.assert_called_once_with(r_id)
         o.status = 'Succeeded'
         self.assertTrue(self.service.wait_for_async(r_id, sec, loop))
 
+    def test_governed_mutation(self):
+        cs_name = 'fdj4h'
+        dm_name = 'gh5jd'
+        vm_name = 'dfg4s'
+        o = Operation()
+        o.request_id = 'fd9sd8f7'
+        with mock.patch('azure.servicemanagement.ServiceManagementService.start_role') as start_role:
+            start_role.return_value = o
+            self.assertEqual(self.service.start_virtual_machine(cs_name, dm_name, vm_name), o)
+            self.service.rate_limiter.bind.assert_called_with(self.service.rate_limiter.acquire.return_value,
+                                                              o.request_id)
+            start_role.side_effect = Exception('Too Many Requests')
+            self.assertRaises(Exception, self.service.start_virtual_machine, cs_name, dm_name, vm_name)
+            self.service.rate_limiter.release_slot.assert_called_with(self.service.rate_limiter.acquire.return_value)
+            self.assertTrue(self.service.rate_limiter.throttled.called)
+            self.service.circuit_breaker.record.assert_called_with(True)
+            self.service.circuit_breaker.get_open_seconds.return_value = 30
+            self.assertRaises(CircuitOpenError, self.service.start_virtual_machine, cs_name, dm_name, vm_name)
+
+    def test_delete_deployment(self):
+        cs_name = 'fdj4h'
+        dm_name = 'gh5jd'
+        o = Operation()
+        o.request_id = 'fd9sd8f7'
+        self.service.circuit_breaker.get_open_seconds.return_value = 0
+        with mock.patch('azure.servicemanagement.ServiceManagementService.delete_deployment') as delete_deployment:
+            delete_deployment.return_value = o
+            self.assertEqual(self.service.delete_deployment(cs_name, dm_name), o)
+            # virtual hard disk blobs are deleted with deployment
+            delete_deployment.assert_called_with(cs_name, dm_name, delete_vhd=True)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,78 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.singleFlight import (
+    SingleFlight,
+)
+from mock import (
+    Mock,
+)
+from threading import (
+    Event,
+    Thread,
+)
+import time
+import unittest
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight(1)
+        self.entered = Event()
+        self.release = Event()
+
+    def tearDown(self):
+        pass
+
+    def __read(self, result):
+        self.entered.set()
+        self.release.wait()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def __call(self, read, results):
+        try:
+            results.append(self.single_flight.do(('get_deployment_by_name', 'cs', 'dm'), read))
+        except Exception as e:
+            results.append(e)
+
+    def __run(self, read):
+        results = []
+        leader = Thread(target=self.__call, args=(read, results))
+        leader.start()
+        self.entered.wait()
+        followers = [Thread(target=self.__call, args=(read, results)) for i in range(4)]
+        for follower in followers:
+            follower.start()
+        # followers are waiting for the read in flight
+        time.sleep(0.1)
+        self.release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        return results
+
+    def test_do(self):
+        read = Mock(side_effect=lambda: self.__read('deployment'))
+        self.assertEqual(self.__run(read), ['deployment'] * 5)
+        self.assertEqual(read.call_count, 1)
+        self.assertEqual(self.single_flight.flights, {})
+        # nothing is kept once the read completes
+        self.assertEqual(self.single_flight.do(('get_deployment_by_name', 'cs', 'dm'), read), 'deployment')
+        self.assertEqual(read.call_count, 2)
+
+    def test_do_error(self):
+        error = Exception('Not found (Not Found)')
+        read = Mock(side_effect=lambda: self.__read(error))
+        self.assertEqual(self.__run(read), [error] * 5)
+        self.assertEqual(read.call_count, 1)
+
+    def test_do_different_keys(self):
+        read = Mock(return_value='deployment')
+        self.single_flight.do(('get_deployment_by_name', 'cs', 'dm-1'), read)
+        self.single_flight.do(('get_deployment_by_name', 'cs', 'dm-2'), read)
+        self.assertEqual(read.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
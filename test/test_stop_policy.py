@@ -0,0 +1,53 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.stopPolicy import (
+    StopPolicy,
+)
+from src.azureformation.enum import (
+    AVMStatus,
+)
+from mock import (
+    patch,
+)
+from datetime import (
+    datetime,
+)
+import unittest
+
+
+class StopPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stop_policy = StopPolicy(1)
+
+    def tearDown(self):
+        pass
+
+    def test_get_expected_gap(self):
+        with patch.object(StopPolicy, 'get_gaps') as get_gaps:
+            get_gaps.return_value = []
+            self.assertIsNone(self.stop_policy.get_expected_gap(7, 12))
+            # short gaps around noon, long gaps overnight
+            get_gaps.return_value = [(12, 600), (13, 900), (11, 300), (23, 30000), (0, 36000), (22, 32000)]
+            self.assertEqual(self.stop_policy.get_expected_gap(7, 12), 600)
+            self.assertEqual(self.stop_policy.get_expected_gap(7, 23), 32000)
+
+    def test_choose(self):
+        noon = datetime(2015, 6, 1, 12)
+        midnight = datetime(2015, 6, 1, 0)
+        with patch.object(StopPolicy, 'get_core_usage') as get_core_usage, \
+                patch.object(StopPolicy, 'get_expected_gap') as get_expected_gap:
+            get_core_usage.return_value = 0.5
+            get_expected_gap.return_value = 600
+            self.assertEqual(self.stop_policy.choose(7, noon), AVMStatus.STOPPED)
+            get_core_usage.return_value = 0.9
+            self.assertEqual(self.stop_policy.choose(7, noon), AVMStatus.STOPPED_DEALLOCATED)
+            get_core_usage.return_value = 0.5
+            get_expected_gap.return_value = 7200
+            self.assertEqual(self.stop_policy.choose(7, noon), AVMStatus.STOPPED_DEALLOCATED)
+            get_expected_gap.return_value = None
+            self.assertEqual(self.stop_policy.choose(7, noon), AVMStatus.STOPPED)
+            self.assertEqual(self.stop_policy.choose(7, midnight), AVMStatus.STOPPED_DEALLOCATED)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.subscriptionSync import (
+    SubscriptionSync,
+)
+from src.azureformation.enum import (
+    STORAGE_ACCOUNT,
+)
+from mock import (
+    Mock,
+    patch,
+)
+import unittest
+
+
+class SubscriptionSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def __named(self, name, **kwargs):
+        m = Mock(**kwargs)
+        m.name = name
+        return m
+
+    def __storage_service(self, name, label):
+        return Mock(service_name=name,
+                    storage_service_properties=Mock(description='d', label=label, location='East Asia',
+                                                    status='Created'))
+
+    @patch('src.azureformation.azureoperation.subscriptionSync.AzureSyncFingerprint')
+    @patch('src.azureformation.azureoperation.subscriptionSync.AzureStorageAccount')
+    @patch('src.azureformation.azureoperation.subscriptionSync.db_session')
+    @patch('src.azureformation.azureoperation.subscriptionSync.db_adapter')
+    @patch('src.azureformation.azureoperation.subscriptionSync.Service')
+    def test_sync_storage_accounts(self, service, db_adapter, db_session, asa, fingerprint):
+        fingerprint.side_effect = lambda **kwargs: Mock(fingerprint=None)
+        service.return_value.list_storage_accounts.return_value.storage_services = [
+            self.__storage_service('sa-new', 'new'),
+            self.__storage_service('sa-imported', 'imported'),
+            self.__storage_service('sa-owned', 'owned')]
+        imported = self.__named('sa-imported', experiment_id=None, label='old')
+        owned = self.__named('sa-owned', experiment_id=7, label='old')
+        asa.query.filter.return_value.all.return_value = [imported, owned]
+        fingerprints = {}
+        sync = SubscriptionSync(1)
+        self.assertEqual(sync.sync_storage_accounts(fingerprints), 3)
+        self.assertEqual(asa.call_args[1]['name'], 'sa-new')
+        self.assertEqual(imported.label, 'imported')
+        # storage account created by experiment is left to it
+        self.assertEqual(owned.label, 'old')
+        # unchanged storage accounts are skipped
+        asa.reset_mock()
+        asa.query.filter.return_value.all.return_value = [imported, owned]
+        self.assertEqual(sync.sync_storage_accounts(fingerprints), 0)
+        self.assertFalse(asa.called)
+
+    @patch('src.azureformation.azureoperation.subscriptionSync.AzureSyncFingerprint')
+    @patch('src.azureformation.azureoperation.subscriptionSync.AzureStorageAccount')
+    @patch('src.azureformation.azureoperation.subscriptionSync.db_session')
+    @patch('src.azureformation.azureoperation.subscriptionSync.db_adapter')
+    @patch('src.azureformation.azureoperation.subscriptionSync.Service')
+    def test_sync_storage_accounts_gone(self, service, db_adapter, db_session, asa, fingerprint):
+        service.return_value.list_storage_accounts.return_value.storage_services = []
+        fingerprints = {(STORAGE_ACCOUNT, 'sa-gone'): Mock(fingerprint='f')}
+        self.assertEqual(SubscriptionSync(1).sync_storage_accounts(fingerprints), 0)
+        asa.query.filter.return_value.delete.assert_called_once_with(synchronize_session=False)
+        fingerprint.query.filter.return_value.delete.assert_called_once_with(synchronize_session=False)
+        self.assertEqual(fingerprints, {})
+
+    @patch('src.azureformation.azureoperation.subscriptionSync.AzureSyncFingerprint')
+    @patch('src.azureformation.azureoperation.subscriptionSync.AzureEndpoint')
+    @patch('src.azureformation.azureoperation.subscriptionSync.AzureVirtualMachine')
+    @patch('src.azureformation.azureoperation.subscriptionSync.AzureDeployment')
+    @patch('src.azureformation.azureoperation.subscriptionSync.AzureCloudService')
+    @patch('src.azureformation.azureoperation.subscriptionSync.db_session')
+    @patch('src.azureformation.azureoperation.subscriptionSync.db_adapter')
+    @patch('src.azureformation.azureoperation.subscriptionSync.Service')
+    def test_sync_cloud_services(self, service, db_adapter, db_session, acs, ad, avm, ae, fingerprint):
+        fingerprint.side_effect = lambda **kwargs: Mock(fingerprint=None)
+        service.NETWORK_CONFIGURATION = 'NetworkConfiguration'
+        service.return_value.list_hosted_services.return_value.hosted_services = [
+            Mock(service_name='cs-new'), Mock(service_name='cs-owned')]
+        acs.query.filter.return_value.all.return_value = [self.__named('cs-owned', experiment_id=7)]
+        endpoint = self.__named('ssh', protocol='tcp', port='22', local_port='22')
+        role = Mock(role_name='vm')
+        role.configuration_sets.configuration_sets = [
+            Mock(configuration_set_type='NetworkConfiguration', input_endpoints=Mock(input_endpoints=[endpoint]))]
+        deployment = self.__named('dm', deployment_slot='Production', status='Running', url='http://cs-new/')
+        deployment.role_list.roles = [role]
+        deployment.role_instance_list = [Mock(instance_name='vm', role_name='vm', instance_status='ReadyRole',
+                                              ip_address='10.0.0.4', instance_endpoints=[Mock(vip='1.2.3.4')])]
+        hosted_service = Mock(service_name='cs-new',
+                              hosted_service_properties=Mock(label='l', location='East Asia', status='Created'))
+        hosted_service.deployments.deployments = [deployment]
+        service.return_value.get_hosted_service_properties.return_value = hosted_service
+        fingerprints = {}
+        sync = SubscriptionSync(1)
+        self.assertEqual(sync.sync_cloud_services(fingerprints), 1)
+        # cloud service created by experiment is not fetched
+        service.return_value.get_hosted_service_properties.assert_called_once_with('cs-new', True)
+        self.assertEqual(avm.call_args[1]['deployment'], ad.return_value)
+        self.assertEqual(avm.return_value.public_ip, '1.2.3.4')
+        self.assertEqual(ae.call_args[1]['public_port'], 22)
+        # unchanged cloud service is skipped
+        avm.reset_mock()
+        self.assertEqual(sync.sync_cloud_services(fingerprints), 0)
+        self.assertFalse(avm.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.taskRegistry import (
+    TaskRegistry,
+)
+from src.azureformation.azureoperation.utility import (
+    TASKS,
+)
+from mock import (
+    Mock,
+)
+import pickle
+import unittest
+
+
+class Counter(object):
+    instances = 0
+
+    def __init__(self, azure_key_id):
+        Counter.instances += 1
+        self.azure_key_id = azure_key_id
+
+    def fail(self, message):
+        raise Exception(message)
+
+    def ok(self):
+        pass
+
+
+class TaskRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        Counter.instances = 0
+        self.registry = TaskRegistry()
+        self.ok = self.registry.register(__name__, 'Counter', 'ok', 'db')
+        self.fail = self.registry.register(__name__, 'Counter', 'fail', 'mutation')
+
+    def tearDown(self):
+        pass
+
+    def test_register(self):
+        self.assertIs(self.registry['Counter.ok'], self.ok)
+        self.assertEqual(self.ok.func_name, 'ok')
+        self.assertEqual(self.ok.executor, 'db')
+        self.assertRaises(ValueError, self.registry.register, __name__, 'Counter', 'ok', 'db')
+
+    def test_dispatch(self):
+        self.registry.dispatch(self.ok, (1, ), ())
+        self.registry.dispatch(self.ok, (1, ), ())
+        # instance is reused for the same class arguments
+        self.assertEqual(Counter.instances, 1)
+        self.registry.dispatch(self.ok, (2, ), ())
+        self.assertEqual(Counter.instances, 2)
+
+    def test_dispatch_hook(self):
+        hook = Mock()
+        self.registry.add_hook(hook)
+        self.assertRaises(Exception, self.registry.dispatch, self.fail, (1, ), ('Conflict', ))
+        task, seconds, error = hook.call_args[0]
+        self.assertEqual(task, self.fail)
+        self.assertEqual(str(error), 'Conflict')
+
+    def test_pickle(self):
+        task = TASKS['Service.query_async_operation_status']
+        self.assertIs(pickle.loads(pickle.dumps(task)), task)
+        self.assertEqual(repr(task), 'Task(Service.query_async_operation_status)')
+
+
+if __name__ == '__main__':
+    unittest.main()
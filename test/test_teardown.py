@@ -0,0 +1,132 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.azureFormation import (
+    AzureFormation,
+)
+from src.azureformation.azureoperation.utility import (
+    ASYNC_TICK,
+    TASKS,
+    TEARDOWN_ROLLBACK_DELAY,
+    check_experiment_deleted,
+    get_job_experiment_id,
+    is_async_operation_pending,
+    call_job,
+)
+from src.azureformation.enum import (
+    EStatus,
+)
+from mock import (
+    Mock,
+    patch,
+)
+import unittest
+
+
+class TeardownTest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    @patch('src.azureformation.azureoperation.utility.update_experiment_status')
+    @patch('src.azureformation.azureoperation.utility.db_adapter')
+    def test_check_experiment_deleted(self, db_adapter, update_experiment_status):
+        db_adapter.get_object.return_value = Mock(status=EStatus.Rollbacking)
+        # two virtual machines started deletion, one finished
+        db_adapter.count_by.return_value = 2
+        db_adapter.count.return_value = 1
+        check_experiment_deleted(7)
+        self.assertFalse(update_experiment_status.called)
+        db_adapter.count.return_value = 2
+        db_adapter.count_by.side_effect = [2, 0]
+        check_experiment_deleted(7)
+        update_experiment_status.assert_called_with(7, EStatus.Rollbacked)
+        # a virtual machine failed to delete
+        db_adapter.count_by.side_effect = [2, 1]
+        check_experiment_deleted(7)
+        update_experiment_status.assert_called_with(7, EStatus.Failed)
+
+    @patch('src.azureformation.azureoperation.azureFormation.run_job')
+    @patch('src.azureformation.azureoperation.azureFormation.Experiment')
+    @patch('src.azureformation.azureoperation.azureFormation.db_adapter')
+    def test_rollback_once(self, db_adapter, experiment, run_job):
+        # experiment is already rolled back by another job
+        experiment.query.filter_by.return_value.update.return_value = 0
+        AzureFormation().rollback(7)
+        experiment.query.filter_by.assert_called_with(id=7, status=EStatus.Failed)
+        self.assertFalse(run_job.called)
+
+    @patch('src.azureformation.azureoperation.azureFormation.remove_experiment_jobs')
+    @patch('src.azureformation.azureoperation.azureFormation.run_job')
+    @patch('src.azureformation.azureoperation.azureFormation.Experiment')
+    @patch('src.azureformation.azureoperation.azureFormation.db_adapter')
+    def test_rollback(self, db_adapter, experiment, run_job, remove_experiment_jobs):
+        experiment.query.filter_by.return_value.update.return_value = 1
+        remove_experiment_jobs.return_value = 2
+        AzureFormation().rollback(7)
+        # provisioning steps are stopped before what is provisioned is deleted
+        remove_experiment_jobs.assert_called_once_with(7)
+        run_job.assert_called_once_with(TASKS['AzureFormation.delete'], (), (7, ), TEARDOWN_ROLLBACK_DELAY)
+
+    @patch('src.azureformation.azureoperation.azureFormation.TemplateFramework')
+    @patch('src.azureformation.azureoperation.azureFormation.is_async_operation_pending')
+    @patch('src.azureformation.azureoperation.azureFormation.run_job')
+    @patch('src.azureformation.azureoperation.azureFormation.db_adapter')
+    def test_delete_waits_for_async_operation(self, db_adapter, run_job, is_async_operation_pending,
+                                              template_framework):
+        db_adapter.get_object.return_value = Mock(azure_key_id=1)
+        template_framework.return_value.get_template_units.return_value = []
+        # creation of a role still holds lock of deployment
+        is_async_operation_pending.return_value = True
+        AzureFormation().delete(7)
+        run_job.assert_called_once_with(TASKS['AzureFormation.delete'], (), (7, ), ASYNC_TICK)
+        self.assertFalse(template_framework.called)
+        is_async_operation_pending.return_value = False
+        AzureFormation().delete(7)
+        self.assertTrue(template_framework.called)
+
+    @patch('src.azureformation.azureoperation.utility.scheduler')
+    def test_is_async_operation_pending(self, scheduler):
+        template_unit = Mock()
+        poll = Mock(func=call_job, args=(TASKS['Service.query_async_operation_status'], (1, ),
+                                         ('r',
+                                          TASKS['VirtualMachine.create_virtual_machine_async_true_1'],
+                                          (1, ), (7, template_unit),
+                                          TASKS['VirtualMachine.create_virtual_machine_async_false_1'],
+                                          (1, ), (7, template_unit))))
+        scheduler.get_jobs.return_value = [poll]
+        self.assertTrue(is_async_operation_pending(7))
+        self.assertFalse(is_async_operation_pending(8))
+
+    def test_get_job_experiment_id(self):
+        template_unit = Mock()
+        self.assertEqual(get_job_experiment_id(TASKS['VirtualMachine.create_virtual_machine'], (7, template_unit)), 7)
+        # virtual machine status poll works for experiment of its continuation
+        self.assertEqual(get_job_experiment_id(TASKS['Service.query_virtual_machine_status'],
+                                               ('cs', 'dm', 'vm', 'ReadyRole',
+                                                TASKS['VirtualMachine.create_virtual_machine_vm_true_1'],
+                                                (1, ), (7, template_unit))), 7)
+        # async operation poll releases in-flight slot, teardown is never cancelled
+        self.assertIsNone(get_job_experiment_id(TASKS['Service.query_async_operation_status'],
+                                                ('r',
+                                                 TASKS['VirtualMachine.create_virtual_machine_async_true_1'],
+                                                 (1, ), (7, template_unit),
+                                                 TASKS['VirtualMachine.create_virtual_machine_async_false_1'],
+                                                 (1, ), (7, template_unit))))
+        self.assertIsNone(get_job_experiment_id(TASKS['VirtualMachine.delete_virtual_machines'], (7, [template_unit])))
+
+    @patch.object(TASKS, 'dispatch')
+    @patch('src.azureformation.azureoperation.utility.metrics')
+    @patch('src.azureformation.azureoperation.utility.db_adapter')
+    def test_call_job_of_cancelled_experiment(self, db_adapter, metrics, dispatch):
+        db_adapter.count.return_value = 1
+        call_job(TASKS['VirtualMachine.create_virtual_machine'], (1, ), (7, Mock()))
+        self.assertFalse(dispatch.called)
+        db_adapter.count.return_value = 0
+        call_job(TASKS['VirtualMachine.create_virtual_machine'], (1, ), (7, Mock()))
+        self.assertTrue(dispatch.called)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+__author__ = 'Yifu Huang'
+
+from src.azureformation.azureoperation.warmPool import (
+    WarmPool,
+)
+from src.azureformation.azureoperation.utility import (
+    TASKS,
+    get_virtual_machine_name,
+)
+from src.azureformation.enum import (
+    AVMStatus,
+    EStatus,
+    VEStatus,
+)
+from mock import (
+    Mock,
+    patch,
+)
+import unittest
+
+
+class WarmPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.template_unit = Mock()
+        self.template_unit.get_virtual_machine_name.return_value = 'ot-vm'
+
+    def tearDown(self):
+        pass
+
+    @patch('src.azureformation.azureoperation.utility.db_adapter')
+    def test_get_virtual_machine_name(self, db_adapter):
+        db_adapter.find_all_objects_by.return_value = []
+        self.assertEqual(get_virtual_machine_name(7, self.template_unit), 'ot-vm-7')
+        # virtual machine handed over from warm pool member 3
+        db_adapter.find_all_objects_by.return_value = [Mock(name='other'), Mock()]
+        db_adapter.find_all_objects_by.return_value[0].name = 'other-vm-3'
+        db_adapter.find_all_objects_by.return_value[1].name = 'ot-vm-3'
+        self.assertEqual(get_virtual_machine_name(7, self.template_unit), 'ot-vm-3')
+
+    @patch('src.azureformation.azureoperation.warmPool.run_job')
+    @patch('src.azureformation.azureoperation.warmPool.db_adapter')
+    def test_claim_without_warm_pool(self, db_adapter, run_job):
+        db_adapter.find_first_object_by.return_value = None
+        self.assertFalse(WarmPool(1).claim(7))
+        self.assertFalse(run_job.called)
+
+    @patch('src.azureformation.azureoperation.warmPool.commit_azure_log')
+    @patch('src.azureformation.azureoperation.warmPool.AzureLog')
+    @patch('src.azureformation.azureoperation.warmPool.run_job')
+    @patch('src.azureformation.azureoperation.warmPool.Experiment')
+    @patch('src.azureformation.azureoperation.warmPool.db_adapter')
+    def test_claim(self, db_adapter, experiment, run_job, azure_log, commit_azure_log):
+        e = Mock(template_id=1, hackathon_id=None, azure_key_id=None)
+        db_adapter.get_object.return_value = e
+        db_adapter.find_first_object_by.return_value = Mock(id=5)
+        other = Mock(id=3, azure_key_id=2, status=EStatus.Running)
+        member = Mock(id=4, azure_key_id=1, status=EStatus.Stopped)
+        query = experiment.query.filter.return_value.order_by.return_value.with_for_update.return_value
+        query.all.return_value = [other, member]
+        # a stop of member 3 failed once, but none is in progress
+        azure_log.query.filter.return_value.filter.return_value.count.return_value = 1
+        models = [Mock(), Mock()]
+        with patch.object(WarmPool, 'MEMBER_MODELS', models):
+            self.assertTrue(WarmPool(1).claim(7))
+        # row lock is held until member is rebound, db adapter commits on every call
+        self.assertFalse(db_adapter.count_by.called)
+        self.assertEqual(db_adapter.commit.call_count, 1)
+        # member on another azure subscription is not claimed
+        for model in models:
+            model.query.filter_by.assert_called_once_with(experiment_id=4)
+            model.query.filter_by.return_value.update.assert_called_once_with({'experiment_id': 7},
+                                                                              synchronize_session=False)
+        self.assertEqual(member.status, EStatus.Deleted)
+        self.assertEqual(e.azure_key_id, 1)
+        run_job.assert_any_call(TASKS['AzureFormation.start'], (1, ), (7, ))
+        # any azure subscription if none is requested
+        with patch.object(WarmPool, 'MEMBER_MODELS', []):
+            self.assertTrue(WarmPool().claim(8))
+        self.assertEqual(other.status, EStatus.Deleted)
+        # ready member being deallocated is skipped
+        other.status = EStatus.Running
+        azure_log.query.filter.return_value.filter.return_value.count.side_effect = [1, 0]
+        query.all.return_value = [other]
+        with patch.object(WarmPool, 'MEMBER_MODELS', []):
+            self.assertFalse(WarmPool().claim(9))
+
+    @patch('src.azureformation.azureoperation.warmPool.is_azure_operation_pending')
+    @patch('src.azureformation.azureoperation.warmPool.run_job')
+    @patch('src.azureformation.azureoperation.warmPool.db_session')
+    @patch('src.azureformation.azureoperation.warmPool.db_adapter')
+    @patch('src.azureformation.azureoperation.warmPool.Experiment')
+    @patch('src.azureformation.azureoperation.warmPool.AzureWarmPool')
+    def test_refill(self, azure_warm_pool, experiment, db_adapter, db_session, run_job, is_azure_operation_pending):
+        pool = Mock(id=5, size=3, status=VEStatus.Stopped, azure_key_id=1, template_id=1, hackathon_id=None)
+        azure_warm_pool.query.filter_by.return_value.with_for_update.return_value.first.return_value = pool
+        ready = Mock(id=3, azure_key_id=1, status=EStatus.Running)
+        stopping = Mock(id=4, azure_key_id=1, status=EStatus.Running)
+        experiment.query.filter.return_value.all.return_value = [ready, stopping]
+        experiment.return_value = Mock(id=6)
+        is_azure_operation_pending.side_effect = lambda experiment_id, operation: experiment_id == 4
+        WarmPool(1).refill(5)
+        self.assertEqual(db_session.add.call_count, 1)
+        run_job.assert_any_call(TASKS['AzureFormation.create'], (1, ), (6, ))
+        # ready member is deallocated, unless a stop is in progress
+        run_job.assert_any_call(TASKS['AzureFormation.stop'], (1, ), (3, AVMStatus.STOPPED_DEALLOCATED))
+        self.assertNotIn(((TASKS['AzureFormation.stop'], (1, ), (4, AVMStatus.STOPPED_DEALLOCATED)), ),
+                         run_job.call_args_list)
+        # run again while new member is starting
+        run_job.assert_called_with(TASKS['WarmPool.refill'], (1, ), (5, ), WarmPool.TICK)
+
+if __name__ == '__main__':
+    unittest.main()